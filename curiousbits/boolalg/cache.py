@@ -0,0 +1,325 @@
+# cache of solver results keyed by a canonical hash of the CNF
+#
+# The key must not depend on clause order, literal order or how variables are
+# numbered, so the CNF is first put in a canonical form:
+#
+#   signature refinement: every variable starts coloured by its number of
+#     positive and negative occurrences, then repeatedly a clause is coloured
+#     by the sorted colours (and signs) of its literals and a variable by its
+#     colour and the sorted colours (and signs) of its clauses, until the
+#     number of colours stops growing (the Weisfeiler-Lehman / "naive
+#     refinement" step of graph canonization tools, without the search)
+#
+#   variables are renumbered by final colour, clauses sorted within and
+#   between, and the sha256 of the text is the key
+#
+# The key is of the renumbered CNF itself, so equal keys always mean the same
+# problem and a cached model maps back exactly. Variables refinement cannot
+# tell apart (symmetric instances) keep their original relative order, which
+# can only cost a hit for a renamed copy, never give a wrong answer.
+#
+# Results are kept in memory and optionally on disk, one small JSON file per
+# key, each bounded by least recently used eviction (file mtimes on disk).
+#
+#   cache = SolveCache('/var/tmp/satcache')
+#   solve_cnf(cnf, cache=cache)
+#
+# TEST WITH: python -m curiousbits.boolalg.cache
+
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+# the cnf may grow colours for as many rounds as it has variables (a long
+# chain), past this the order so far is used as is
+MAX_ROUNDS = 32
+
+# renumber colours 0, 1, ... in sorted signature order, so they mean the same
+# whatever the original numbering
+def rank(signatures):
+    ids = {sig: i for (i, sig) in enumerate(sorted(set(signatures)))}
+    return [ids[sig] for sig in signatures]
+
+# returns (key, order) where order[v] is the canonical number of variable v
+#
+# marks: optional {var: int} told apart from the start (eg: which variables
+#   are enumerated over), part of the key
+# tag: optional string mixed into the key, for what is asked of the CNF
+def canonical_form(cnf, marks=None, tag=''):
+    n = cnf.n_vars
+    # xors are clauses with a flag
+    clauses = [(0, list(c)) for c in cnf] + [(1, list(x)) for x in cnf.xors()]
+    marks = marks or {}
+
+    occurs = [[] for v in range(n+1)]
+    for (k, (kind, lits)) in enumerate(clauses):
+        for l in lits:
+            occurs[abs(l)].append((k, l > 0))
+
+    colour = rank([(marks.get(v, -1), sum(s for (k, s) in occurs[v]), sum(not s for (k, s) in occurs[v]))
+        for v in range(n+1)])
+    n_colours = len(set(colour))
+    for i in range(MAX_ROUNDS):
+        clause_colour = rank([(kind, tuple(sorted((colour[abs(l)], l > 0) for l in lits)))
+            for (kind, lits) in clauses])
+        colour = rank([(colour[v], tuple(sorted((clause_colour[k], s) for (k, s) in occurs[v])))
+            for v in range(n+1)])
+        if len(set(colour)) == n_colours:
+            break
+        n_colours = len(set(colour))
+
+    # ties keep the original order
+    by_colour = sorted(range(1, n+1), key=lambda v: (colour[v], v))
+    order = [0] * (n+1)
+    for (i, v) in enumerate(by_colour):
+        order[v] = i + 1
+
+    def renumber(l):
+        return order[l] if l > 0 else -order[-l]
+
+    lines = sorted(('x' if kind else '') + ' '.join(map(str, sorted(map(renumber, lits), key=abs)))
+        for (kind, lits) in clauses)
+    marked = sorted((order[v], m) for (v, m) in marks.items())
+    text = f'{tag}\n{marked}\np {n} {len(clauses)}\n' + '\n'.join(lines)
+    return (hashlib.sha256(text.encode('utf-8')).hexdigest(), order)
+
+# model in the original numbering <-> canonical numbering, both complete
+# lists of literals (variables missing from the model are false)
+def to_canonical(model, order):
+    result = [-c for c in range(1, len(order))]
+    for l in model:
+        c = order[abs(l)]
+        result[c-1] = c if l > 0 else -c
+    return result
+
+def from_canonical(model, order):
+    inverse = [0] * len(order)
+    for (v, c) in enumerate(order):
+        inverse[c] = v
+    result = [-v for v in range(1, len(order))]
+    for l in model:
+        v = inverse[abs(l)]
+        result[v-1] = v if l > 0 else -v
+    return result
+
+#------------------------------------------------------------------------------
+# storage
+#------------------------------------------------------------------------------
+
+# path: directory for the on-disk cache, None for memory only
+# max_entries: entries kept in memory
+# max_disk_entries: files kept in path, once past it the least recently used
+#   go, a tenth more than needed so that listing the directory is rare
+class SolveCache(object):
+    def __init__(self, path=None, max_entries=1024, max_disk_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()
+        self.n_disk = None          # files in path, counted on the first put()
+        self.hits = 0
+        self.misses = 0
+        if path != None:
+            os.makedirs(path, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    # cached value (anything JSON can hold) or None
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+
+        if self.path != None:
+            try:
+                with open(self.filename(key)) as fp:
+                    value = json.load(fp)
+                os.utime(self.filename(key))
+            except (OSError, ValueError):
+                value = None
+            if value != None:
+                self.hits += 1
+                self.remember(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.remember(key, value)
+        if self.path != None:
+            # written whole then renamed, readers never see half a file
+            tmp = self.filename(key) + f'.{os.getpid()}.tmp'
+            with open(tmp, 'w') as fp:
+                json.dump(value, fp)
+            if self.n_disk == None:
+                self.n_disk = len(self.disk_names())
+            if not os.path.exists(self.filename(key)):
+                self.n_disk += 1
+            os.replace(tmp, self.filename(key))
+            # other instances may share path, the count is put right whenever
+            # the directory is listed
+            if self.n_disk > self.max_disk_entries:
+                self.evict_disk()
+
+    def remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def disk_names(self):
+        return [name for name in os.listdir(self.path) if name.endswith('.json')]
+
+    def evict_disk(self):
+        names = self.disk_names()
+        self.n_disk = len(names)
+        if len(names) <= self.max_disk_entries:
+            return
+        def mtime(name):
+            try:
+                return os.path.getmtime(os.path.join(self.path, name))
+            except OSError:
+                return 0
+        names.sort(key=mtime)
+        keep = self.max_disk_entries - self.max_disk_entries // 10
+        for name in names[:len(names) - keep]:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+        self.n_disk = keep
+
+    def clear(self):
+        self.memory.clear()
+        if self.path != None:
+            for name in self.disk_names():
+                os.remove(os.path.join(self.path, name))
+            self.n_disk = 0
+
+#------------------------------------------------------------------------------
+# tests
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import random
+    import tempfile
+
+    from .cnf import CNF
+
+    def random_cnf(rng, n_vars, n_clauses, k=3):
+        cnf = CNF()
+        for i in range(n_vars):
+            cnf.new_var()
+        for i in range(n_clauses):
+            cnf.add_clause([rng.choice([-1, 1]) * v for v in rng.sample(range(1, n_vars+1), k)])
+        return cnf
+
+    # the same problem shuffled: clause order, literal order, numbering
+    def shuffled(rng, cnf):
+        perm = list(range(1, cnf.n_vars+1))
+        rng.shuffle(perm)
+        perm = [0] + perm
+        clauses = [[perm[l] if l > 0 else -perm[-l] for l in c] for c in cnf]
+        for c in clauses:
+            rng.shuffle(c)
+        rng.shuffle(clauses)
+        result = CNF()
+        for i in range(cnf.n_vars):
+            result.new_var()
+        result.add_clauses(clauses)
+        for x in cnf.xors():
+            result.add_xor([perm[l] if l > 0 else -perm[-l] for l in x])
+        return (result, perm)
+
+    rng = random.Random(0)
+    for i in range(20):
+        cnf = random_cnf(rng, 30, 120)
+        if i % 2:
+            cnf.add_xor([1, -2, 3])
+        (key, order) = canonical_form(cnf)
+        assert sorted(order[1:]) == list(range(1, 31))
+        (other, perm) = shuffled(rng, cnf)
+        (key2, order2) = canonical_form(other)
+        assert key == key2
+        # a model maps through the canonical numbering to the renamed copy
+        model = [v if rng.random() < 0.5 else -v for v in range(1, 31)]
+        mapped = from_canonical(to_canonical(model, order), order2)
+        assert mapped == sorted([perm[v] if v > 0 else -perm[-v] for v in model], key=abs)
+        assert from_canonical(to_canonical(model, order), order) == model
+
+    # different problems, marks and tags give different keys
+    cnf = random_cnf(rng, 10, 30)
+    (key, order) = canonical_form(cnf)
+    other = cnf.copy()
+    other.add_clause([1, 2])
+    assert canonical_form(other)[0] != key
+    assert canonical_form(cnf, marks={1: 0})[0] != key
+    assert canonical_form(cnf, tag='all')[0] != key
+
+    # memory LRU
+    cache = SolveCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') == None and cache.get('a') == 1 and cache.get('c') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # disk LRU, shared between instances
+    with tempfile.TemporaryDirectory() as path:
+        cache = SolveCache(path, max_entries=1, max_disk_entries=2)
+        cache.put('a', {'model': [1, -2]})
+        cache.put('b', {'model': None})
+        os.utime(os.path.join(path, 'a.json'), (0, 0))
+        cache.put('c', {'model': []})
+        assert sorted(os.listdir(path)) == ['b.json', 'c.json']
+        again = SolveCache(path)
+        assert again.get('b') == {'model': None} and again.get('a') == None
+        again.clear()
+        assert os.listdir(path) == []
+
+        # the directory is only listed when the count passes the limit
+        cache = SolveCache(path, max_disk_entries=20)
+        listed = []
+        disk_names = cache.disk_names
+        cache.disk_names = lambda: listed.append(1) or disk_names()
+        for i in range(100):
+            cache.put(f'k{i}', i)
+            cache.put(f'k{i}', i)
+            assert len(os.listdir(path)) <= 20
+        assert len(listed) <= 1 + 100 // 2
+        assert SolveCache(path).get('k99') == 99
+
+    # underneath the solvers
+    from .tools import parse_python
+    from .sat_solve import solve, solve_all, solve_cnf, solve_cnf_lits
+
+    cache = SolveCache()
+    cnf = random_cnf(rng, 40, 120)
+    model = solve_cnf_lits(cnf, 'builtin', cache)
+    assert model != None
+    assert solve_cnf_lits(cnf, 'builtin', cache) == model and cache.hits == 1
+    (other, perm) = shuffled(rng, cnf)
+    assert solve_cnf_lits(other, 'builtin', cache) == sorted([perm[v] if v > 0 else -perm[-v] for v in model], key=abs)
+    assert cache.hits == 2
+    cnf.add_clauses([[1], [-1]])
+    assert solve_cnf_lits(cnf, 'builtin', cache) == None and solve_cnf(cnf, 'builtin', cache) == {}
+    assert cache.hits == 3
+
+    expr = parse_python('(A and B) or (C ^ D) or (not A and E)')
+    assert solve(expr, solver='builtin', cache=cache) == solve(expr, solver='builtin', cache=cache)
+    for minimize in [False, True]:
+        expected = solve_all(expr, solver='builtin', minimize=minimize)
+        hits = cache.hits
+        assert solve_all(expr, solver='builtin', minimize=minimize, cache=cache) == expected
+        assert solve_all(expr, solver='builtin', minimize=minimize, cache=cache) == expected
+        assert cache.hits == hits + 1
+    # a different projection is a different question
+    hits = cache.hits
+    assert len(solve_all(expr, solver='builtin', projection=['A', 'B'], cache=cache)) == 4
+    assert cache.hits == hits
+
+    print('pass')
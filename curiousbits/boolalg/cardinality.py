@@ -0,0 +1,265 @@
+# unary counters for cardinality constraints over integer literals
+#
+# Each encoder takes input literals xs and returns outputs us where us[i] is
+# "at least i+1 of xs are true", for i up to m-1 (counting further than the
+# largest bound is wasted clauses). Outputs past len(us) are always false.
+#
+# The two directions are emitted separately:
+#   up:   inputs -> outputs, a true count pushes us[i] true, needed to enforce
+#         an upper bound (AtMost asserted true, AtLeast asserted false)
+#   down: outputs -> inputs, us[i] true needs i+1 true inputs, needed to
+#         enforce a lower bound
+#
+# cnf is anything with new_var()/add_clause(), like a CNF or DimacsWriter
+#
+# encodings, for n inputs and m outputs:
+#   sequential counter (Sinz 2005)           O(n*m) clauses and variables
+#   totalizer (Bailleux & Boufkhad 2003)     O(n*log n) vars, O(n*m) clauses
+#   cardinality network (Asin et al. 2011)   O(n*log^2 m) clauses, blocks of
+#     about m inputs sorted by odd-even merge sort then merged pairwise keeping
+#     only the top of each merge, comparators whose outputs go unused left out
+
+#------------------------------------------------------------------------------
+# sequential counter
+#------------------------------------------------------------------------------
+
+def sequential_counter(cnf, xs, m, up=True, down=True):
+    if not xs or m <= 0:
+        return []
+
+    # row: counter after the inputs so far, row[j] is "at least j+1 true"
+    row = [xs[0]]
+    for x in xs[1:]:
+        width = min(len(row)+1, m)
+        new = [cnf.new_var() for j in range(width)]
+        for j in range(width):
+            prev = row[j] if j < len(row) else None
+            carry = row[j-1] if j > 0 else None
+            # new[j] = prev[j] + x*prev[j-1], with prev[-1] true
+            if up:
+                if prev != None:
+                    cnf.add_clause([-prev, new[j]])
+                cnf.add_clause([-x, new[j]] + ([-carry] if j > 0 else []))
+            if down:
+                cnf.add_clause([-new[j], x] + ([prev] if prev != None else []))
+                if j > 0:
+                    cnf.add_clause([-new[j], carry] + ([prev] if prev != None else []))
+        row = new
+
+    return row[:m]
+
+#------------------------------------------------------------------------------
+# totalizer
+#------------------------------------------------------------------------------
+
+# merge unary counts a and b (outputs past the end are false) into one of
+# length min(len(a)+len(b), m)
+def unary_add(cnf, a, b, m, up=True, down=True):
+    if not a: return b[:m]
+    if not b: return a[:m]
+
+    r = [cnf.new_var() for i in range(min(len(a)+len(b), m))]
+
+    # count i of a and j of b, 0 meaning the always true "at least 0"
+    for i in range(len(a)+1):
+        for j in range(len(b)+1):
+            # a >= i and b >= j -> r >= i+j
+            if up and 0 < i+j <= len(r):
+                clause = [r[i+j-1]]
+                if i > 0: clause.append(-a[i-1])
+                if j > 0: clause.append(-b[j-1])
+                cnf.add_clause(clause)
+            # a < i+1 and b < j+1 -> r < i+j+1
+            if down and i+j < len(r):
+                clause = [-r[i+j]]
+                if i < len(a): clause.append(a[i])
+                if j < len(b): clause.append(b[j])
+                cnf.add_clause(clause)
+
+    return r
+
+def totalizer(cnf, xs, m, up=True, down=True):
+    if not xs or m <= 0:
+        return []
+    if len(xs) == 1:
+        return list(xs)
+    half = len(xs) // 2
+    a = totalizer(cnf, xs[:half], m, up, down)
+    b = totalizer(cnf, xs[half:], m, up, down)
+    return unary_add(cnf, a, b, m, up, down)
+
+#------------------------------------------------------------------------------
+# cardinality network
+#------------------------------------------------------------------------------
+
+# comparators (i, j) of Batcher's odd-even merge sort for n (a power of two)
+# wires, wire i ending up >= wire j
+def odd_even_merge_sort(lo, n):
+    result = []
+    if n > 1:
+        half = n // 2
+        result += odd_even_merge_sort(lo, half)
+        result += odd_even_merge_sort(lo+half, half)
+        result += odd_even_merge(lo, n, 1)
+    return result
+
+def odd_even_merge(lo, n, step):
+    result = []
+    double = step * 2
+    if double < n:
+        result += odd_even_merge(lo, n, double)
+        result += odd_even_merge(lo+step, n, double)
+        result += [(i, i+step) for i in range(lo+step, lo+n-step, double)]
+    else:
+        result.append((lo, lo+step))
+    return result
+
+# comparators for n wires in blocks of p (a power of two dividing n): each
+# block sorted, then blocks merged two at a time keeping the top p wires of
+# each merge, returns (comparators, wires of the top p at the end)
+def block_merge_sort(n, p):
+    result = []
+    blocks = []
+    for lo in range(0, n, p):
+        result += odd_even_merge_sort(lo, p)
+        blocks.append(list(range(lo, lo+p)))
+    while len(blocks) > 1:
+        merged = []
+        for k in range(0, len(blocks) - 1, 2):
+            wires = blocks[k] + blocks[k+1]
+            result += [(wires[i], wires[j]) for (i, j) in odd_even_merge(0, 2*p, 1)]
+            merged.append(wires[:p])
+        if len(blocks) % 2:
+            merged.append(blocks[-1])
+        blocks = merged
+    return (result, blocks[0])
+
+def cardinality_network(cnf, xs, m, up=True, down=True):
+    if not xs or m <= 0:
+        return []
+
+    # blocks of a power of two at least m (or all the inputs if fewer), padded
+    # with always false wires (None)
+    p = 1
+    while p < min(m, len(xs)):
+        p *= 2
+    n = -(-len(xs) // p) * p
+    (comparators, top) = block_merge_sort(n, p)
+
+    # backwards: which comparator outputs lead to the first m outputs
+    needed = set(top[:min(m, len(xs))])
+    plan = []
+    for (i, j) in reversed(comparators):
+        (hi, lo) = (i in needed, j in needed)
+        plan.append((i, j, hi, lo))
+        if hi or lo:
+            needed |= {i, j}
+    plan.reverse()
+
+    # forwards: hi = a + b, lo = a * b
+    wires = list(xs) + [None] * (n - len(xs))
+    for (i, j, need_hi, need_lo) in plan:
+        (a, b) = (wires[i], wires[j])
+        if a == None or b == None:
+            (wires[i], wires[j]) = (b if a == None else a, None)
+            continue
+        hi = lo = None
+        if need_hi:
+            hi = cnf.new_var()
+            if up: cnf.add_clauses([[-a, hi], [-b, hi]])
+            if down: cnf.add_clause([-hi, a, b])
+        if need_lo:
+            lo = cnf.new_var()
+            if up: cnf.add_clause([-a, -b, lo])
+            if down: cnf.add_clauses([[-lo, a], [-lo, b]])
+        (wires[i], wires[j]) = (hi, lo)
+
+    return [wires[k] for k in top[:m] if wires[k] != None]
+
+ENCODINGS = {
+    'seqcounter': sequential_counter,
+    'totalizer': totalizer,
+    'sortnet': cardinality_network,
+}
+
+# the sequential counter is smallest for tiny bounds, the totalizer for
+# moderate ones, the network once the counter would be wide
+def choose_encoding(n, m):
+    if m <= 2:
+        return 'seqcounter'
+    if n * m <= 4096:
+        return 'totalizer'
+    return 'sortnet'
+
+def unary_count(cnf, xs, m, up=True, down=True, encoding='auto'):
+    if encoding == 'auto':
+        encoding = choose_encoding(len(xs), m)
+    return ENCODINGS[encoding](cnf, xs, m, up, down)
+
+#------------------------------------------------------------------------------
+# tests
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import itertools
+
+    from .cnf import CNF
+
+    # every assignment of the inputs, with up and down together, should force
+    # the outputs to exactly the unary count
+    def check(encode, n, m):
+        cnf = CNF()
+        xs = [cnf.new_var() for i in range(n)]
+        us = encode(cnf, xs, m)
+        assert len(us) == min(n, m)
+        for bits in itertools.product([False, True], repeat=n):
+            values = {x: b for (x, b) in zip(xs, bits)}
+            # propagate to a fixpoint
+            changed = True
+            while changed:
+                changed = False
+                for clause in cnf:
+                    unknown = [l for l in clause if not abs(l) in values]
+                    if any(values.get(abs(l)) == (l > 0) for l in clause):
+                        continue
+                    assert unknown, 'conflict'
+                    if len(unknown) == 1:
+                        values[abs(unknown[0])] = unknown[0] > 0
+                        changed = True
+            count = sum(bits)
+            assert [values.get(u) for u in us] == [i < count for i in range(len(us))], (encode, n, m, bits)
+
+    for encode in ENCODINGS.values():
+        for n in range(0, 7):
+            for m in range(0, n+2):
+                check(encode, n, m)
+
+    # several blocks, including an odd one out
+    for (n, m) in [(9, 2), (10, 3)]:
+        check(cardinality_network, n, m)
+
+    # one direction alone is weaker but still sound for its bound
+    cnf = CNF()
+    xs = [cnf.new_var() for i in range(4)]
+    us = totalizer(cnf, xs, 3, down=False)
+    assert all(c[0] > 0 for c in cnf)
+
+    # the network drops comparators the first outputs do not need
+    sizes = {}
+    for m in [1, 2, 4, 16]:
+        cnf = CNF()
+        xs = [cnf.new_var() for i in range(16)]
+        cardinality_network(cnf, xs, m)
+        sizes[m] = len(cnf)
+    assert sizes[1] < sizes[2] < sizes[4] < sizes[16]
+    # and for a fixed bound grows linearly with the inputs
+    sizes = {}
+    for n in [1024, 4096]:
+        cnf = CNF()
+        cardinality_network(cnf, [cnf.new_var() for i in range(n)], 8)
+        sizes[n] = len(cnf)
+    assert sizes[4096] < 4.2 * sizes[1024]
+
+    assert choose_encoding(100, 1) == 'seqcounter'
+    assert choose_encoding(10000, 50) == 'sortnet'
+
+    print('pass')
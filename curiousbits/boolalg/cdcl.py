@@ -0,0 +1,570 @@
+# a small conflict driven clause learning (CDCL) SAT solver in pure Python
+#
+# for the many tiny instances where starting an external solver costs more
+# than solving, and for when no external solver is installed
+#
+# the usual MiniSat recipe:
+#   two watched literals per clause for propagation
+#   first unique implication point (1-UIP) learning, with the learned clause
+#     minimized by dropping literals implied by the rest
+#   VSIDS decisions (bump the variables of each conflict, decay all others)
+#     with saved phases
+#   Luby restarts
+#   learned clause deletion, by activity, when the database grows
+#   assumptions: literals taken as the first decisions of every search, when
+#     unsatisfiable under them the subset to blame is found by walking the
+#     implications of the failed one back to the assumptions (analyzeFinal)
+#
+# literals are DIMACS style ints, values are 1 (true), -1 (false), 0 (unassigned)
+#
+# TEST WITH: python -m curiousbits.boolalg.cdcl
+
+import heapq
+
+# 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ...
+def luby(i):
+    # find the finite subsequence containing index i, and its size
+    (size, seq) = (1, 0)
+    while size < i + 1:
+        seq += 1
+        size = 2 * size + 1
+    while size - 1 != i:
+        size = (size - 1) >> 1
+        seq -= 1
+        i = i % size
+    return 1 << seq
+
+class Solver(object):
+    # cnf: optional CNF to start from (XOR constraints must be expanded first)
+    # seed: randomize the first decisions (tiny initial activities) and initial
+    #   phases, different seeds take very different paths on hard instances
+    def __init__(self, cnf=None, restart_base=100, var_decay=0.95, clause_decay=0.999, seed=None):
+        self.n_vars = 0
+        self.value = [0]        # per variable
+        self.level = [0]
+        self.reason = [None]
+        self.activity = [0.0]
+        self.phase = [False]
+        self.watches = {}       # literal -> clauses watching it
+
+        self.clauses = []
+        self.learnts = []
+        self.clause_activity = {}   # id(learnt clause) -> activity
+
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.heap = []
+        self.ok = True          # False once unsatisfiable at level 0
+
+        self.var_inc = 1.0
+        self.var_decay = var_decay
+        self.clause_inc = 1.0
+        self.clause_decay = clause_decay
+        self.restart_base = restart_base
+        self.max_learnts = 0
+
+        self.rng = None
+        if seed != None:
+            import random
+            self.rng = random.Random(seed)
+
+        self.model = None
+        self.assumptions = []
+        self.conflict = []      # failed assumptions of the last solve()
+        self.stats = {'decisions': 0, 'propagations': 0, 'conflicts': 0, 'restarts': 0}
+
+        if cnf != None:
+            assert cnf.n_xors == 0, 'expand XOR constraints first'
+            self.ensure_vars(cnf.n_vars)
+            for clause in cnf:
+                self.add_clause(clause)
+
+    #--------------------------------------------------------------------------
+    # problem
+    #--------------------------------------------------------------------------
+
+    def new_var(self):
+        self.n_vars += 1
+        self.value.append(0)
+        self.level.append(0)
+        self.reason.append(None)
+        self.activity.append(self.rng.random() * 1e-5 if self.rng else 0.0)
+        self.phase.append(self.rng.random() < 0.5 if self.rng else False)
+        self.watches[self.n_vars] = []
+        self.watches[-self.n_vars] = []
+        heapq.heappush(self.heap, (-self.activity[-1], self.n_vars))
+        return self.n_vars
+
+    def ensure_vars(self, n):
+        while self.n_vars < n:
+            self.new_var()
+
+    def lit_value(self, lit):
+        return self.value[lit] if lit > 0 else -self.value[-lit]
+
+    # clauses may be added between calls to solve(), returns False if the
+    # problem is now known unsatisfiable
+    def add_clause(self, lits):
+        if not self.ok:
+            return False
+        self.cancel_until(0)
+        self.ensure_vars(max((abs(l) for l in lits), default=0))
+
+        # drop duplicates and false literals, skip tautologies and satisfied
+        clause = []
+        for l in lits:
+            v = self.lit_value(l)
+            if v == 1 or -l in clause:
+                return True
+            if v == 0 and not l in clause:
+                clause.append(l)
+
+        if len(clause) == 0:
+            self.ok = False
+        elif len(clause) == 1:
+            self.enqueue(clause[0], None)
+            self.ok = self.propagate() == None
+        else:
+            self.clauses.append(clause)
+            self.watch(clause)
+        return self.ok
+
+    def watch(self, clause):
+        self.watches[clause[0]].append(clause)
+        self.watches[clause[1]].append(clause)
+
+    #--------------------------------------------------------------------------
+    # propagation
+    #--------------------------------------------------------------------------
+
+    def enqueue(self, lit, reason):
+        var = abs(lit)
+        self.value[var] = 1 if lit > 0 else -1
+        self.level[var] = len(self.trail_lim)
+        self.reason[var] = reason
+        self.trail.append(lit)
+
+    # returns a conflicting clause, or None
+    def propagate(self):
+        value = self.value
+        level = self.level
+        reason = self.reason
+        watches = self.watches
+        trail = self.trail
+        current = len(self.trail_lim)
+        conflict = None
+        qhead = self.qhead
+
+        while qhead < len(trail) and conflict == None:
+            false_lit = -trail[qhead]
+            qhead += 1
+
+            # clauses kept watching false_lit are compacted to the front
+            ws = watches[false_lit]
+            (i, j, end) = (0, 0, len(ws))
+            while i < end:
+                clause = ws[i]
+                i += 1
+                if not clause:
+                    # deleted
+                    continue
+
+                # the false literal goes to clause[1]
+                if clause[0] == false_lit:
+                    clause[0] = clause[1]
+                    clause[1] = false_lit
+
+                first = clause[0]
+                first_value = value[first] if first > 0 else -value[-first]
+                if first_value == 1:
+                    ws[j] = clause
+                    j += 1
+                    continue
+
+                # look for a new literal to watch
+                for k in range(2, len(clause)):
+                    l = clause[k]
+                    if (value[l] if l > 0 else -value[-l]) != -1:
+                        clause[1] = l
+                        clause[k] = false_lit
+                        watches[l].append(clause)
+                        break
+                else:
+                    ws[j] = clause
+                    j += 1
+                    if first_value == -1:
+                        conflict = clause
+                        ws[j:j] = ws[i:end]
+                        j += end - i
+                        break
+                    var = abs(first)
+                    value[var] = 1 if first > 0 else -1
+                    level[var] = current
+                    reason[var] = clause
+                    trail.append(first)
+            del ws[j:]
+
+        self.stats['propagations'] += qhead - self.qhead
+        self.qhead = qhead
+        return conflict
+
+    #--------------------------------------------------------------------------
+    # conflict analysis
+    #--------------------------------------------------------------------------
+
+    def bump_var(self, var):
+        self.activity[var] += self.var_inc
+        if self.activity[var] > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.var_inc *= 1e-100
+            self.heap = [(-self.activity[v], v) for (a, v) in self.heap]
+            heapq.heapify(self.heap)
+        if self.value[var] == 0:
+            heapq.heappush(self.heap, (-self.activity[var], var))
+
+    def bump_clause(self, clause):
+        key = id(clause)
+        if key in self.clause_activity:
+            self.clause_activity[key] += self.clause_inc
+            if self.clause_activity[key] > 1e20:
+                for k in self.clause_activity:
+                    self.clause_activity[k] *= 1e-20
+                self.clause_inc *= 1e-20
+
+    # returns (learnt clause with the asserting literal first, backtrack level)
+    def analyze(self, conflict):
+        seen = set()
+        learnt = [None]
+        counter = 0
+        lit = None
+        index = len(self.trail) - 1
+        current = len(self.trail_lim)
+
+        clause = conflict
+        while True:
+            self.bump_clause(clause)
+            for q in (clause if lit == None else clause[1:]):
+                var = abs(q)
+                if not var in seen and self.level[var] > 0:
+                    seen.add(var)
+                    self.bump_var(var)
+                    if self.level[var] == current:
+                        counter += 1
+                    else:
+                        learnt.append(q)
+            # next literal of the current level on the trail
+            while not abs(self.trail[index]) in seen:
+                index -= 1
+            lit = self.trail[index]
+            index -= 1
+            counter -= 1
+            if counter == 0:
+                break
+            clause = self.reason[abs(lit)]
+            seen.discard(abs(lit))
+        learnt[0] = -lit
+
+        # minimize: drop literals whose reason lies entirely within the clause
+        in_learnt = {abs(l) for l in learnt}
+        minimized = [learnt[0]]
+        for q in learnt[1:]:
+            reason = self.reason[abs(q)]
+            if reason == None or not all(abs(r) in in_learnt or self.level[abs(r)] == 0 for r in reason[1:]):
+                minimized.append(q)
+        learnt = minimized
+
+        # second watch on the highest level literal after the asserting one
+        if len(learnt) == 1:
+            return (learnt, 0)
+        k = max(range(1, len(learnt)), key=lambda k: self.level[abs(learnt[k])])
+        (learnt[1], learnt[k]) = (learnt[k], learnt[1])
+        return (learnt, self.level[abs(learnt[1])])
+
+    #--------------------------------------------------------------------------
+    # search
+    #--------------------------------------------------------------------------
+
+    def cancel_until(self, level):
+        if len(self.trail_lim) <= level:
+            return
+        for lit in self.trail[self.trail_lim[level]:]:
+            var = abs(lit)
+            self.phase[var] = lit > 0
+            self.value[var] = 0
+            self.reason[var] = None
+            heapq.heappush(self.heap, (-self.activity[var], var))
+        del self.trail[self.trail_lim[level]:]
+        del self.trail_lim[level:]
+        self.qhead = len(self.trail)
+
+    def pick_branch(self):
+        # stale entries pile up with every bump and backtrack
+        if len(self.heap) > 4 * self.n_vars + 100:
+            self.heap = [(-self.activity[v], v) for v in range(1, self.n_vars+1) if self.value[v] == 0]
+            heapq.heapify(self.heap)
+        while self.heap:
+            (a, var) = heapq.heappop(self.heap)
+            if self.value[var] == 0:
+                return var if self.phase[var] else -var
+        return None
+
+    # forget the less active half of the learnt clauses, not those that are
+    # the reason of a current assignment
+    def reduce_db(self):
+        locked = {id(self.reason[abs(l)]) for l in self.trail if self.reason[abs(l)] != None}
+        self.learnts.sort(key=lambda c: self.clause_activity[id(c)])
+        half = len(self.learnts) // 2
+        kept = []
+        for (i, clause) in enumerate(self.learnts):
+            if i < half and len(clause) > 2 and not id(clause) in locked:
+                del self.clause_activity[id(clause)]
+                clause.clear()
+            else:
+                kept.append(clause)
+        self.learnts = kept
+        self.max_learnts = int(self.max_learnts * 1.1)
+
+    # search until a model, unsatisfiability (False) or n_conflicts (None)
+    def search(self, n_conflicts):
+        conflicts = 0
+        while True:
+            conflict = self.propagate()
+            if conflict != None:
+                self.stats['conflicts'] += 1
+                conflicts += 1
+                if len(self.trail_lim) == 0:
+                    return False
+
+                (learnt, level) = self.analyze(conflict)
+                self.cancel_until(level)
+                if len(learnt) == 1:
+                    self.enqueue(learnt[0], None)
+                else:
+                    self.learnts.append(learnt)
+                    self.clause_activity[id(learnt)] = 0.0
+                    self.bump_clause(learnt)
+                    self.watch(learnt)
+                    self.enqueue(learnt[0], learnt)
+
+                self.var_inc /= self.var_decay
+                self.clause_inc /= self.clause_decay
+                continue
+
+            if conflicts >= n_conflicts:
+                self.cancel_until(0)
+                return None
+
+            if len(self.learnts) - len(self.trail) >= self.max_learnts:
+                self.reduce_db()
+
+            # assumptions first, one level each (an empty one if already true)
+            lit = None
+            while len(self.trail_lim) < len(self.assumptions):
+                p = self.assumptions[len(self.trail_lim)]
+                if self.lit_value(p) == 1:
+                    self.trail_lim.append(len(self.trail))
+                elif self.lit_value(p) == -1:
+                    self.conflict = self.analyze_final(p)
+                    return False
+                else:
+                    lit = p
+                    break
+
+            if lit == None:
+                lit = self.pick_branch()
+                if lit == None:
+                    return True
+            self.stats['decisions'] += 1
+            self.trail_lim.append(len(self.trail))
+            self.enqueue(lit, None)
+
+    # the assumptions responsible for p being false, p included
+    def analyze_final(self, p):
+        result = [p]
+        if len(self.trail_lim) == 0:
+            return result
+        seen = {abs(p)}
+        for lit in reversed(self.trail[self.trail_lim[0]:]):
+            var = abs(lit)
+            if not var in seen:
+                continue
+            if self.reason[var] == None:
+                # a decision below the assumption levels is an assumption
+                result.append(lit)
+            else:
+                for q in self.reason[var][1:]:
+                    if self.level[abs(q)] > 0:
+                        seen.add(abs(q))
+        return result
+
+    # returns True (model in self.model, a list of literals) or False
+    #
+    # assumptions: literals held true for this call only, when False because
+    #   of them self.conflict is the subset that cannot all hold (and the
+    #   solver stays usable), empty when unsatisfiable regardless
+    def solve(self, assumptions=()):
+        self.model = None
+        self.conflict = []
+        if not self.ok:
+            return False
+        self.assumptions = list(assumptions)
+        for p in self.assumptions:
+            self.ensure_vars(abs(p))
+        self.cancel_until(0)
+        if self.propagate() != None:
+            self.ok = False
+            return False
+
+        self.max_learnts = max(len(self.clauses) // 3, 1000)
+        restart = 0
+        while True:
+            result = self.search(luby(restart) * self.restart_base)
+            if result != None:
+                break
+            restart += 1
+            self.stats['restarts'] += 1
+
+        if result:
+            self.model = [v if self.value[v] == 1 else -v for v in range(1, self.n_vars+1)]
+        elif not self.conflict:
+            self.ok = False
+        self.cancel_until(0)
+        self.assumptions = []
+        return result
+
+# solve a CNF, returns a model (list of literals) or None if unsatisfiable
+def solve_cnf_lits(cnf):
+    solver = Solver(cnf)
+    return solver.model if solver.solve() else None
+
+#------------------------------------------------------------------------------
+# tests
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import random
+    import itertools
+
+    from .cnf import CNF
+
+    assert [luby(i) for i in range(15)] == [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8]
+
+    def satisfies(cnf, model):
+        values = {abs(l): l > 0 for l in model}
+        return all(any(values.get(abs(l), False) == (l > 0) for l in c) for c in cnf)
+
+    def brute_force(cnf):
+        for bits in itertools.product([False, True], repeat=cnf.n_vars):
+            model = [v if b else -v for (v, b) in zip(range(1, cnf.n_vars+1), bits)]
+            if satisfies(cnf, model):
+                return True
+        return False
+
+    def random_cnf(rng, n_vars, n_clauses, k=3):
+        cnf = CNF()
+        for i in range(n_vars):
+            cnf.new_var()
+        for i in range(n_clauses):
+            cnf.add_clause([rng.choice([-1, 1]) * v for v in rng.sample(range(1, n_vars+1), k)])
+        return cnf
+
+    # trivia
+    cnf = CNF()
+    assert solve_cnf_lits(cnf) == []
+    cnf.add_clause([])
+    assert solve_cnf_lits(cnf) == None
+    cnf = CNF()
+    cnf.add_clauses([[1], [-1, 2], [-2, 3, 3], [3, -3]])
+    assert solve_cnf_lits(cnf) == [1, 2, 3]
+    cnf.add_clause([-3])
+    assert solve_cnf_lits(cnf) == None
+
+    # agreement with brute force on small random instances around the threshold
+    rng = random.Random(0)
+    for trial in range(300):
+        n = rng.randint(3, 10)
+        cnf = random_cnf(rng, n, int(n * rng.uniform(3.0, 5.5)))
+        model = solve_cnf_lits(cnf)
+        if model == None:
+            assert not brute_force(cnf)
+        else:
+            assert satisfies(cnf, model)
+
+    # pigeonhole: 6 pigeons do not fit 5 holes
+    cnf = CNF()
+    p = {(i, j): cnf.new_var() for i in range(6) for j in range(5)}
+    for i in range(6):
+        cnf.add_clause([p[i, j] for j in range(5)])
+    for j in range(5):
+        for (a, b) in itertools.combinations(range(6), 2):
+            cnf.add_clause([-p[a, j], -p[b, j]])
+    solver = Solver(cnf)
+    assert solver.solve() == False
+    assert solver.stats['conflicts'] > 0
+
+    # bigger random instances, learning and restarts get exercised
+    for seed in range(3):
+        rng = random.Random(seed)
+        cnf = random_cnf(rng, 120, 500)
+        solver = Solver(cnf)
+        if solver.solve():
+            assert satisfies(cnf, solver.model)
+
+    # clauses added after solving
+    solver = Solver()
+    solver.add_clause([1, 2])
+    assert solver.solve() and solver.model in ([1, -2], [-1, 2], [1, 2])
+    solver.add_clause([-1])
+    assert solver.solve() and solver.model == [-1, 2]
+    solver.add_clause([-2])
+    assert solver.solve() == False
+
+    # assumptions: the same solver asked under different ones
+    solver = Solver()
+    for clause in [[-1, 2], [-2, 3], [-3, -4], [5, 6]]:
+        solver.add_clause(clause)
+    assert solver.solve([1, 4]) == False
+    assert sorted(solver.conflict) == [1, 4]
+    assert solver.solve([1, -4, 5]) and solver.model[:5] == [1, 2, 3, -4, 5]
+    assert solver.solve([4, 6, 1]) == False and sorted(solver.conflict) == [1, 4]
+    assert solver.solve([-5, -6]) == False and sorted(solver.conflict) == [-6, -5]
+    assert solver.solve([1, -1]) == False and sorted(solver.conflict) == [-1, 1]
+    assert solver.solve() and solver.ok
+    solver.add_clause([-3])
+    assert solver.solve([1]) == False and solver.conflict == [1]
+    assert solver.solve([-1, 7]) and solver.model[0] == -1 and solver.model[6] == 7
+
+    # against brute force: a failed subset is itself unsatisfiable with the
+    # clauses, and the solver only gives up for good when the clauses alone
+    # are unsatisfiable
+    rng = random.Random(3)
+    for trial in range(200):
+        n = rng.randint(3, 10)
+        cnf = random_cnf(rng, n, int(n * rng.uniform(2.0, 4.5)))
+        solver = Solver(cnf)
+        for i in range(3):
+            assumptions = [rng.choice([-1, 1]) * v for v in rng.sample(range(1, n+1), rng.randint(1, n))]
+            fixed = cnf.copy()
+            fixed.add_clauses([[p] for p in assumptions])
+            if solver.solve(assumptions):
+                assert satisfies(fixed, solver.model)
+            else:
+                assert not brute_force(fixed)
+                assert set(solver.conflict) <= set(assumptions)
+                core = cnf.copy()
+                core.add_clauses([[p] for p in solver.conflict])
+                assert not brute_force(core)
+                assert solver.ok or not brute_force(cnf)
+
+    # seeds change the path, not the answer
+    rng = random.Random(5)
+    cnf = random_cnf(rng, 80, 340)
+    answers = set()
+    for seed in range(4):
+        solver = Solver(cnf, seed=seed)
+        result = solver.solve()
+        assert not result or satisfies(cnf, solver.model)
+        answers.add(result)
+    assert len(answers) == 1
+
+    print('pass')
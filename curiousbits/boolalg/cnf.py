@@ -0,0 +1,296 @@
+# conjunctive normal form (CNF) stored as flat integer arrays
+#
+# literals are DIMACS style ints: variable i is +i, its negation is -i
+# clause k is lits[offsets[k]:offsets[k+1]]
+#
+# variables are numbered from 1, names[i] is the name of variable i or None for
+# anonymous variables (like Tseytin gates) which print as _<i>
+#
+# XOR constraints, for solvers with native support (CryptoMiniSat 'x' lines),
+# are kept alongside in xor_lits/xor_offsets: [1, -2, 3] means 1 ^ /2 ^ 3 is
+# true. expand_xors() rewrites them as plain clauses for other solvers.
+
+from array import array
+
+from .expr import *
+
+class CNF(object):
+    def __init__(self):
+        self.lits = array('i')
+        self.offsets = array('q', [0])
+        self.names = [None]
+        self.name2idx = {}
+        self.xor_lits = array('i')
+        self.xor_offsets = array('q', [0])
+
+    #--------------------------------------------------------------------------
+    # variables
+    #--------------------------------------------------------------------------
+
+    @property
+    def n_vars(self):
+        return len(self.names) - 1
+
+    def new_var(self, name=None):
+        idx = len(self.names)
+        self.names.append(name)
+        if name != None:
+            assert not name in self.name2idx
+            self.name2idx[name] = idx
+        return idx
+
+    # index of the named variable, allocating it if needed
+    def var(self, name):
+        idx = self.name2idx.get(name)
+        if idx == None:
+            idx = self.new_var(name)
+        return idx
+
+    def varname(self, idx):
+        name = self.names[abs(idx)]
+        return f'_{abs(idx)}' if name == None else name
+
+    # Var('A') -> 1, Not(Var('A')) -> -1
+    def lit(self, expr):
+        if type(expr) == Var:
+            return self.var(expr.name)
+        if type(expr) == Not and type(expr.child) == Var:
+            return -self.var(expr.child.name)
+        raise Exception(f'not a literal: {expr}')
+
+    #--------------------------------------------------------------------------
+    # clauses
+    #--------------------------------------------------------------------------
+
+    @property
+    def n_clauses(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_literals(self):
+        return len(self.lits)
+
+    def add_clause(self, lits):
+        self.lits.extend(lits)
+        self.offsets.append(len(self.lits))
+
+    def add_clauses(self, clauses):
+        for clause in clauses:
+            self.add_clause(clause)
+
+    def clause(self, k):
+        return self.lits[self.offsets[k]:self.offsets[k+1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        lits = self.lits
+        offsets = self.offsets
+        for k in range(len(offsets)-1):
+            yield lits[offsets[k]:offsets[k+1]]
+
+    def copy(self):
+        result = CNF()
+        result.lits = array('i', self.lits)
+        result.offsets = array('q', self.offsets)
+        result.names = list(self.names)
+        result.name2idx = dict(self.name2idx)
+        result.xor_lits = array('i', self.xor_lits)
+        result.xor_offsets = array('q', self.xor_offsets)
+        return result
+
+    #--------------------------------------------------------------------------
+    # XOR constraints
+    #--------------------------------------------------------------------------
+
+    @property
+    def n_xors(self):
+        return len(self.xor_offsets) - 1
+
+    # constrain the parity of lits to be odd
+    def add_xor(self, lits):
+        self.xor_lits.extend(lits)
+        self.xor_offsets.append(len(self.xor_lits))
+
+    def xors(self):
+        lits = self.xor_lits
+        offsets = self.xor_offsets
+        for k in range(len(offsets)-1):
+            yield lits[offsets[k]:offsets[k+1]]
+
+    # copy with each XOR constraint replaced by clauses
+    #
+    # A k-literal XOR needs 2^(k-1) clauses (one per even parity assignment) so
+    # long ones are cut into pieces of at most `cut` literals chained through
+    # anonymous variables: x1^x2^x3^x4^x5 -> (x1^x2^x3^/t)(t^x4^x5)
+    def expand_xors(self, cut=4):
+        assert cut >= 3
+        result = self.copy()
+        result.xor_lits = array('i')
+        result.xor_offsets = array('q', [0])
+
+        for lits in self.xors():
+            lits = list(lits)
+            while len(lits) > cut:
+                t = result.new_var()
+                head = lits[:cut-1] + [-t]
+                lits = [t] + lits[cut-1:]
+                result.add_xor_clauses(head)
+            result.add_xor_clauses(lits)
+
+        return result
+
+    # the 2^(k-1) clauses for an odd parity XOR, one blocking each even parity assignment
+    def add_xor_clauses(self, lits):
+        k = len(lits)
+        for bits in range(2**k):
+            if bin(bits).count('1') % 2 == 0:
+                # bit i set means literal i true in the blocked assignment
+                self.add_clause([-l if bits & (1<<i) else l for (i, l) in enumerate(lits)])
+
+    #--------------------------------------------------------------------------
+    # models
+    #--------------------------------------------------------------------------
+
+    # model is a list of literals like a DIMACS 'v' line, eg: [-1, 2, -3]
+    # returns {'A': False, 'B': True, 'C': False}
+    def model_to_dict(self, model, named_only=False):
+        result = {}
+        for lit in model:
+            if named_only and self.names[abs(lit)] == None:
+                continue
+            result[self.varname(lit)] = lit > 0
+        return result
+
+    # {'A': False, 'B': True} -> [-1, 2]
+    def dict_to_model(self, values):
+        return [self.name2idx[name] if value else -self.name2idx[name] for (name, value) in values.items()]
+
+    #--------------------------------------------------------------------------
+    # BoolExpr <-> CNF
+    #--------------------------------------------------------------------------
+
+    # accepts what is_cnf() accepts, and also the degenerate forms produced by
+    # reduce(): Val, a lone literal, a lone Or, and And with literal conjuncts
+    #
+    # variables are numbered in sorted name order, same as to_dimacs()
+    @classmethod
+    def from_expr(cls, expr):
+        result = cls()
+        for name in sorted(expr.varnames()):
+            result.new_var(name)
+
+        if type(expr) == Val:
+            if expr.value == False:
+                result.add_clause([])
+            return result
+
+        conjuncts = expr.children if type(expr) == And else [expr]
+        for c in conjuncts:
+            if type(c) == Val:
+                if c.value == False:
+                    result.add_clause([])
+            elif type(c) == Or:
+                result.add_clause([result.lit(gc) for gc in c.children])
+            else:
+                result.add_clause([result.lit(c)])
+
+        return result
+
+    def to_expr(self):
+        def lit_to_expr(lit):
+            return Var(self.varname(lit)) if lit > 0 else Not(Var(self.varname(lit)))
+
+        conjuncts = [Or(*[lit_to_expr(l) for l in clause]) for clause in self]
+
+        # XOR constraints as binary chains, n-ary Xor evaluates as one-hot
+        for lits in self.xors():
+            chain = lit_to_expr(lits[0]) if lits else Val(False)
+            for l in lits[1:]:
+                chain = Xor(chain, lit_to_expr(l))
+            conjuncts.append(chain)
+
+        return And(*conjuncts)
+
+    def __str__(self):
+        return str(self.to_expr())
+
+    def __repr__(self):
+        return f'<CNF vars={self.n_vars} clauses={self.n_clauses} literals={self.n_literals} xors={self.n_xors}>'
+
+if __name__ == '__main__':
+    from .tools import parse_python
+
+    cnf = CNF()
+    a = cnf.var('A')
+    b = cnf.var('B')
+    assert (a, b) == (1, 2)
+    assert cnf.var('A') == 1
+    g = cnf.new_var()
+    assert g == 3 and cnf.varname(g) == '_3' and cnf.varname(-g) == '_3'
+    cnf.add_clause([a, -b])
+    cnf.add_clause([g])
+    cnf.add_clause([])
+    assert len(cnf) == 3 and cnf.n_literals == 3
+    assert [list(c) for c in cnf] == [[1, -2], [3], []]
+    assert list(cnf.clause(0)) == [1, -2]
+    assert cnf.model_to_dict([1, -2, 3]) == {'A': True, 'B': False, '_3': True}
+    assert cnf.model_to_dict([1, -2, 3], named_only=True) == {'A': True, 'B': False}
+    assert cnf.dict_to_model({'A': True, 'B': False}) == [1, -2]
+
+    expr = parse_python('(A or not B) and (B or C) and (not A or not C)')
+    cnf = CNF.from_expr(expr)
+    assert cnf.names == [None, 'A', 'B', 'C']
+    assert [list(c) for c in cnf] == [[1, -2], [2, 3], [-1, -3]]
+    assert str(cnf) == str(expr)
+
+    # copies are independent
+    cnf2 = cnf.copy()
+    cnf2.add_clause([1])
+    assert len(cnf) == 3 and len(cnf2) == 4
+
+    # degenerate forms
+    assert len(CNF.from_expr(Val(True))) == 0
+    assert [list(c) for c in CNF.from_expr(Val(False))] == [[]]
+    assert [list(c) for c in CNF.from_expr(Not(Var('A')))] == [[-1]]
+    assert [list(c) for c in CNF.from_expr(parse_python('A or B'))] == [[1, 2]]
+    assert [list(c) for c in CNF.from_expr(parse_python('A and (B or C)'))] == [[1], [2, 3]]
+
+
+    # XOR constraints
+    cnf = CNF()
+    for name in 'ABCDEF':
+        cnf.new_var(name)
+    cnf.add_clause([1, 2])
+    cnf.add_xor([1, -2, 3, 4, -5, 6])
+    cnf.add_xor([2, 3])
+    assert cnf.n_xors == 2 and [list(x) for x in cnf.xors()] == [[1, -2, 3, 4, -5, 6], [2, 3]]
+    assert cnf.copy().n_xors == 2
+
+    # expanding keeps the solutions over the original variables
+    def models(cnf, names):
+        n = cnf.n_vars
+        result = set()
+        for i in range(2**n):
+            value = lambda l: bool(i & (1 << (abs(l)-1))) == (l > 0)
+            if not all(any(value(l) for l in c) for c in cnf):
+                continue
+            if not all(sum(value(l) for l in x) % 2 == 1 for x in cnf.xors()):
+                continue
+            result.add(tuple(value(cnf.var(name)) for name in names))
+        return result
+
+    for cut in [3, 4, 6]:
+        expanded = cnf.expand_xors(cut)
+        assert expanded.n_xors == 0 and expanded.n_vars > 6 or cut == 6
+        assert max(len(c) for c in expanded) <= cut
+        assert models(expanded, 'ABCDEF') == models(cnf, 'ABCDEF')
+        assert len(models(cnf, 'ABCDEF')) == 12
+
+    expr = cnf.to_expr()
+    for i in range(64):
+        values = {name: bool(i & (1<<k)) for (k, name) in enumerate('ABCDEF')}
+        assert expr.evaluate(values) == (tuple(values.values()) in models(cnf, 'ABCDEF'))
+
+    print('pass')
@@ -1,7 +1,6 @@
 #from . import expr
 from .expr import *
 from .tools import gen_dot, shellout
-from .tseytin import *
 
 def half_adder(A, B):
     A = Var(A) if type(A)==str else A
@@ -0,0 +1,383 @@
+# DIMACS CNF output that streams to a file object
+#
+# A DimacsWriter stands in for a CNF wherever clauses are produced (it has the
+# same new_var()/var()/add_clause() interface TseytinEncoder uses) but writes
+# each clause out as it arrives instead of storing it.
+#
+# The "p cnf <vars> <clauses>" header must come first yet is only known at the
+# end. For seekable files a fixed width placeholder is written and patched by
+# close(). For pipes, count the clauses first with a ClauseCounter, then pass
+# the counts to DimacsWriter so the header can be written up front.
+#
+# XOR constraints are written as CryptoMiniSat 'x' lines and counted as clauses.
+#
+# Also here: write_dimacs() for a whole CNF straight from its arrays,
+# read_dimacs()/load_dimacs() to stream a .cnf file into a CNF, and
+# parse_model() for solver output.
+
+import itertools
+import operator
+from array import array
+
+# placeholder header: 'p cnf' plus two 20 digit fields and newline
+HEADER_WIDTH = 5 + 1 + 20 + 1 + 20
+
+def header(n_vars, n_clauses, width=None):
+    line = 'p cnf %d %d' % (n_vars, n_clauses)
+    if width != None:
+        assert len(line) <= width
+        line = line.ljust(width)
+    return line + '\n'
+
+# counts what a DimacsWriter would write, storing nothing but variable names
+class ClauseCounter(object):
+    def __init__(self):
+        self.n_vars = 0
+        self.n_clauses = 0
+        self.name2idx = {}
+
+    def new_var(self, name=None):
+        self.n_vars += 1
+        if name != None:
+            self.name2idx[name] = self.n_vars
+        return self.n_vars
+
+    def var(self, name):
+        idx = self.name2idx.get(name)
+        if idx == None:
+            idx = self.new_var(name)
+        return idx
+
+    def add_clause(self, lits):
+        self.n_clauses += 1
+
+    def add_clauses(self, clauses):
+        for clause in clauses:
+            self.add_clause(clause)
+
+    def add_xor(self, lits):
+        self.n_clauses += 1
+
+# fp: text file object
+# n_vars, n_clauses: final counts if known in advance (eg: from a ClauseCounter),
+#   otherwise fp must be seekable and the header is patched on close()
+# buffer_size: clause lines to collect before each fp.write()
+class DimacsWriter(ClauseCounter):
+    def __init__(self, fp, n_vars=None, n_clauses=None, buffer_size=4096):
+        super().__init__()
+        self.fp = fp
+        self.buffer = []
+        self.buffer_size = buffer_size
+        self.expected = None
+
+        if n_vars != None and n_clauses != None:
+            self.expected = (n_vars, n_clauses)
+            fp.write(header(n_vars, n_clauses))
+        else:
+            if not fp.seekable():
+                raise Exception('counts must be given up front when writing to an unseekable file')
+            self.start = fp.tell()
+            fp.write(header(0, 0, HEADER_WIDTH))
+
+    def add_clause(self, lits):
+        self.n_clauses += 1
+        self.buffer.append(' '.join(map(str, lits)) + ' 0\n' if lits else '0\n')
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def add_xor(self, lits):
+        self.n_clauses += 1
+        self.buffer.append('x' + ' '.join(map(str, lits)) + ' 0\n')
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.fp.write(''.join(self.buffer))
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.expected != None:
+            assert self.expected == (self.n_vars, self.n_clauses), 'counts differ from those given up front'
+        else:
+            end = self.fp.tell()
+            self.fp.seek(self.start)
+            self.fp.write(header(self.n_vars, self.n_clauses, HEADER_WIDTH))
+            self.fp.seek(end)
+        self.fp.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type == None:
+            self.close()
+
+#------------------------------------------------------------------------------
+# whole CNFs
+#------------------------------------------------------------------------------
+
+# clause lines for lits/offsets (flat arrays, see cnf.py), at most chunk
+# clauses per string, each literal converted by a single map(str) per chunk
+def clause_lines(lits, offsets, prefix='', chunk=65536):
+    n = len(offsets) - 1
+    for first in range(0, n, chunk):
+        last = min(first + chunk, n)
+        base = offsets[first]
+        tokens = list(map(str, lits[base:offsets[last]]))
+        lines = [prefix + ' '.join(tokens[offsets[k]-base:offsets[k+1]-base]) for k in range(first, last)]
+        # an empty clause is a lone 0
+        text = ' 0\n'.join(lines) + ' 0\n'
+        if '\n 0\n' in text or text.startswith(' 0\n'):
+            text = ''.join((line + ' 0\n' if line != prefix else prefix + '0\n') for line in lines)
+        yield text
+
+# write a CNF to text file object fp
+def write_dimacs(cnf, fp, chunk=65536):
+    fp.write(header(cnf.n_vars, cnf.n_clauses + cnf.n_xors))
+    for text in clause_lines(cnf.lits, cnf.offsets, '', chunk):
+        fp.write(text)
+    for text in clause_lines(cnf.xor_lits, cnf.xor_offsets, 'x', chunk):
+        fp.write(text)
+
+# append the clauses of ints, a flat array of literals with 0 ending each
+# clause, to lits/offsets, returns what follows the last 0 (an unfinished clause)
+#
+# all loops are map/filter/compress so nothing runs per literal in Python
+def append_clauses(lits, offsets, ints):
+    ends = list(itertools.compress(itertools.count(), map(operator.not_, ints)))
+    if not ends:
+        return ints
+    last = ends[-1]
+    base = len(lits)
+    lits.extend(filter(None, ints[:last]))
+    # the k-th 0 at position p ends a clause after p-k literals
+    offsets.extend(map(operator.add, map(operator.sub, ends, itertools.count()), itertools.repeat(base)))
+    return ints[last+1:]
+
+# read DIMACS CNF from text file object fp into a CNF (or add to cnf)
+#
+# Reads chunk characters at a time, so files of hundreds of MB never exist as
+# one string or list. Accepts comments, clauses spread over or sharing lines,
+# CryptoMiniSat 'x' lines and the '%' end marker of the SATLIB files.
+def read_dimacs(fp, cnf=None, chunk=1<<24):
+    from .cnf import CNF
+
+    if cnf == None:
+        cnf = CNF()
+    first_var = cnf.n_vars
+    pending = array('i')
+    rest = ''
+    done = False
+    while not done:
+        text = fp.read(chunk)
+        if not text:
+            (text, rest, done) = (rest, '', True)
+        else:
+            text = rest + text
+            cut = text.rfind('\n') + 1
+            (text, rest) = (text[:cut], text[cut:])
+
+        # the slow path only for chunks with something other than clauses
+        if 'c' in text or 'p' in text or 'x' in text or '%' in text:
+            body = []
+            for line in text.split('\n'):
+                line = line.strip()
+                if not line or line[0] == 'c':
+                    continue
+                if line[0] == 'p':
+                    fields = line.split()
+                    assert fields[1] == 'cnf', 'expected a "p cnf" header'
+                    n_vars = first_var + int(fields[2])
+                    while cnf.n_vars < n_vars:
+                        cnf.names.append(None)
+                elif line[0] == '%':
+                    done = True
+                    break
+                elif line[0] == 'x':
+                    xor = [int(x) for x in line[1:].split()]
+                    assert xor[-1] == 0, 'xor constraints should end with 0 on the same line'
+                    cnf.add_xor([l + first_var if l > 0 else l - first_var for l in xor[:-1]])
+                else:
+                    body.append(line)
+            text = '\n'.join(body)
+
+        ints = array('i', map(int, text.split()))
+        if first_var:
+            ints = array('i', (l + first_var if l > 0 else l - first_var if l else 0 for l in ints))
+        pending = append_clauses(cnf.lits, cnf.offsets, pending + ints)
+
+    assert not pending, 'last clause should end with 0'
+
+    # variables past those the header declares
+    top = max(max(cnf.lits, default=0), -min(cnf.lits, default=0))
+    while cnf.n_vars < top:
+        cnf.names.append(None)
+    return cnf
+
+# read a DIMACS file by name, compressed if it ends in .gz, .bz2 or .xz (as
+# the competition benchmarks are shipped)
+def load_dimacs(path, cnf=None):
+    if path.endswith('.gz'):
+        import gzip
+        opener = gzip.open
+    elif path.endswith('.bz2'):
+        import bz2
+        opener = bz2.open
+    elif path.endswith('.xz'):
+        import lzma
+        opener = lzma.open
+    else:
+        opener = open
+    with opener(path, 'rt') as fp:
+        return read_dimacs(fp, cnf)
+
+#------------------------------------------------------------------------------
+# solver output
+#------------------------------------------------------------------------------
+
+# competition format output -> model or None if unsatisfiable
+#
+# The model may span any number of 'v' lines (solvers wrap long ones), ends
+# at 0 and comes back as [-1, 2, -3, ...] for variables 1..n_vars, any the
+# solver left out being false and any past n_vars (eg: from expand_xors())
+# dropped. Without n_vars, up to the largest variable mentioned.
+#
+# raises an Exception if there is no answer (an 's UNKNOWN' or a crash)
+def parse_model(output, n_vars=None):
+    status = None
+    tokens = []
+    for line in output.split('\n'):
+        if line.startswith('s '):
+            status = line[2:].strip()
+        elif line.startswith('v'):
+            tokens.extend(line[1:].split())
+
+    if status == 'UNSATISFIABLE':
+        return None
+    if status != 'SATISFIABLE':
+        raise Exception(f'no answer from solver, status: {status}')
+
+    values = {}
+    for lit in map(int, tokens):
+        if lit == 0:
+            break
+        values[abs(lit)] = lit > 0
+    if n_vars == None:
+        n_vars = max(values, default=0)
+    return [v if values.get(v, False) else -v for v in range(1, n_vars+1)]
+
+if __name__ == '__main__':
+    import io
+
+    from .cnf import CNF
+
+    def parse(text):
+        lines = text.strip().split('\n')
+        fields = lines[0].split()
+        clauses = [[int(x) for x in line.split()[:-1]] for line in lines[1:]]
+        return ((int(fields[2]), int(fields[3])), clauses)
+
+    cnf = CNF()
+    for name in 'ABC':
+        cnf.new_var(name)
+    cnf.add_clause([1, -2])
+    cnf.add_clause([2, 3])
+    cnf.add_clause([])
+    fp = io.StringIO()
+    write_dimacs(cnf, fp)
+    assert fp.getvalue() == 'p cnf 3 3\n1 -2 0\n2 3 0\n0\n'
+    cnf.add_xor([1, -3])
+    fp = io.StringIO()
+    write_dimacs(cnf, fp)
+    assert fp.getvalue() == 'p cnf 3 4\n1 -2 0\n2 3 0\n0\nx1 -3 0\n'
+
+    # seekable: header patched on close
+    fp = io.StringIO()
+    with DimacsWriter(fp, buffer_size=2) as w:
+        a = w.var('A')
+        b = w.new_var()
+        w.add_clause([a, -b])
+        w.add_clauses([[b], [-a, b], [a]])
+        w.add_xor([a, b])
+    assert fp.getvalue().endswith('\nx1 2 0\n')
+    fp = io.StringIO(fp.getvalue()[:-len('x1 2 0\n')])
+    assert parse(fp.getvalue()) == ((2, 5), [[1, -2], [2], [-1, 2], [1]])
+    assert fp.getvalue().startswith('p cnf 2 5 ')
+    assert len(fp.getvalue().split('\n')[0]) == HEADER_WIDTH
+
+    # unseekable: counts given up front
+    class Pipe(io.StringIO):
+        def seekable(self):
+            return False
+
+    fp = Pipe()
+    failed = False
+    try:
+        DimacsWriter(fp)
+    except Exception:
+        failed = True
+    assert failed
+    w = DimacsWriter(fp, 2, 1)
+    w.add_clause([1, 2])
+    w.new_var()
+    w.new_var()
+    w.close()
+    assert fp.getvalue() == 'p cnf 2 1\n1 2 0\n'
+
+    # bulk writing: empty clauses and chunk boundaries
+    cnf = CNF()
+    for i in range(5):
+        cnf.new_var()
+    clauses = [[1, -2], [], [3], [], [], [-4, 5, 1], [2]]
+    cnf.add_clauses(clauses)
+    cnf.add_xor([1, 2, -3])
+    expected = 'p cnf 5 8\n' + ''.join(' '.join(map(str, c + [0])) + '\n' for c in clauses) + 'x1 2 -3 0\n'
+    for chunk in [1, 2, 3, 100]:
+        fp = io.StringIO()
+        write_dimacs(cnf, fp, chunk)
+        assert fp.getvalue() == expected
+
+    # reading back
+    def same(a, b):
+        return a.n_vars == b.n_vars and list(map(list, a)) == list(map(list, b)) and \
+            list(map(list, a.xors())) == list(map(list, b.xors()))
+
+    assert same(read_dimacs(io.StringIO(expected)), cnf)
+    for chunk in [1, 5, 7, 1000]:
+        assert same(read_dimacs(io.StringIO(expected), chunk=chunk), cnf)
+
+    # comments, free layout, more variables than declared, SATLIB end marker
+    text = 'c a comment\np cnf 3 4\n1 -2\n 0 3 0\n-1\n\n0\n  4 0\n%\n0\n'
+    for chunk in [1, 3, 1000]:
+        cnf = read_dimacs(io.StringIO(text), chunk=chunk)
+        assert list(map(list, cnf)) == [[1, -2], [3], [-1], [4]] and cnf.n_vars == 4
+
+    # big random instance round trip, and appending to a CNF shifts variables
+    import random
+    rng = random.Random(0)
+    cnf = CNF()
+    for i in range(500):
+        cnf.new_var()
+    for i in range(5000):
+        cnf.add_clause([rng.choice([-1, 1]) * rng.randint(1, 500) for j in range(rng.randint(0, 6))])
+    fp = io.StringIO()
+    write_dimacs(cnf, fp, chunk=333)
+    assert same(read_dimacs(io.StringIO(fp.getvalue()), chunk=4096), cnf)
+    both = read_dimacs(io.StringIO('p cnf 2 1\n1 -2 0\n'))
+    read_dimacs(io.StringIO('p cnf 2 1\n2 -1 0\n'), both)
+    assert list(map(list, both)) == [[1, -2], [4, -3]] and both.n_vars == 4
+
+    # models over several v lines, missing and extra variables
+    output = 'c comment\ns SATISFIABLE\nv 1 -2\nv 3\nv -5 7 0\n'
+    assert parse_model(output, 5) == [1, -2, 3, -4, -5]
+    assert parse_model(output) == [1, -2, 3, -4, -5, -6, 7]
+    assert parse_model('s UNSATISFIABLE\n', 3) == None
+    for output in ['s UNKNOWN\n', '', 'segfault']:
+        try:
+            parse_model(output, 3)
+            assert False
+        except Exception as e:
+            assert 'no answer' in str(e)
+
+    print('pass')
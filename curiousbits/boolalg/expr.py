@@ -13,8 +13,6 @@
 #
 # .set_variable(), .reduce()
 
-import random
-
 class BoolExpr(object):
 #    @classmethod
 #    def true(self):
@@ -293,6 +291,7 @@ class Xor(BoolExpr):
 
     def evaluate(self, values):
         sr = [c.evaluate(values) for c in self.children]
+        if None in sr: return None
         return sr.count(True) == 1
 
     def deepen(self):
@@ -347,6 +346,161 @@ class Xor(BoolExpr):
         self._str_cache = '^'.join(sorted(lines))
         return self._str_cache
 
+# "k of n" nodes: AtMost(k, A, B, C) is true when at most k children are true
+#
+# writing these out with And/Or takes C(n,k) terms, the Tseytin encoder instead
+# builds a counter (see cardinality.py)
+class Cardinality(BoolExpr):
+    def __init__(self, bound, *children):
+        super().__init__()
+        assert all(isinstance(c, BoolExpr) for c in children), breakpoint()
+        self.bound = bound
+        self.children = list(children)
+
+    # does a count of true children in [lo, hi] satisfy the node?
+    def holds(self, count):
+        raise NotImplementedError()
+
+    def evaluate(self, values):
+        sr = [c.evaluate(values) for c in self.children]
+        lo = sr.count(True)
+        hi = lo + sr.count(None)
+        results = {self.holds(count) for count in range(lo, hi+1)}
+        return results.pop() if len(results) == 1 else None
+
+    def deepen(self):
+        self.children = [c.deepen() for c in self.children]
+        return self
+
+    def flatten(self):
+        self.children = [c.flatten() for c in self.children]
+        return self
+
+    def reduce(self):
+        self.children = [c.reduce() for c in self.children]
+
+        # rule: constant children move into the bound
+        self.bound -= sum(1 for c in self.children if c == True)
+        self.children = [c for c in self.children if type(c) != Val]
+
+        # rule: decided whatever the remaining children are
+        results = {self.holds(count) for count in range(len(self.children)+1)}
+        if len(results) == 1:
+            return Val(results.pop())
+
+        return self
+
+    def clone(self):
+        return type(self)(self.bound, *[c.clone() for c in self.children])
+
+    def __eq__(self, other):
+        if type(other) == str:
+            other = parse(other)
+        return type(other) == type(self) and self.bound == other.bound and self.children == other.children
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.bound},' + ','.join([repr(c) for c in self.children]) + ')'
+
+    def __py__(self):
+        return f'(sum([{", ".join(c.__py__() for c in self.children)}]) {self.op} {self.bound})'
+
+    def __c__(self):
+        return f'(({" + ".join(f"({c.__c__()})" for c in self.children)}) {self.op} {self.bound})'
+
+    def __str__(self):
+        subresults = [str(c) for c in self.children]
+        self._str_cache = f'{type(self).__name__}{self.bound}(' + ','.join(sorted(subresults)) + ')'
+        return self._str_cache
+
+class AtMost(Cardinality):
+    op = '<='
+
+    def holds(self, count):
+        return count <= self.bound
+
+class AtLeast(Cardinality):
+    op = '>='
+
+    def holds(self, count):
+        return count >= self.bound
+
+class Exactly(Cardinality):
+    op = '=='
+
+    def holds(self, count):
+        return count == self.bound
+
+# pseudo-Boolean constraint: PB([3, 2, 2], 4, A, B, C) is true when
+# 3*A + 2*B + 2*C <= 4, weights are integers and may be negative
+class PB(BoolExpr):
+    def __init__(self, weights, bound, *children):
+        super().__init__()
+        assert all(isinstance(c, BoolExpr) for c in children), breakpoint()
+        assert len(weights) == len(children)
+        self.weights = list(weights)
+        self.bound = bound
+        self.children = list(children)
+
+    # smallest and largest sums possible given child results (None unknown)
+    def sum_range(self, results):
+        lo = hi = 0
+        for (w, r) in zip(self.weights, results):
+            if r == True or (r == None and w < 0): lo += w
+            if r == True or (r == None and w > 0): hi += w
+        return (lo, hi)
+
+    def evaluate(self, values):
+        (lo, hi) = self.sum_range([c.evaluate(values) for c in self.children])
+        if hi <= self.bound: return True
+        if lo > self.bound: return False
+        return None
+
+    def deepen(self):
+        self.children = [c.deepen() for c in self.children]
+        return self
+
+    def flatten(self):
+        self.children = [c.flatten() for c in self.children]
+        return self
+
+    def reduce(self):
+        self.children = [c.reduce() for c in self.children]
+
+        # rule: constant children and zero weights drop out
+        self.bound -= sum(w for (w, c) in zip(self.weights, self.children) if c == True)
+        keep = [(w, c) for (w, c) in zip(self.weights, self.children) if type(c) != Val and w != 0]
+        self.weights = [w for (w, c) in keep]
+        self.children = [c for (w, c) in keep]
+
+        # rule: decided whatever the remaining children are
+        result = self.evaluate({})
+        if result != None:
+            return Val(result)
+
+        return self
+
+    def clone(self):
+        return PB(self.weights, self.bound, *[c.clone() for c in self.children])
+
+    def __eq__(self, other):
+        if type(other) == str:
+            other = parse(other)
+        return type(other) == PB and (self.weights, self.bound) == (other.weights, other.bound) and self.children == other.children
+
+    def __repr__(self):
+        return f'PB({self.weights},{self.bound},' + ','.join([repr(c) for c in self.children]) + ')'
+
+    def __py__(self):
+        return '(' + ' + '.join(f'{w}*({c.__py__()})' for (w, c) in zip(self.weights, self.children)) + f' <= {self.bound})'
+
+    def __c__(self):
+        return '(' + ' + '.join(f'{w}*({c.__c__()})' for (w, c) in zip(self.weights, self.children)) + f' <= {self.bound})'
+
+    def __str__(self):
+        subresults = [f'{w}{c}' for (w, c) in zip(self.weights, self.children)]
+        self._str_cache = f'PB{self.bound}(' + ','.join(sorted(subresults)) + ')'
+        return self._str_cache
+
 class Not(BoolExpr):
     def __init__(self, child):
         super().__init__()
@@ -660,4 +814,46 @@ if __name__ == '__main__':
     e = e.reduce()
     assert e.__py__() == 'True'
 
+    print('-------- test cardinality --------')
+    e = AtMost(1, Var('A'), Var('B'), Not(Var('C')))
+    assert e.evaluate({'A': False, 'B': True, 'C': True}) == True
+    assert e.evaluate({'A': True, 'B': True, 'C': True}) == False
+    assert e.evaluate({'A': True, 'C': True}) == None
+    assert e.evaluate({'A': True, 'B': True}) == False
+    assert AtLeast(2, Var('A'), Var('B'), Var('C')).evaluate({'A': True, 'B': True, 'C': False}) == True
+    assert Exactly(0, Var('A'), Var('B')).evaluate({'A': False, 'B': False}) == True
+    assert e.__py__() == '(sum([A, B, not C]) <= 1)'
+    assert eval(e.__py__(), {'A': False, 'B': True, 'C': True}) == True
+    assert e.clone() == e and id(e.clone()) != id(e)
+    assert str(e) == 'AtMost1(/C,A,B)'
+
+    e = AtMost(1, Var('A'), Val(True), Var('B')).reduce()
+    assert e == AtMost(0, Var('A'), Var('B'))
+    assert AtMost(3, Var('A'), Var('B')).reduce() == True
+    assert AtLeast(3, Var('A'), Var('B')).reduce() == False
+    e = Exactly(1, Var('A'), Var('B'))
+    e.set_variable('A', True)
+    assert e.reduce() == Exactly(0, Var('B'))
+
+    print('-------- test pseudo-Boolean --------')
+    e = PB([3, 2, -2], 2, Var('A'), Var('B'), Not(Var('C')))
+    assert e.evaluate({'A': True, 'B': False, 'C': False}) == True
+    assert e.evaluate({'A': True, 'B': True, 'C': True}) == False
+    assert e.evaluate({'A': True, 'B': False}) == None
+    assert e.evaluate({'A': False}) == True
+    assert eval(e.__py__(), {'A': False, 'B': True, 'C': False}) == True
+    assert eval(e.__py__(), {'A': True, 'B': True, 'C': False}) == False
+    assert str(e) == 'PB2(-2/C,2B,3A)'
+    assert e.clone() == e
+    e = PB([3, 2, 5], 4, Var('A'), Val(True), Var('B')).reduce()
+    assert e == PB([3, 5], 2, Var('A'), Var('B'))
+    assert PB([1, 1], 2, Var('A'), Var('B')).reduce() == True
+    assert PB([1, 1], -1, Var('A'), Var('B')).reduce() == False
+
+    print('-------- test three-valued evaluation --------')
+    e = Or(Xor(Var('A'), Var('B')), Var('C'))
+    assert e.evaluate({'A': True}) == None
+    assert e.evaluate({'A': True, 'C': True}) == True
+    assert e.evaluate({'A': True, 'B': True, 'C': False}) == False
+
     print('pass')
@@ -0,0 +1,276 @@
+# exact model counting (#SAT) over integer CNFs
+#
+# Enumerating with solve_all() costs a solver call per model, hopeless past a
+# few million. This counts instead, the way the component caching counters
+# (cachet, sharpSAT) do, in plain DPLL:
+#
+#   unit propagation after every decision
+#   variables no clause mentions any more count double (or once, see below)
+#   the remaining clauses split into components sharing no variables, the
+#     count is the product of the components' counts
+#   each component's count is cached by its clauses, the same component turns
+#     up again and again under different assignments of the rest
+#   a component is split by deciding its most frequent variable both ways,
+#     occurrences in short clauses counting for more
+#
+# Projected counting counts the distinct assignments of some variables (eg:
+# the inputs, not the Tseytin gates) that extend to a model. Only projection
+# variables are decided, a component without any is just a satisfiability
+# question, 1 or 0, for the CDCL solver.
+#
+# TEST WITH: python -m curiousbits.boolalg.model_count
+
+from .preprocess import unit_propagate, prune_cnf
+
+class Counter(object):
+    # projection: set of variables to count over, None for all
+    # max_cache: components remembered, the cache starts over past this
+    def __init__(self, projection=None, max_cache=1000000):
+        self.projection = projection
+        self.max_cache = max_cache
+        self.cache = {}
+        self.stats = {'decisions': 0, 'components': 0, 'cache_hits': 0}
+
+    # clauses: list of sorted tuples of literals
+    # variables: those the count is over, all in clauses or free
+    #
+    # Depth first with an explicit stack (a level per decision, up to one per
+    # variable, would not fit the recursion limit), of frames:
+    #   ['product', result so far, components left]
+    #   ['split', cache key, clauses, branch literals left, sum so far,
+    #     variables of the component]
+    # value carries the count of whatever just finished up to the frame below.
+    def count(self, clauses, variables):
+        stack = []
+        value = self.start_count(clauses, variables, stack)
+        while stack:
+            frame = stack[-1]
+            if frame[0] == 'product':
+                if value != None:
+                    frame[1] *= value
+                if frame[1] == 0 or not frame[2]:
+                    stack.pop()
+                    value = frame[1]
+                else:
+                    value = self.start_component(frame[2].pop(), stack)
+            else:
+                if value != None:
+                    frame[4] += value
+                if frame[3]:
+                    value = self.start_count(frame[2] + [(frame[3].pop(),)], frame[5], stack)
+                else:
+                    stack.pop()
+                    self.remember(frame[1], frame[4])
+                    value = frame[4]
+        return value
+
+    # the count of clauses if settled at once, else None with a frame pushed
+    def start_count(self, clauses, variables, stack):
+        values = unit_propagate(clauses)
+        if values == None:
+            return 0
+        if values:
+            clauses = [tuple(l for l in c if not abs(l) in values)
+                for c in clauses if not any(values.get(abs(l)) == (l > 0) for l in c)]
+
+        # every way of setting the free variables is a model
+        used = {abs(l) for c in clauses for l in c}
+        free = variables - used - values.keys()
+        if self.projection != None:
+            free &= self.projection
+
+        # the components multiply, in order
+        stack.append(['product', 1 << len(free), components(clauses)[::-1]])
+        return None
+
+    # likewise for one component
+    def start_component(self, clauses, stack):
+        key = tuple(sorted(clauses))
+        result = self.cache.get(key)
+        if result != None:
+            self.stats['cache_hits'] += 1
+            return result
+        self.stats['components'] += 1
+
+        variables = {abs(l) for c in clauses for l in c}
+        deciding = variables if self.projection == None else variables & self.projection
+        if not deciding:
+            result = 1 if satisfiable(clauses) else 0
+            self.remember(key, result)
+            return result
+
+        # occurrences weighted towards short clauses (Jeroslow-Wang, though
+        # with 3 instead of 2 so that the rest of a clause already cut down
+        # beats a fresh one, eg: the pieces of an xor chain)
+        score = {}
+        for c in clauses:
+            weight = 3.0 ** -len(c)
+            for l in c:
+                if abs(l) in deciding:
+                    score[abs(l)] = score.get(abs(l), 0.0) + weight
+        var = max(score, key=score.get)
+        self.stats['decisions'] += 1
+        stack.append(['split', key, clauses, [-var, var], 0, variables])
+        return None
+
+    def remember(self, key, result):
+        if len(self.cache) >= self.max_cache:
+            self.cache.clear()
+        self.cache[key] = result
+
+# clauses -> lists of clauses, connected through shared variables
+def components(clauses):
+    by_var = {}
+    for (k, c) in enumerate(clauses):
+        for l in c:
+            by_var.setdefault(abs(l), []).append(k)
+
+    seen = [False] * len(clauses)
+    result = []
+    for start in range(len(clauses)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        component = []
+        stack = [start]
+        while stack:
+            k = stack.pop()
+            component.append(clauses[k])
+            for l in clauses[k]:
+                for j in by_var.pop(abs(l), []):
+                    if not seen[j]:
+                        seen[j] = True
+                        stack.append(j)
+        result.append(component)
+    return result
+
+def satisfiable(clauses):
+    from .cdcl import Solver
+
+    # compact numbering, the variables of a deep component can be large
+    number = {}
+    solver = Solver()
+    for c in clauses:
+        solver.add_clause([number.setdefault(abs(l), len(number)+1) * (1 if l > 0 else -1) for l in c])
+    return solver.solve()
+
+#------------------------------------------------------------------------------
+# API
+#------------------------------------------------------------------------------
+
+# number of models of cnf (a CNF), or with projection (variable numbers or
+# names) the number of distinct assignments to those that extend to a model
+def count_models(cnf, projection=None):
+    if cnf.n_xors:
+        # the chaining variables are functions of the rest, the count is kept
+        cnf = cnf.expand_xors()
+    if projection != None:
+        projection = {cnf.name2idx[v] if type(v) == str else v for v in projection}
+
+    clauses = [tuple(sorted(set(c))) for c in cnf]
+    # tautologies constrain nothing
+    clauses = [c for c in clauses if not any(-l in c for l in c if l > 0)]
+
+    return Counter(projection).count(clauses, set(range(1, cnf.n_vars+1)))
+
+# number of assignments to the variables of expr (or projection, names) for
+# which it evaluates to desired_output
+def count_solutions(expr, desired_output=True, native_xor=False, projection=None):
+    from .sat_solve import constrained_cnf
+
+    varnames = expr.varnames()
+    projection = set(varnames if projection == None else projection)
+
+    # the one-directional encoding is enough, gates are projected away
+    definitions = []
+    cnf = constrained_cnf(expr, desired_output, pg=True, native_xor=native_xor, definitions=definitions)
+    (reduced, recon) = prune_cnf(cnf, definitions)
+
+    # names of expr fixed by propagation have one value, names not in expr two
+    outside = len(projection - set(varnames))
+    return count_models(reduced, [name for name in projection if name in reduced.name2idx]) << outside
+
+#------------------------------------------------------------------------------
+# tests
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import sys
+    import random
+    import itertools
+
+    from .cnf import CNF
+    from .expr import *
+    from .tools import parse_python, generate
+
+    def brute_force(cnf, projection=None):
+        n = cnf.n_vars
+        found = set()
+        for bits in itertools.product([False, True], repeat=n):
+            if all(any(bits[abs(l)-1] == (l > 0) for l in c) for c in cnf) and \
+                    all(sum(bits[abs(l)-1] == (l > 0) for l in x) % 2 == 1 for x in cnf.xors()):
+                found.add(bits if projection == None else tuple(bits[v-1] for v in sorted(projection)))
+        return len(found)
+
+    def random_cnf(rng, n_vars, n_clauses):
+        cnf = CNF()
+        for i in range(n_vars):
+            cnf.new_var()
+        for i in range(n_clauses):
+            cnf.add_clause([rng.choice([-1, 1]) * rng.randint(1, n_vars) for j in range(rng.randint(1, 3))])
+        return cnf
+
+    # trivia
+    cnf = CNF()
+    assert count_models(cnf) == 1
+    for i in range(3):
+        cnf.new_var()
+    assert count_models(cnf) == 8
+    cnf.add_clause([])
+    assert count_models(cnf) == 0
+
+    # against brute force, with and without projection and xors
+    rng = random.Random(0)
+    for i in range(150):
+        n = rng.randint(1, 10)
+        cnf = random_cnf(rng, n, rng.randint(0, 3 * n))
+        if i % 3 == 0:
+            cnf.add_xor([rng.choice([-1, 1]) * v for v in rng.sample(range(1, n+1), min(n, 3))])
+        assert count_models(cnf) == brute_force(cnf), i
+        projection = set(rng.sample(range(1, n+1), rng.randint(0, n)))
+        assert count_models(cnf, projection) == brute_force(cnf, projection), i
+
+    # expressions, against their truth tables
+    for n_nodes in range(1, 30):
+        expr = generate(n_nodes, list('ABCDEF'))
+        names = sorted(expr.varnames())
+        table = [expr.evaluate(dict(zip(names, bits))) for bits in itertools.product([False, True], repeat=len(names))]
+        assert count_solutions(expr) == table.count(True)
+        assert count_solutions(expr, desired_output=False) == table.count(False)
+        assert count_solutions(expr, projection=names + ['Z']) == 2 * table.count(True)
+
+    expr = parse_python('(A and B) or (C and not D) or (B ^ E)')
+    assert count_solutions(expr) == 23
+    assert count_solutions(expr, projection=['A', 'B']) == 4
+    assert count_solutions(parse_python('A and not A')) == 0
+
+    # far past enumeration
+    xs = [Var(f'x{i}') for i in range(40)]
+    assert count_solutions(Or(*xs)) == 2**40 - 1
+    assert count_solutions(Xor(*xs), native_xor=True) == 2**39
+    assert count_solutions(AtMost(3, *xs[:24])) == 1 + 24 + 276 + 2024
+    # a decision per variable, deeper than the recursion limit allows
+    cnf = CNF()
+    xs = [cnf.new_var() for i in range(120)]
+    cnf.add_clauses([[-a, -b] for (a, b) in itertools.combinations(xs, 2)])
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(100)
+    try:
+        assert count_models(cnf) == 121
+    finally:
+        sys.setrecursionlimit(limit)
+
+    # independent blocks multiply, found as components
+    blocks = [parse_python(f'(a{i} or b{i}) and (b{i} ^ c{i})') for i in range(20)]
+    assert count_solutions(And(*blocks)) == 3**20
+
+    print('pass')
@@ -0,0 +1,324 @@
+# run several solver configurations on one CNF at once, first answer wins
+#
+# Hard instances vary enormously in run time across solvers and random seeds,
+# so with idle cores it pays to race a few: different programs, the same
+# program with different seeds, the built-in solver with different seeds.
+# Each configuration gets its own process, when one answers the others are
+# killed (and waited for, nothing is left running).
+#
+# A configuration is a (solver, options) pair:
+#   ('builtin', {'seed': 1})               keyword arguments of cdcl.Solver
+#   ('cryptominisat5', ['--random', '1'])  a program and extra arguments
+#
+# Every race updates per configuration statistics. When there are more
+# configurations than workers, the ones with the best record so far run.
+#
+#   portfolio = Portfolio([('builtin', {'seed': s}) for s in range(4)])
+#   solve(expr, solver=portfolio)
+#   print(portfolio.ranking())
+#
+# TEST WITH: python -m curiousbits.boolalg.portfolio
+
+import os
+import time
+import queue
+import threading
+import subprocess
+
+def config_name(config):
+    (solver, options) = config
+    if solver == 'builtin':
+        return ' '.join(['builtin'] + [f'{k}={v}' for (k, v) in sorted(options.items())])
+    return ' '.join([solver] + list(options))
+
+#------------------------------------------------------------------------------
+# jobs
+#------------------------------------------------------------------------------
+
+# runs in the child process of a built-in configuration
+def run_builtin(conn, cnf, options):
+    from .cdcl import Solver
+
+    solver = Solver(cnf, **options)
+    conn.send(solver.model if solver.solve() else None)
+    conn.close()
+
+# each job runs on its own thread, puts (index, outcome, result) on results
+# when done, and can be cancelled from any thread
+class BuiltinJob(object):
+    def __init__(self, index, cnf, options, results):
+        import multiprocessing
+
+        (self.conn, child_conn) = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=run_builtin, args=(child_conn, cnf, options), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        self.thread = threading.Thread(target=self.wait, args=(index, results), daemon=True)
+        self.thread.start()
+
+    def wait(self, index, results):
+        try:
+            model = self.conn.recv()
+            results.put((index, 'sat' if model != None else 'unsat', model))
+        except (EOFError, OSError) as e:
+            results.put((index, 'error', e))
+
+    def cancel(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.thread.join()
+        self.conn.close()
+
+class ProgramJob(object):
+    def __init__(self, index, cmd, dimacs, n_vars, results):
+        from .sat_solve import parse_solution
+
+        self.parse_solution = parse_solution
+        self.n_vars = n_vars
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        self.thread = threading.Thread(target=self.wait, args=(index, dimacs, results), daemon=True)
+        self.thread.start()
+
+    def wait(self, index, dimacs, results):
+        try:
+            (stdout, stderr) = self.process.communicate(dimacs.encode('utf-8'))
+            model = self.parse_solution(stdout.decode('utf-8'), self.n_vars)
+            results.put((index, 'sat' if model != None else 'unsat', model))
+        except Exception as e:
+            results.put((index, 'error', e))
+
+    def cancel(self):
+        if self.process.poll() == None:
+            self.process.kill()
+        self.thread.join()
+
+#------------------------------------------------------------------------------
+# portfolio
+#------------------------------------------------------------------------------
+
+class Portfolio(object):
+    # configs: [(solver, options), ...], see above
+    # max_workers: configurations raced at once, None for all of them
+    def __init__(self, configs, max_workers=None):
+        assert configs, 'a portfolio needs at least one configuration'
+        self.configs = list(configs)
+        self.max_workers = max_workers or len(self.configs)
+        # name -> {'runs', 'wins', 'seconds' (total time to win)}
+        self.stats = {config_name(c): {'runs': 0, 'wins': 0, 'seconds': 0.0} for c in self.configs}
+        self.last_winner = None
+        self._lock = threading.Lock()
+
+    # wins with add-one smoothing, so untried configurations are not ruled out
+    def score(self, config):
+        s = self.stats[config_name(config)]
+        return (s['wins'] + 1) / (s['runs'] + 2)
+
+    # the configurations to race next, best record first
+    def select(self):
+        with self._lock:
+            ranked = sorted(self.configs, key=self.score, reverse=True)
+        return ranked[:self.max_workers]
+
+    # [(name, wins, runs), ...] best first
+    def ranking(self):
+        with self._lock:
+            ranked = sorted(self.configs, key=self.score, reverse=True)
+            return [(config_name(c), self.stats[config_name(c)]['wins'], self.stats[config_name(c)]['runs'])
+                for c in ranked]
+
+    # same contract as sat_solve.solve_cnf_lits(): a model (list of literals)
+    # or None if unsatisfiable
+    #
+    # timeout: seconds, subprocess.TimeoutExpired is raised once they pass
+    # with no answer, every job is cancelled either way
+    def solve_cnf_lits(self, cnf, timeout=None):
+        from .sat_solve import XOR_SOLVERS, to_dimacs
+
+        n_vars = cnf.n_vars
+        chosen = self.select()
+
+        # what each kind of configuration is given, made once
+        expanded = None
+        dimacs = {}
+        def problem(solver):
+            nonlocal expanded
+            native = cnf.n_xors == 0 or (solver != 'builtin' and os.path.basename(solver) in XOR_SOLVERS)
+            if not native and expanded == None:
+                expanded = cnf.expand_xors()
+            problem = cnf if native else expanded
+            if solver == 'builtin':
+                return problem
+            if not native in dimacs:
+                dimacs[native] = to_dimacs(problem)[0]
+            return dimacs[native]
+
+        results = queue.Queue()
+        jobs = []
+        winner = None
+        t0 = time.time()
+        try:
+            for (index, (solver, options)) in enumerate(chosen):
+                # one that cannot start (eg: not installed) has failed, like
+                # one that crashes
+                try:
+                    if solver == 'builtin':
+                        jobs.append(BuiltinJob(index, problem(solver), options, results))
+                    else:
+                        jobs.append(ProgramJob(index, [solver] + list(options), problem(solver), n_vars, results))
+                except OSError as e:
+                    results.put((index, 'error', e))
+
+            # first definite answer wins, errors only matter if all fail
+            errors = []
+            while True:
+                remaining = None if timeout == None else timeout - (time.time() - t0)
+                if remaining != None and remaining <= 0:
+                    raise subprocess.TimeoutExpired('portfolio', timeout)
+                try:
+                    (index, outcome, result) = results.get(timeout=remaining)
+                except queue.Empty:
+                    raise subprocess.TimeoutExpired('portfolio', timeout)
+                if outcome != 'error':
+                    winner = config_name(chosen[index])
+                    break
+                errors.append(result)
+                if len(errors) == len(chosen):
+                    raise Exception(f'every solver in the portfolio failed: {errors}')
+        finally:
+            for job in jobs:
+                job.cancel()
+
+            # every configuration raced has run, timeouts and failures are
+            # losses too
+            with self._lock:
+                for config in chosen:
+                    self.stats[config_name(config)]['runs'] += 1
+                if winner != None:
+                    self.stats[winner]['wins'] += 1
+                    self.stats[winner]['seconds'] += time.time() - t0
+                    self.last_winner = winner
+
+        return None if result == None else result[:n_vars]
+
+# one seeded built-in configuration per core, plus CryptoMiniSat with seeds
+# if it is installed
+_default_portfolio = None
+
+def default_portfolio():
+    global _default_portfolio
+    if _default_portfolio == None:
+        import shutil
+        n = os.cpu_count() or 1
+        configs = []
+        if shutil.which('cryptominisat5'):
+            configs += [('cryptominisat5', ['--random', str(seed)]) for seed in range(n)]
+        configs += [('builtin', {'seed': seed}) for seed in range(n)]
+        _default_portfolio = Portfolio(configs, max_workers=n)
+    return _default_portfolio
+
+#------------------------------------------------------------------------------
+# tests
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import sys
+    import random
+
+    from .cnf import CNF
+    from .tools import parse_python
+    from .sat_solve import solve, solve_all, solve_cnf, solve_cnf_lits
+
+    def satisfies(cnf, model):
+        values = {abs(l): l > 0 for l in model}
+        return all(any(values.get(abs(l), False) == (l > 0) for l in c) for c in cnf) and \
+            all(sum(values.get(abs(l), False) == (l > 0) for l in x) % 2 == 1 for x in cnf.xors())
+
+    def random_cnf(rng, n_vars, n_clauses, k=3):
+        cnf = CNF()
+        for i in range(n_vars):
+            cnf.new_var()
+        for i in range(n_clauses):
+            cnf.add_clause([rng.choice([-1, 1]) * v for v in rng.sample(range(1, n_vars+1), k)])
+        return cnf
+
+    assert config_name(('builtin', {'seed': 3})) == 'builtin seed=3'
+    assert config_name(('cryptominisat5', ['--random', '1'])) == 'cryptominisat5 --random 1'
+
+    print('-------- builtin seeds')
+    portfolio = Portfolio([('builtin', {'seed': s}) for s in range(3)])
+    rng = random.Random(1)
+    for i in range(6):
+        cnf = random_cnf(rng, 40, 170)
+        model = portfolio.solve_cnf_lits(cnf)
+        expected = solve_cnf_lits(cnf, 'builtin')
+        assert (model == None) == (expected == None)
+        assert model == None or satisfies(cnf, model)
+    assert sum(wins for (name, wins, runs) in portfolio.ranking()) == 6
+    assert all(runs == 6 for (name, wins, runs) in portfolio.ranking())
+
+    print('-------- through solve() and solve_cnf()')
+    expr = parse_python('(A or B) and (not A or C) and (B ^ C)')
+    assert expr.evaluate(solve(expr, solver=portfolio)) == True
+    assert solve(parse_python('A and not A'), solver=portfolio) == {}
+    cnf = CNF()
+    (a, b) = (cnf.var('A'), cnf.var('B'))
+    cnf.add_clause([a, b])
+    cnf.add_xor([a, b])
+    solution = solve_cnf(cnf, solver=portfolio)
+    assert solution['A'] != solution['B']
+    assert len(solve_all(parse_python('(A or B) and (C ^ A)'), solver=portfolio)) == 3
+
+    print('-------- programs, the losers are killed')
+    # a program that never answers, and one that fails
+    slow = [sys.executable, '-c', 'import time; time.sleep(30)']
+    broken = [sys.executable, '-c', 'import sys; sys.exit(3)']
+    portfolio = Portfolio([(slow[0], slow[1:]), (broken[0], broken[1:]), ('builtin', {})])
+    t0 = time.time()
+    cnf = random_cnf(random.Random(2), 30, 100)
+    model = portfolio.solve_cnf_lits(cnf)
+    assert model == None or satisfies(cnf, model)
+    assert portfolio.last_winner == 'builtin'
+    assert time.time() - t0 < 10
+
+    # timeout, nothing answers
+    portfolio = Portfolio([(slow[0], slow[1:])] * 2)
+    t0 = time.time()
+    try:
+        portfolio.solve_cnf_lits(cnf, timeout=0.3)
+        assert False
+    except subprocess.TimeoutExpired:
+        pass
+    assert time.time() - t0 < 5
+
+    # both copies (one name) ran and lost
+    assert [(wins, runs) for (name, wins, runs) in portfolio.ranking()] == [(0, 2), (0, 2)]
+
+    # all fail
+    portfolio = Portfolio([(broken[0], broken[1:])])
+    try:
+        portfolio.solve_cnf_lits(cnf)
+        assert False
+    except Exception as e:
+        assert 'failed' in str(e)
+    assert portfolio.ranking()[0][1:] == (0, 1)
+
+    # one not installed is just a failed configuration
+    portfolio = Portfolio([('no-such-solver', []), ('builtin', {})])
+    model = portfolio.solve_cnf_lits(cnf)
+    assert model == None or satisfies(cnf, model)
+    assert portfolio.last_winner == 'builtin'
+    assert portfolio.ranking() == [('builtin', 1, 1), ('no-such-solver', 0, 1)]
+
+    print('-------- adaptation')
+    # with one worker, the configuration that keeps winning keeps running
+    portfolio = Portfolio([('builtin', {'seed': 0}), ('builtin', {'seed': 1})], max_workers=1)
+    for i in range(3):
+        portfolio.solve_cnf_lits(random_cnf(rng, 20, 60))
+    assert portfolio.ranking()[0] == ('builtin seed=0', 3, 3)
+    assert portfolio.ranking()[1] == ('builtin seed=1', 0, 0)
+    portfolio.stats['builtin seed=0']['runs'] += 10
+    assert [c for c in portfolio.select()] == [('builtin', {'seed': 1})]
+
+    print('pass')
@@ -0,0 +1,775 @@
+# shrink a CNF before handing it to a solver, keeping what is needed to turn
+# a model of the smaller CNF back into a model of the original
+#
+# prune_cnf() does two things for Tseytin output:
+#
+#   unit propagation: the output unit clause (and constants) force many gates,
+#     forced variables are fixed and drop out with every clause they satisfy
+#
+#   cone of influence: a gate definition only matters if something constrains
+#     the gate, a definition can always be satisfied by giving the gate (and
+#     any helper variables of its counter etc.) the right values, so the
+#     definitions no constraint reaches are set aside
+#
+# simplify_cnf() works on any CNF with the classic rewrites of SatELite (and
+# MiniSat's simp), run in rounds until nothing changes:
+#
+#   unit propagation
+#   equivalent literals: the literals of a strongly connected component of
+#     the binary implication graph are all equal, one is substituted for all
+#   subsumption: a clause containing all of another clause goes
+#   self-subsumption: from C+l and D+/l with C in D, /l is dropped
+#   pure literals: a variable of one sign only is set to satisfy its clauses
+#   bounded variable elimination: the clauses of a variable are replaced by
+#     their resolvents on it, when there are no more of those
+#
+# Tseytin output is full of this: gates whose definitions resolve away, buffer
+# and inverter chains, clauses of a fixed gate subsumed by others.
+#
+# The reduced CNF is renumbered compactly, named variables keep their names.
+# Its models go back through Reconstruction.extend().
+
+from .cnf import CNF
+
+class Reconstruction(object):
+    def __init__(self, n_vars):
+        # variables of the original CNF
+        self.n_vars = n_vars
+        # reduced variable -> original variable, [0] unused
+        self.old_var = [0]
+        # original variable -> value, for variables fixed by propagation
+        self.fixed = {}
+        # definitions set aside, in original numbering, one clause list per
+        # gate with its inputs first, satisfied in order once everything else
+        # has a value
+        self.removed = []
+        # variables taken out by simplify_cnf(), undone last first:
+        #   ('equal', var, lit): var has the value of lit
+        #   ('eliminated', var, clauses): var set to satisfy clauses
+        self.stack = []
+
+    # model of the reduced CNF (a list of literals) -> model of the original
+    def extend(self, model):
+        values = dict(self.fixed)
+        for lit in model:
+            values[self.old_var[abs(lit)]] = lit > 0
+        for (kind, var, arg) in reversed(self.stack):
+            if kind == 'equal':
+                values[var] = values.get(abs(arg), False) == (arg > 0)
+            else:
+                values[var] = False
+                for clause in arg:
+                    if not any(values.get(abs(l), False) == (l > 0) for l in clause):
+                        values[var] = True
+                        break
+        for clauses in self.removed:
+            values = complete(clauses, values)
+            assert values != None, 'set aside clauses must be satisfiable'
+        return [v if values.get(v, False) else -v for v in range(1, self.n_vars+1)]
+
+# values extended by unit propagation over clauses, or None on conflict
+def propagate_clauses(clauses, values):
+    changed = True
+    while changed:
+        changed = False
+        for clause in clauses:
+            if any(values.get(abs(l)) == (l > 0) for l in clause):
+                continue
+            free = [l for l in clause if not abs(l) in values]
+            if not free:
+                return None
+            if len(free) == 1:
+                values[abs(free[0])] = free[0] > 0
+                changed = True
+    return values
+
+# values extended to satisfy clauses, or None
+#
+# The clauses are one set-aside gate definition with its inputs already set,
+# so propagation nearly always settles it. What is left open (a gate encoded
+# in one direction only) is decided to satisfy the first open clause, with a
+# search over the other choices, up to max_steps, if that runs into a
+# conflict.
+def complete(clauses, values, max_steps=10000):
+    stack = [dict(values)]
+    for step in range(max_steps):
+        if not stack:
+            break
+        values = propagate_clauses(clauses, stack.pop())
+        if values == None:
+            continue
+        branch = None
+        for clause in clauses:
+            if not any(values.get(abs(l)) == (l > 0) for l in clause):
+                branch = next(l for l in clause if not abs(l) in values)
+                break
+        if branch == None:
+            return values
+        stack.append({**values, abs(branch): branch < 0})
+        stack.append({**values, abs(branch): branch > 0})
+    return None
+
+# {gate: clauses} -> the clause lists, each gate after the gates its clauses
+# mention (its inputs)
+def definition_order(definitions):
+    result = []
+    seen = set()
+    for root in definitions:
+        stack = [(root, False)]
+        while stack:
+            (g, ready) = stack.pop()
+            if ready:
+                result.append(definitions[g])
+                continue
+            if g in seen:
+                continue
+            seen.add(g)
+            stack.append((g, True))
+            for clause in definitions[g]:
+                for l in clause:
+                    if abs(l) in definitions and not abs(l) in seen:
+                        stack.append((abs(l), False))
+    return result
+
+# returns {var: value} of everything forced, or None on conflict
+def unit_propagate(clauses):
+    values = {}
+    # clauses containing each literal, to revisit when it becomes false
+    occurs = {}
+    queue = []
+    for (k, clause) in enumerate(clauses):
+        if len(clause) == 0:
+            return None
+        if len(clause) == 1:
+            queue.append(clause[0])
+        for l in clause:
+            occurs.setdefault(l, []).append(k)
+
+    while queue:
+        lit = queue.pop()
+        value = values.get(abs(lit))
+        if value != None:
+            if value != (lit > 0):
+                return None
+            continue
+        values[abs(lit)] = lit > 0
+
+        for k in occurs.get(-lit, []):
+            free = None
+            n_free = 0
+            for l in clauses[k]:
+                value = values.get(abs(l))
+                if value == (l > 0):
+                    break
+                if value == None:
+                    free = l
+                    n_free += 1
+            else:
+                if n_free == 0:
+                    return None
+                if n_free == 1:
+                    queue.append(free)
+
+    return values
+
+# cnf: a CNF
+# definitions: [(gate variable, first clause, end clause), ...] as recorded by
+#   TseytinEncoder, without it only unit propagation is done
+#
+# returns (reduced CNF, Reconstruction), the reduced CNF is a single empty
+# clause if propagation finds a conflict
+def prune_cnf(cnf, definitions=None):
+    clauses = [list(c) for c in cnf]
+    recon = Reconstruction(cnf.n_vars)
+
+    values = unit_propagate(clauses)
+    if values == None:
+        reduced = CNF()
+        reduced.add_clause([])
+        return (reduced, recon)
+    recon.fixed = values
+
+    # owner[k]: innermost gate whose definition added clause k, None for
+    # constraints (a gate made while defining another, eg: in a PB adder, is
+    # memoized and may be shared, so its clauses must stay its own)
+    owner = [None] * len(clauses)
+    for (g, start, end) in definitions or []:
+        for k in range(start, end):
+            if owner[k] == None:
+                owner[k] = g
+
+    # simplify under the fixed values, what is left of the definition of a
+    # fixed gate constrains its inputs, so becomes a constraint itself
+    remaining = []
+    for (k, clause) in enumerate(clauses):
+        if any(values.get(abs(l)) == (l > 0) for l in clause):
+            continue
+        g = owner[k] if not owner[k] in values else None
+        remaining.append((g, [l for l in clause if not abs(l) in values]))
+
+    # XOR constraints are kept as constraints, with fixed literals folded in
+    xors = []
+    for lits in cnf.xors():
+        parity = True
+        free = []
+        for l in lits:
+            if abs(l) in values:
+                parity ^= values[abs(l)] == (l > 0)
+            else:
+                free.append(l)
+        if free:
+            xors.append([free[0] if parity else -free[0]] + free[1:])
+        elif parity:
+            # odd parity still required of nothing
+            remaining.append((None, []))
+
+    # cone of influence: from the constraints, through the definitions of
+    # every gate they mention
+    owned = {}
+    for (i, (g, clause)) in enumerate(remaining):
+        if g != None:
+            owned.setdefault(g, []).append(i)
+    stack = [abs(l) for (g, clause) in remaining if g == None for l in clause]
+    stack += [abs(l) for lits in xors for l in lits]
+    reached = set()
+    in_cone = set()
+    while stack:
+        var = stack.pop()
+        if var in reached:
+            continue
+        reached.add(var)
+        for i in owned.get(var, []):
+            in_cone.add(i)
+            stack.extend(abs(l) for l in remaining[i][1])
+
+    kept = []
+    removed = {}
+    for (i, (g, clause)) in enumerate(remaining):
+        if g == None or i in in_cone:
+            kept.append(clause)
+        else:
+            removed.setdefault(g, []).append(clause)
+    recon.removed.extend(definition_order(removed))
+
+    # renumber: variables still in some clause, and named ones not fixed
+    reduced = CNF()
+    new_var = {}
+    used = {abs(l) for clause in kept for l in clause} | {abs(l) for lits in xors for l in lits}
+    for var in range(1, cnf.n_vars+1):
+        if var in used or (cnf.names[var] != None and not var in values):
+            new_var[var] = reduced.new_var(cnf.names[var])
+            recon.old_var.append(var)
+    for clause in kept:
+        reduced.add_clause([new_var[l] if l > 0 else -new_var[-l] for l in clause])
+    for lits in xors:
+        reduced.add_xor([new_var[l] if l > 0 else -new_var[-l] for l in lits])
+
+    return (reduced, recon)
+
+#------------------------------------------------------------------------------
+# simplification
+#------------------------------------------------------------------------------
+
+class Simplifier(object):
+    # frozen: variables never eliminated or substituted away
+    # max_occurrences: variables in more clauses than this are not eliminated
+    # max_resolvent: longest resolvent a variable elimination may add
+    def __init__(self, cnf, frozen=(), max_occurrences=16, max_resolvent=20):
+        self.n_vars = cnf.n_vars
+        self.frozen = set(frozen)
+        self.max_occurrences = max_occurrences
+        self.max_resolvent = max_resolvent
+
+        self.clauses = []           # lists of literals, None once removed
+        self.occurs = {}            # literal -> set of clause indices
+        self.fixed = {}
+        self.stack = []
+        self.units = []
+        self.ok = True
+        self.stats = {'fixed': 0, 'equal': 0, 'subsumed': 0, 'strengthened': 0, 'pure': 0, 'eliminated': 0}
+
+        # xors are kept as they are, their variables frozen
+        self.xors = [list(x) for x in cnf.xors()]
+        self.frozen |= {abs(l) for x in self.xors for l in x}
+
+        for clause in cnf:
+            self.add(list(clause))
+
+    #--------------------------------------------------------------------------
+    # clauses
+    #--------------------------------------------------------------------------
+
+    def add(self, lits):
+        clause = []
+        for l in lits:
+            value = self.fixed.get(abs(l))
+            if value == (l > 0) or -l in clause:
+                return
+            if value == None and not l in clause:
+                clause.append(l)
+        if not clause:
+            self.ok = False
+            return
+        if len(clause) == 1:
+            self.units.append(clause[0])
+        k = len(self.clauses)
+        self.clauses.append(clause)
+        for l in clause:
+            self.occurs.setdefault(l, set()).add(k)
+
+    def remove(self, k):
+        for l in self.clauses[k]:
+            self.occurs[l].discard(k)
+        self.clauses[k] = None
+
+    def strengthen(self, k, lit):
+        clause = self.clauses[k]
+        clause.remove(lit)
+        self.occurs[lit].discard(k)
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            self.units.append(clause[0])
+
+    def occurrences(self, lit):
+        return self.occurs.get(lit, ())
+
+    #--------------------------------------------------------------------------
+    # rewrites, each returns whether it changed anything
+    #--------------------------------------------------------------------------
+
+    def propagate(self):
+        changed = False
+        while self.units and self.ok:
+            lit = self.units.pop()
+            value = self.fixed.get(abs(lit))
+            if value != None:
+                if value != (lit > 0):
+                    self.ok = False
+                continue
+            self.fixed[abs(lit)] = lit > 0
+            self.stats['fixed'] += 1
+            changed = True
+            for k in list(self.occurrences(lit)):
+                self.remove(k)
+            for k in list(self.occurrences(-lit)):
+                self.strengthen(k, -lit)
+        return changed
+
+    # strongly connected components of the binary implication graph, by
+    # Tarjan's algorithm without recursion
+    def equivalences(self):
+        graph = {}
+        for clause in self.clauses:
+            if clause != None and len(clause) == 2:
+                (a, b) = clause
+                graph.setdefault(-a, []).append(b)
+                graph.setdefault(-b, []).append(a)
+
+        index = {}
+        low = {}
+        on_stack = set()
+        stack = []
+        sccs = []
+        for root in graph:
+            if root in index:
+                continue
+            work = [(root, 0)]
+            while work:
+                (node, i) = work.pop()
+                if i == 0:
+                    index[node] = low[node] = len(index)
+                    stack.append(node)
+                    on_stack.add(node)
+                successors = graph.get(node, [])
+                if i < len(successors):
+                    work.append((node, i+1))
+                    succ = successors[i]
+                    if not succ in index:
+                        work.append((succ, 0))
+                    elif succ in on_stack:
+                        low[node] = min(low[node], index[succ])
+                    continue
+                if low[node] == index[node]:
+                    scc = []
+                    while True:
+                        l = stack.pop()
+                        on_stack.discard(l)
+                        scc.append(l)
+                        if l == node:
+                            break
+                    if len(scc) > 1:
+                        sccs.append(scc)
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+
+        # substitute a representative for the rest of each component, a frozen
+        # variable if there is one
+        substitute = {}
+        for scc in sccs:
+            if any(-l in scc for l in scc):
+                self.ok = False
+                return False
+            rep = min(scc, key=lambda l: (not abs(l) in self.frozen, abs(l)))
+            for l in scc:
+                var = abs(l)
+                if var != abs(rep) and not var in self.frozen and not var in substitute:
+                    substitute[var] = rep if l > 0 else -rep
+        # mirror components map a variable twice, the same way
+        for (var, lit) in list(substitute.items()):
+            while abs(lit) in substitute:
+                lit = substitute[abs(lit)] if lit > 0 else -substitute[abs(lit)]
+            substitute[var] = lit
+
+        for (var, lit) in substitute.items():
+            self.stack.append(('equal', var, lit))
+            self.stats['equal'] += 1
+            for k in list(self.occurrences(var)) + list(self.occurrences(-var)):
+                clause = self.clauses[k]
+                if clause == None:
+                    continue
+                self.remove(k)
+                self.add([(lit if l > 0 else -lit) if abs(l) == var else l for l in clause])
+        return bool(substitute)
+
+    def subsume(self):
+        changed = False
+        order = sorted((k for (k, c) in enumerate(self.clauses) if c != None), key=lambda k: len(self.clauses[k]))
+        for k in order:
+            clause = self.clauses[k]
+            if clause == None:
+                continue
+            lits = set(clause)
+
+            # subsumption: candidates all contain the rarest literal
+            rarest = min(clause, key=lambda l: len(self.occurrences(l)))
+            for j in list(self.occurrences(rarest)):
+                other = self.clauses[j]
+                if j != k and len(other) >= len(clause) and lits.issubset(other):
+                    self.remove(j)
+                    self.stats['subsumed'] += 1
+                    changed = True
+
+            # self-subsumption: C+l strengthens D+/l to D when C is in D
+            for l in clause:
+                rest = lits - {l}
+                for j in list(self.occurrences(-l)):
+                    other = self.clauses[j]
+                    if len(other) >= len(clause) and rest.issubset(other):
+                        self.strengthen(j, -l)
+                        self.stats['strengthened'] += 1
+                        changed = True
+            if not self.ok:
+                return changed
+        return changed
+
+    def pure_literals(self):
+        changed = False
+        for var in range(1, self.n_vars+1):
+            if var in self.frozen or var in self.fixed:
+                continue
+            (pos, neg) = (self.occurrences(var), self.occurrences(-var))
+            if bool(pos) != bool(neg):
+                ks = list(pos or neg)
+                self.stack.append(('eliminated', var, [list(self.clauses[k]) for k in ks]))
+                for k in ks:
+                    self.remove(k)
+                self.stats['pure'] += 1
+                changed = True
+        return changed
+
+    def eliminate(self):
+        changed = False
+        candidates = []
+        for var in range(1, self.n_vars+1):
+            if var in self.frozen or var in self.fixed:
+                continue
+            (n_pos, n_neg) = (len(self.occurrences(var)), len(self.occurrences(-var)))
+            if n_pos and n_neg and n_pos + n_neg <= self.max_occurrences:
+                candidates.append((n_pos * n_neg, var))
+        candidates.sort()
+
+        for (cost, var) in candidates:
+            pos = [self.clauses[k] for k in self.occurrences(var)]
+            neg = [self.clauses[k] for k in self.occurrences(-var)]
+            if not pos or not neg or len(pos) + len(neg) > self.max_occurrences:
+                continue
+
+            resolvents = []
+            for p in pos:
+                for n in neg:
+                    r = set(p) | set(n)
+                    r.discard(var)
+                    r.discard(-var)
+                    if any(-l in r for l in r):
+                        continue
+                    if len(r) > self.max_resolvent:
+                        break
+                    resolvents.append(list(r))
+                else:
+                    continue
+                break
+            else:
+                if len(resolvents) > len(pos) + len(neg):
+                    continue
+                self.stack.append(('eliminated', var, [list(c) for c in pos + neg]))
+                for k in list(self.occurrences(var)) + list(self.occurrences(-var)):
+                    self.remove(k)
+                for r in resolvents:
+                    self.add(r)
+                self.stats['eliminated'] += 1
+                changed = True
+                self.propagate()
+                if not self.ok:
+                    return changed
+        return changed
+
+    def run(self, max_rounds=10):
+        self.propagate()
+        for i in range(max_rounds):
+            changed = False
+            for step in [self.equivalences, self.propagate, self.subsume, self.propagate,
+                    self.pure_literals, self.eliminate, self.propagate]:
+                if not self.ok:
+                    return
+                changed |= step()
+            if not changed:
+                break
+
+# cnf: a CNF
+# frozen: variables to keep, eg: those blocking clauses will mention
+#
+# returns (reduced CNF, Reconstruction) like prune_cnf()
+def simplify_cnf(cnf, frozen=()):
+    simp = Simplifier(cnf, frozen)
+    simp.run()
+
+    recon = Reconstruction(cnf.n_vars)
+    if not simp.ok:
+        reduced = CNF()
+        reduced.add_clause([])
+        return (reduced, recon)
+    recon.fixed = dict(simp.fixed)
+    recon.stack = simp.stack
+
+    # fixed literals folded into the xors
+    xors = []
+    empty_xor = False
+    for lits in simp.xors:
+        parity = True
+        free = []
+        for l in lits:
+            if abs(l) in simp.fixed:
+                parity ^= simp.fixed[abs(l)] == (l > 0)
+            else:
+                free.append(l)
+        if free:
+            xors.append([free[0] if parity else -free[0]] + free[1:])
+        elif parity:
+            empty_xor = True
+
+    # renumber: variables still in use, frozen ones and named ones left
+    kept = [c for c in simp.clauses if c != None]
+    used = {abs(l) for c in kept for l in c} | {abs(l) for x in xors for l in x}
+    gone = set(simp.fixed) | {var for (kind, var, arg) in simp.stack}
+    reduced = CNF()
+    new_var = {}
+    for var in range(1, cnf.n_vars+1):
+        if var in used or (not var in gone and (var in simp.frozen or cnf.names[var] != None)):
+            new_var[var] = reduced.new_var(cnf.names[var])
+            recon.old_var.append(var)
+    for clause in kept:
+        reduced.add_clause([new_var[l] if l > 0 else -new_var[-l] for l in clause])
+    for lits in xors:
+        reduced.add_xor([new_var[l] if l > 0 else -new_var[-l] for l in lits])
+    if empty_xor:
+        reduced.add_clause([])
+
+    return (reduced, recon)
+
+#------------------------------------------------------------------------------
+# tests
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import itertools
+
+    from .expr import *
+    from .tools import parse_python, generate
+    from .tseytin import Tseytin_encode, Tseytin_encode_many
+
+    def satisfies(cnf, model):
+        values = {abs(l): l > 0 for l in model}
+        return all(any(values[abs(l)] == (l > 0) for l in c) for c in cnf) and \
+            all(sum(values[abs(l)] == (l > 0) for l in x) % 2 == 1 for x in cnf.xors())
+
+    # all models, brute force
+    def models(cnf):
+        n = cnf.n_vars
+        for bits in itertools.product([False, True], repeat=n):
+            model = [v if b else -v for (v, b) in zip(range(1, n+1), bits)]
+            if satisfies(cnf, model):
+                yield model
+
+    def inputs(cnf, model, names):
+        return tuple(model[cnf.var(name)-1] > 0 for name in names)
+
+    # the reduced CNF has exactly the input projections of the original, and
+    # every one of its models extends to a model of the original
+    def check(expr, desired=True, polarity=0, native_xor=False):
+        definitions = []
+        cnf, out = Tseytin_encode(expr, polarity, definitions=definitions, native_xor=native_xor)
+        cnf.add_clause([out if desired else -out])
+        (reduced, recon) = prune_cnf(cnf, definitions)
+        assert reduced.n_vars <= cnf.n_vars and len(reduced) <= len(cnf)
+
+        names = sorted(expr.varnames())
+        expected = {tuple(bits) for bits in itertools.product([False, True], repeat=len(names))
+                    if expr.evaluate(dict(zip(names, bits))) == desired}
+        found = set()
+        for model in models(reduced):
+            full = recon.extend(model)
+            assert satisfies(cnf, full)
+            found.add(inputs(cnf, full, names))
+        assert found == expected, (expr, found, expected)
+        return (cnf, reduced)
+
+    # units: an asserted AND fixes everything
+    cnf, reduced = check(parse_python('A and B and not C'))
+    assert reduced.n_vars == 0 and len(reduced) == 0
+
+    # an asserted OR of ANDs: the OR gate is fixed, the ANDs remain
+    cnf, reduced = check(parse_python('(A and B) or (C and D)'))
+    assert reduced.n_vars < cnf.n_vars
+
+    check(parse_python('(A ^ B) or (C and not A)'), desired=False)
+    check(parse_python('(A ^ B) ^ (B or C)'), native_xor=True)
+    check(parse_python('A and not A'))
+    check(AtMost(1, Var('A'), Var('B'), Var('C')))
+    check(And(Exactly(2, Var('A'), Var('B'), Var('C'), Var('D')), Var('A')))
+    for n_nodes in range(1, 25):
+        expr = generate(n_nodes, list('ABCDE'))
+        check(expr)
+        check(expr, desired=False, polarity=-1)
+
+    # conflict
+    (reduced, recon) = prune_cnf(CNF.from_expr(parse_python('A and (not A or B) and not B')))
+    assert [list(c) for c in reduced] == [[]]
+
+    # cone of influence: roots encoded together, only one constrained
+    definitions = []
+    cnf, outs = Tseytin_encode_many([parse_python('(A and B) or C'), parse_python('(A or D) and (B ^ D)')],
+        definitions=definitions)
+    cnf.add_clause([outs[0]])
+    (reduced, recon) = prune_cnf(cnf, definitions)
+    assert len(reduced) < len(cnf) - 5
+    for model in models(reduced):
+        assert satisfies(cnf, recon.extend(model))
+    # the unconstrained input D is kept for enumeration
+    assert 'D' in reduced.name2idx
+
+    # an inner gate of a PB adder shared with the constrained root, the PB
+    # itself out of cone: the inner gate's definition must stay
+    (A, B, C, D) = (Var('A'), Var('B'), Var('C'), Var('D'))
+    roots = [PB([1, 2, 3], 3, A, B, C), Or(And(A, C), D)]
+    definitions = []
+    shared, outs = Tseytin_encode_many(roots, pb='adder', definitions=definitions)
+    shared.add_clause([outs[1]])
+    (reduced, recon) = prune_cnf(shared, definitions)
+    assert recon.removed
+    found = set()
+    for model in models(reduced):
+        full = recon.extend(model)
+        assert satisfies(shared, full)
+        found.add(inputs(shared, full, 'ACD'))
+    assert found == {bits for bits in itertools.product([False, True], repeat=3) if (bits[0] and bits[1]) or bits[2]}
+
+    # a large set-aside region is completed gate by gate, without recursion
+    xs = [Var(f'x{i}') for i in range(3000)]
+    chain = xs[0]
+    for x in xs[1:]:
+        chain = Or(And(chain, x), Not(x))
+    definitions = []
+    big, outs = Tseytin_encode_many([chain, Var('y')], definitions=definitions)
+    big.add_clause([outs[1]])
+    (reduced, recon) = prune_cnf(big, definitions)
+    assert len(reduced) == 0 and len(recon.removed) > 3000
+    assert satisfies(big, recon.extend([-v for v in range(1, reduced.n_vars+1)]))
+
+    # without definitions, propagation only
+    (reduced, recon) = prune_cnf(cnf)
+    assert len(reduced) <= len(cnf)
+    for model in models(reduced):
+        assert satisfies(cnf, recon.extend(model))
+
+    # simplification: same satisfiability, models extend, and the frozen
+    # variables keep exactly their projections
+    import random
+
+    def projections(cnf, model_list, frozen):
+        return {tuple(model[v-1] > 0 for v in frozen) for model in model_list}
+
+    def check_simplified(cnf, frozen=()):
+        (reduced, recon) = simplify_cnf(cnf, frozen)
+        original = list(models(cnf))
+        extended = [recon.extend(model) for model in models(reduced)]
+        assert bool(original) == bool(extended)
+        for model in extended:
+            assert satisfies(cnf, model)
+        frozen = sorted(frozen)
+        assert projections(cnf, original, frozen) == projections(cnf, extended, frozen)
+        return reduced
+
+    rng = random.Random(0)
+    for i in range(300):
+        n = rng.randint(1, 9)
+        cnf = CNF()
+        for j in range(n):
+            cnf.new_var()
+        for j in range(rng.randint(0, 4 * n)):
+            cnf.add_clause([rng.choice([-1, 1]) * rng.randint(1, n) for k in range(rng.randint(1, 4))])
+        if i % 5 == 0:
+            cnf.add_xor([rng.choice([-1, 1]) * v for v in rng.sample(range(1, n+1), min(n, 2))])
+        check_simplified(cnf)
+        check_simplified(cnf, rng.sample(range(1, n+1), rng.randint(1, n)))
+
+    # each rewrite on its own
+    def simplified(clauses, n, frozen=()):
+        cnf = CNF()
+        for j in range(n):
+            cnf.new_var()
+        cnf.add_clauses(clauses)
+        check_simplified(cnf, frozen)
+        return simplify_cnf(cnf, frozen)[0]
+
+    # equivalent literals, 1 = 2 = /3, the frozen one is kept
+    reduced = simplified([[-1, 2], [-2, -3], [3, 1], [1, 4, 5], [-2, 4, -5], [3, -4, 5]], 5, frozen=[2, 4, 5])
+    assert reduced.n_vars == 3
+    # subsumption and self-subsumption: [1 2] and [/1 2 3] -> [2 3]
+    reduced = simplified([[1, 2], [1, 2, 3], [-1, 2, 3], [-2, -3, 4]], 4, frozen=[1, 2, 3, 4])
+    assert sorted(map(sorted, map(list, reduced))) == [[-3, -2, 4], [1, 2], [2, 3]]
+    # pure literals and elimination empty everything satisfiable and unfrozen
+    assert len(simplified([[1, 2], [1, -3], [-2, 3]], 3)) == 0
+    assert list(map(list, simplified([[1], [-1, 2], [-2]], 2))) == [[]]
+
+    # Tseytin output shrinks a lot, the inputs (frozen) keep their solutions
+    total = [0, 0]
+    for n_nodes in range(1, 25):
+        expr = generate(n_nodes, list('ABCDE'))
+        cnf, out = Tseytin_encode(expr)
+        cnf.add_clause([out])
+        names = sorted(expr.varnames())
+        (reduced, recon) = simplify_cnf(cnf, [cnf.var(name) for name in names])
+        expected = {tuple(bits) for bits in itertools.product([False, True], repeat=len(names))
+                    if expr.evaluate(dict(zip(names, bits))) == True}
+        found = set()
+        for model in models(reduced):
+            full = recon.extend(model)
+            assert satisfies(cnf, full)
+            found.add(inputs(cnf, full, names))
+        assert found == expected
+        total[0] += len(cnf)
+        total[1] += len(reduced)
+    assert total[1] < total[0] / 2, total
+
+    print('pass')
@@ -0,0 +1,257 @@
+# encodings of w1*x1 + ... + wn*xn <= k over integer literals
+#
+# Each encoder returns a literal le standing for the constraint. Weights must
+# be positive and 0 <= k < sum(ws); TseytinEncoder.gate_pb() gets any PB node
+# into that shape first (negative weights flip their literal, constants move
+# into the bound, equal weights become a cardinality constraint).
+#
+# enc is a TseytinEncoder, for its constants, gates and cnf. As with the
+# cardinality counters the directions are separate:
+#   pos: le -> constraint holds, needed when le is asserted true
+#   neg: constraint holds -> le, needed when le is asserted false
+#
+# encodings, for n terms with weights summing to W:
+#   bdd      (Een & Sorensson 2006, with the interval merging of Abio et al.
+#             2012) at most n*(k+1) nodes, each 2 to 4 clauses, arc consistent
+#   adder    binary adder tree then a comparator against k, O(n*log W) but
+#            weak propagation, the fallback for big weights and bounds
+#   sortnet  each literal repeated w times into a cardinality network,
+#            O(W*log^2 k), good when the weights are small
+
+from .cardinality import cardinality_network
+
+#------------------------------------------------------------------------------
+# BDD
+#------------------------------------------------------------------------------
+
+def bdd(enc, ws, xs, k, pos=True, neg=True):
+    n = len(ws)
+    # rest[i]: largest possible sum of terms i and after
+    rest = [0] * (n+1)
+    for i in reversed(range(n)):
+        rest[i] = rest[i+1] + ws[i]
+
+    def add(clause):
+        if any(l is True for l in clause):
+            return
+        enc.cnf.add_clause([l for l in clause if not l is False])
+
+    def negate(l):
+        return (not l) if type(l) == bool else -l
+
+    # memo[i]: [(beta, gamma, node), ...] where node stands for "terms i and
+    # after sum to at most K" for every K in [beta, gamma]
+    memo = [[] for i in range(n+1)]
+
+    # (node, beta, gamma) for (i, K) if already known, else None
+    def lookup(i, K):
+        if K < 0:
+            return (False, float('-inf'), -1)
+        if K >= rest[i]:
+            return (True, rest[i], float('inf'))
+        for (beta, gamma, node) in memo[i]:
+            if beta <= K <= gamma:
+                return (node, beta, gamma)
+        return None
+
+    # depth first without recursion, a node is made once both of its children
+    # are known, high child first (the order the recursive definition gives)
+    stack = [(0, k)]
+    while stack:
+        (i, K) = stack[-1]
+        if lookup(i, K) != None:
+            stack.pop()
+            continue
+        high = lookup(i+1, K - ws[i])
+        if high == None:
+            stack.append((i+1, K - ws[i]))
+            continue
+        low = lookup(i+1, K)
+        if low == None:
+            stack.append((i+1, K))
+            continue
+        stack.pop()
+
+        (hi, hi_beta, hi_gamma) = high
+        (lo, lo_beta, lo_gamma) = low
+        beta = max(hi_beta + ws[i], lo_beta)
+        gamma = min(hi_gamma + ws[i], lo_gamma)
+
+        # True == 1, a constant is never the same node as variable 1
+        if type(hi) == type(lo) and hi == lo:
+            node = lo
+        else:
+            # node = lo * (/x + hi), hi implying lo
+            node = enc.cnf.new_var()
+            x = xs[i]
+            if pos:
+                add([-node, lo])
+                add([-node, -x, hi])
+            if neg:
+                add([node, negate(lo), x])
+                add([node, negate(hi)])
+
+        memo[i].append((beta, gamma, node))
+
+    (root, beta, gamma) = lookup(0, k)
+    return enc.constant(root) if type(root) == bool else root
+
+#------------------------------------------------------------------------------
+# adder network
+#------------------------------------------------------------------------------
+
+# bits of the sum, least significant first, built from full and half adders
+# column by column, the Wallace tree way
+def sum_bits(enc, ws, xs):
+    columns = {}
+    for (w, x) in zip(ws, xs):
+        b = 0
+        while w:
+            if w & 1:
+                columns.setdefault(b, []).append(x)
+            w >>= 1
+            b += 1
+
+    bits = []
+    b = 0
+    while b <= max(columns, default=-1):
+        column = columns.get(b, [])
+        while len(column) > 1:
+            if len(column) >= 3:
+                (x, y, z) = (column.pop(0), column.pop(0), column.pop(0))
+                column.append(enc.gate_xor([x, y, z]))
+                carry = enc.gate_or([enc.gate_and([x, y]), enc.gate_and([x, z]), enc.gate_and([y, z])])
+            else:
+                (x, y) = (column.pop(0), column.pop(0))
+                column.append(enc.gate_xor([x, y]))
+                carry = enc.gate_and([x, y])
+            columns.setdefault(b+1, []).append(carry)
+        bits.append(column[0] if column else enc.constant(False))
+        b += 1
+
+    return bits
+
+def adder(enc, ws, xs, k, pos=True, neg=True):
+    bits = sum_bits(enc, ws, xs)
+    if k >> len(bits):
+        return enc.constant(True)
+
+    # comparing from the least significant bit: le is "the low bits of the
+    # sum are at most the low bits of k"
+    le = enc.constant(True)
+    for (i, s) in enumerate(bits):
+        if (k >> i) & 1:
+            le = enc.gate_or([-s, le])
+        else:
+            le = enc.gate_and([-s, le])
+    return le
+
+#------------------------------------------------------------------------------
+# sorting network
+#------------------------------------------------------------------------------
+
+def sortnet(enc, ws, xs, k, pos=True, neg=True):
+    unary = [x for (w, x) in zip(ws, xs) for i in range(w)]
+    us = cardinality_network(enc.cnf, unary, k+1, up=pos, down=neg)
+    return -us[k] if k < len(us) else enc.constant(True)
+
+ENCODINGS = {
+    'bdd': bdd,
+    'adder': adder,
+    'sortnet': sortnet,
+}
+
+# rough sizes: the network has ~W*log^2(k) comparators, the BDD at most
+# n*(k+1) nodes (far fewer in practice), the adder ~n*log W gates
+BDD_LIMIT = 50000
+
+def choose_encoding(ws, k):
+    n = len(ws)
+    total = sum(ws)
+    if total <= 8 * n:
+        return 'sortnet'
+    if n * min(k+1, total) <= BDD_LIMIT:
+        return 'bdd'
+    return 'adder'
+
+def encode_pb(enc, ws, xs, k, pos=True, neg=True, encoding='auto'):
+    if encoding == 'auto':
+        encoding = choose_encoding(ws, k)
+    return ENCODINGS[encoding](enc, ws, xs, k, pos, neg)
+
+#------------------------------------------------------------------------------
+# tests
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import itertools
+
+    from .cnf import CNF
+    from .tseytin import TseytinEncoder
+
+    def propagate(cnf, values):
+        values = dict(values)
+        changed = True
+        while changed:
+            changed = False
+            for clause in cnf:
+                if any(values.get(abs(l)) == (l > 0) for l in clause):
+                    continue
+                free = [l for l in clause if not abs(l) in values]
+                assert free, 'conflict'
+                if len(free) == 1:
+                    values[abs(free[0])] = free[0] > 0
+                    changed = True
+        return values
+
+    # both directions: the inputs alone decide le by unit propagation
+    def check(encoding, ws, k):
+        enc = TseytinEncoder()
+        xs = [enc.cnf.new_var() for w in ws]
+        le = encode_pb(enc, ws, xs, k, encoding=encoding)
+        for bits in itertools.product([False, True], repeat=len(ws)):
+            values = {x: b for (x, b) in zip(xs, bits)}
+            if enc.true_lit != None:
+                values[enc.true_lit] = True
+            values = propagate(enc.cnf, values)
+            expected = sum(w for (w, b) in zip(ws, bits) if b) <= k
+            assert values[abs(le)] == ((le > 0) == expected), (encoding, ws, k, bits)
+        return enc.cnf
+
+    for encoding in ENCODINGS:
+        for ws in [[1], [2, 3], [3, 5, 7], [1, 1, 2, 4], [6, 4, 3, 3, 2], [9, 1, 5, 2, 8]]:
+            for k in range(sum(ws)):
+                check(encoding, ws, k)
+
+    # the BDD merges nodes: 2*x1 + ... with all weights equal is a counter
+    cnf = check('bdd', [5]*8, 12)
+    assert len(cnf) <= 4 * 8 * 3
+
+    # nodes numbered from 1 (inputs not yet in the CNF) are not taken for
+    # the constants: x100 + x101 <= 1 has node 1 below a True branch
+    enc = TseytinEncoder()
+    le = bdd(enc, [1, 1], [100, 101], 1)
+    for bits in itertools.product([False, True], repeat=2):
+        values = {100: bits[0], 101: bits[1]}
+        if enc.true_lit != None:
+            values[enc.true_lit] = True
+        values = propagate(enc.cnf, values)
+        assert values[abs(le)] == ((le > 0) == (sum(bits) <= 1)), bits
+
+    # long constraints build without recursion
+    from .cdcl import Solver
+    from .expr import PB, Var
+    from .tseytin import Tseytin_encode
+    ws = [9 + i % 4 for i in range(2000)]
+    assert choose_encoding(ws, 20) == 'bdd'
+    xs = [Var(f'x{i}') for i in range(2000)]
+    (cnf, out) = Tseytin_encode(PB(ws, 20, *xs))
+    solver = Solver(cnf)
+    (x0, x1, x2) = (cnf.var('x0'), cnf.var('x1'), cnf.var('x1999'))
+    assert solver.solve([out, x0, x1])
+    assert not solver.solve([out, x0, x1, x2]) and out in solver.conflict and x2 in solver.conflict
+
+    assert choose_encoding([1, 2, 1, 1], 3) == 'sortnet'
+    assert choose_encoding([100, 250, 75, 300], 400) == 'bdd'
+    assert choose_encoding([10**6 + i for i in range(100)], 10**7) == 'adder'
+
+    print('pass')
@@ -1,123 +1,552 @@
-from subprocess import Popen, PIPE
-
 #from . import expr
+import io
+import os
+
 from .expr import *
-from .tools import is_cnf, parse_python
-from .tseytin import *
-
-def call_solver(dimacs, program='cryptominisat5'):
-    process = Popen([program], stdout=PIPE, stdin=PIPE)
-    (stdout, stderr) = process.communicate(input=dimacs.encode('utf-8'))
-    exit_code = process.wait()
-    return stdout.decode('utf-8').rstrip()
-
-def solve_cnf(expr, solver='cryptominisat5'):
-    assert is_cnf(expr)
-    dimacs, var2idx = to_dimacs(expr)
-
-    output = call_solver(dimacs, solver)
-    lines = output.split('\n')
-    if lines[-2] != 's SATISFIABLE': return {}
-    if not lines[-1].startswith('v '): return {}
-    
-    line = lines[-1]
-    if not line: return {}
-    if not line.startswith('v '): raise Exception('dimacs solution should start with \'v \'')
-    if not line.endswith(' 0'): raise Exception('dimacs solution should end with \' 0\'')
-    # like '-1 -2 -3 4 5 -6 7 -8 -9 -10 -11'
-    assignments = line[2:-2]
-
-    idx2var = {b:a for a,b in var2idx.items()}
-    result = {}
-    for elem in assignments.split(' '):
-        value = True
-        if elem.startswith('-'):
-            value = False
-            elem = elem[1:]
-        idx = int(elem)
-        result[idx2var[idx]] = value
+from .tools import is_cnf, parse_python, shellout
+from .tseytin import Tseytin_encode
+from .cnf import CNF
+
+def call_solver(dimacs, program='cryptominisat5', timeout=None):
+    (stdout, stderr) = shellout([program], dimacs, timeout)
+    return stdout.rstrip()
+
+# solvers that read CryptoMiniSat 'x' lines, others get XOR constraints as clauses
+XOR_SOLVERS = {'cryptominisat5'}
+
+# 'builtin' is the in-process solver of cdcl.py, anything else names a program
+_default_solver = None
+
+def default_solver():
+    global _default_solver
+    if _default_solver == None:
+        import shutil
+        _default_solver = 'cryptominisat5' if shutil.which('cryptominisat5') else 'builtin'
+    return _default_solver
+
+# solve a CNF, returns the model as a list of literals like [-1, 2, 3] or None if unsatisfiable
+#
+# solver: program name (or path) of a DIMACS solver, or 'builtin', None for
+# default_solver(), or a portfolio.Portfolio to race several ('portfolio' for
+# portfolio.default_portfolio())
+# cache: optional cache.SolveCache, answers are looked up by canonical hash
+# preprocess: hand the solver the CNF reduced by preprocess.simplify_cnf()
+def solve_cnf_lits(cnf, solver=None, cache=None, preprocess=False):
+    if solver == None:
+        solver = default_solver()
+    if solver == 'portfolio':
+        from .portfolio import default_portfolio
+        solver = default_portfolio()
+
+    def run(problem):
+        if not isinstance(solver, str):
+            return solver.solve_cnf_lits(problem)
+        if solver == 'builtin':
+            from . import cdcl
+            return cdcl.solve_cnf_lits(problem)
+        return parse_solution(call_solver(to_dimacs(problem)[0], solver), problem.n_vars)
+
+    steps = solve_steps(cnf, solver, cache, preprocess)
+    try:
+        problem = next(steps)
+        while True:
+            problem = steps.send(run(problem))
+    except StopIteration as done:
+        return done.value
+
+# everything about solving a CNF but running the solver, shared by
+# solve_cnf_lits() and solve_cnf_lits_async(): a generator that yields the CNF
+# for the solver (XORs expanded if it needs them), is sent back its model or
+# None, and returns the answer
+def solve_steps(cnf, solver, cache=None, preprocess=False):
+    n_vars = cnf.n_vars
+
+    # nothing left for the solver to do (eg: after prune_cnf())
+    if cnf.n_clauses + cnf.n_xors == 0:
+        return [-v for v in range(1, n_vars+1)]
+    if any(len(clause) == 0 for clause in cnf):
+        return None
+
+    if preprocess:
+        from .preprocess import simplify_cnf
+        (reduced, recon) = simplify_cnf(cnf)
+        model = yield from solve_steps(reduced, solver, cache)
+        return None if model == None else recon.extend(model)
+
+    if cache != None:
+        from .cache import canonical_form, to_canonical, from_canonical
+        (key, order) = canonical_form(cnf)
+        entry = cache.get(key)
+        if entry != None:
+            return None if entry['model'] == None else from_canonical(entry['model'], order)
+        model = yield from solve_steps(cnf, solver)
+        cache.put(key, {'model': None if model == None else to_canonical(model, order)})
+        return model
+
+    # portfolios expand for each of their solvers themselves
+    if cnf.n_xors and isinstance(solver, str) and not os.path.basename(solver) in XOR_SOLVERS:
+        cnf = cnf.expand_xors()
+
+    model = yield cnf
+    return None if model == None else model[:n_vars]
+
+# solver output -> list of literals (up to n_vars) or None if unsatisfiable,
+# the model may span several 'v' lines, see dimacs.parse_model()
+def parse_solution(output, n_vars):
+    from .dimacs import parse_model
+    return parse_model(output, n_vars)
 
-    return result
+#------------------------------------------------------------------------------
+# incremental solving
+#------------------------------------------------------------------------------
+
+# a CNF solved repeatedly as clauses are added, eg: blocking clauses
+#
+#   session = SolverSession(cnf)
+#   while session.solve():
+#       session.add_clause([-lit for lit in session.model])
+#
+# With the built-in solver this is one cdcl.Solver kept between calls, so its
+# learnt clauses, activities and saved phases carry over. An external solver
+# still runs once per solve() (DIMACS solvers read one problem and exit) but
+# the DIMACS is kept as text and only new clauses are converted.
+#
+# A portfolio is raced afresh on the whole CNF every solve().
+#
+# solve() takes assumptions, literals held for that call only. The built-in
+# solver decides them first and, when unsatisfiable, finds which of them are
+# to blame. Other solvers get them as temporary unit clauses and can only
+# blame them all.
+#
+# XOR constraints of the starting CNF are expanded for solvers without native
+# support, after which clauses must not add variables.
+class SolverSession(object):
+    def __init__(self, cnf=None, solver=None):
+        self.solver = default_solver() if solver == None else solver
+        if self.solver == 'portfolio':
+            from .portfolio import default_portfolio
+            self.solver = default_portfolio()
+        self.n_vars = 0             # variables seen in models
+        self.n_total = 0            # including those from expanded XORs
+        self.n_clauses = 0
+        self.has_empty = False
+        self.model = None
+        self.failed = []            # assumptions to blame for the last False
+        self.n_solves = 0
+
+        if self.solver == 'builtin':
+            from . import cdcl
+            self.backend = cdcl.Solver()
+        elif not isinstance(self.solver, str):
+            self.cnf = CNF()
+        else:
+            self.lines = []
+
+        if cnf != None:
+            native = cnf.n_xors == 0 or not isinstance(self.solver, str) or \
+                os.path.basename(self.solver) in XOR_SOLVERS
+            full = cnf if native else cnf.expand_xors()
+            # the expanded clauses use the extra variables, so models are
+            # only cut down to the starting ones once they are loaded
+            self.n_vars = self.n_total = full.n_vars
+            if self.solver == 'builtin':
+                self.backend.ensure_vars(self.n_total)
+            for clause in full:
+                self.add_clause(clause)
+            for lits in full.xors():
+                if isinstance(self.solver, str):
+                    self.lines.append('x' + ' '.join(map(str, lits)) + ' 0\n')
+                else:
+                    self.cnf.add_xor(lits)
+                self.n_clauses += 1
+            self.n_vars = cnf.n_vars
+
+    def add_clause(self, lits):
+        top = max((abs(l) for l in lits), default=0)
+        if top > self.n_vars:
+            assert self.n_vars == self.n_total, 'no new variables after expanding XOR constraints'
+            self.n_vars = self.n_total = top
+
+        self.n_clauses += 1
+        if len(lits) == 0:
+            self.has_empty = True
+        if self.solver == 'builtin':
+            self.backend.add_clause(lits)
+        elif not isinstance(self.solver, str):
+            self.cnf.add_clause(lits)
+        else:
+            self.lines.append(' '.join(map(str, lits)) + ' 0\n' if lits else '0\n')
+
+    def add_clauses(self, clauses):
+        for clause in clauses:
+            self.add_clause(clause)
+
+    # returns True with the model (a list of literals) in self.model, or False
+    #
+    # assumptions: literals over existing variables, true for this call only,
+    # when False because of them self.failed is a subset that cannot all hold
+    # (all of them with solvers other than the built-in one)
+    def solve(self, assumptions=()):
+        self.n_solves += 1
+        self.model = None
+        self.failed = []
+        assumptions = list(assumptions)
+        assert all(0 < abs(p) <= self.n_vars for p in assumptions), 'assumptions over unknown variables'
+
+        if self.has_empty:
+            return False
+        if self.n_clauses == 0 and not assumptions:
+            self.model = [-v for v in range(1, self.n_vars+1)]
+        elif self.solver == 'builtin':
+            if self.backend.solve(assumptions):
+                self.model = self.backend.model[:self.n_vars]
+            else:
+                self.failed = self.backend.conflict
+        elif not isinstance(self.solver, str):
+            while self.cnf.n_vars < self.n_vars:
+                self.cnf.new_var()
+            cnf = self.cnf
+            if assumptions:
+                cnf = cnf.copy()
+                cnf.add_clauses([[p] for p in assumptions])
+            self.model = self.solver.solve_cnf_lits(cnf)
+            if self.model == None:
+                self.failed = assumptions
+        else:
+            units = ['%d 0\n' % p for p in assumptions]
+            header = 'p cnf %d %d\n' % (self.n_total, self.n_clauses + len(units))
+            self.lines[:0] = [header] + units
+            dimacs = ''.join(self.lines)
+            del self.lines[:1+len(units)]
+            self.model = parse_solution(call_solver(dimacs, self.solver), self.n_vars)
+            if self.model == None:
+                self.failed = assumptions
+
+        return self.model != None
+
+# expr is a BoolExpr in CNF (see is_cnf()) or a CNF
+def solve_cnf(expr, solver=None, cache=None, preprocess=False):
+    cnf = expr if isinstance(expr, CNF) else CNF.from_expr(expr)
+
+    model = solve_cnf_lits(cnf, solver, cache, preprocess)
+    if model == None:
+        return {}
+
+    return cnf.model_to_dict(model)
+
+# solve_cnf() with assumptions held for this call only, returns (solution,
+# failed) where failed lists the assumptions that cannot all hold together,
+# [] when satisfiable or unsatisfiable regardless (see SolverSession.solve(),
+# all of them with solvers other than the built-in one)
+#
+# assumptions: literals, as variable numbers (-3) or names ('A', '-A'),
+#   failed is a sublist in the same form
+#
+# Each call loads the CNF into a new solver (and simplifies it again with
+# preprocess). For many questions about one CNF keep a SolverSession and call
+# its solve(assumptions), the built-in solver keeps what it learnt between
+# them.
+def solve_cnf_assuming(expr, assumptions, solver=None, preprocess=False):
+    cnf = expr if isinstance(expr, CNF) else CNF.from_expr(expr)
+
+    def literal(a):
+        if type(a) != str:
+            return a
+        return -cnf.name2idx[a[1:]] if a.startswith('-') else cnf.name2idx[a]
+    lits = [literal(a) for a in assumptions]
+
+    def blamed(failed):
+        failed = set(failed)
+        return [a for (a, l) in zip(assumptions, lits) if l in failed]
+
+    (reduced, recon) = (cnf, None)
+    if preprocess:
+        from .preprocess import simplify_cnf
+        (reduced, recon) = simplify_cnf(cnf, [abs(l) for l in lits])
+        if any(len(clause) == 0 for clause in reduced):
+            return ({}, [])
+        # assumptions on variables fixed by simplification hold or fail alone
+        for l in lits:
+            if recon.fixed.get(abs(l)) == (l < 0):
+                return ({}, blamed([l]))
+        new_var = {old: new for (new, old) in enumerate(recon.old_var) if new}
+        renumber = {l: new_var[abs(l)] if l > 0 else -new_var[abs(l)] for l in lits if not abs(l) in recon.fixed}
+    else:
+        renumber = {l: l for l in lits}
+
+    session = SolverSession(reduced, solver)
+    if not session.solve(list(renumber.values())):
+        failed = set(session.failed)
+        return ({}, blamed([l for (l, r) in renumber.items() if r in failed]))
+    model = session.model if recon == None else recon.extend(session.model)
+    return (cnf.model_to_dict(model), [])
 
 #------------------------------------------------------------------------------
 # to dimacs
 #------------------------------------------------------------------------------
 
+# conj is a BoolExpr in CNF (see is_cnf()) or a CNF
 def to_dimacs(conj):
-    assert is_cnf(conj)
+    if isinstance(conj, CNF):
+        cnf = conj
+    else:
+        assert is_cnf(conj)
+        cnf = CNF.from_expr(conj)
 
-    var2idx = {name: i+1 for i,name in enumerate(sorted(conj.varnames()))}
+    var2idx = {cnf.varname(i): i for i in range(1, cnf.n_vars+1)}
 
     # clause lines look like:
     # [-]<var_id> [-]<var_id> ... [-]<var_id> 0
-    # where '-' indicates logical negation
-    clauses = []
-    for disj in conj.children:
-        elems = []
-        for lit in disj.children:
-            prefix = '-' if type(lit) == Not else ''
-            elems.append(prefix + str(var2idx[lit.name]))
-        clauses.append(' '.join(elems + ['0']))
-    # problem lines look like:
+    # where '-' indicates logical negation, XOR constraints are the same with
+    # an 'x' prefix, and the problem line looks like:
     # p cnf <number_of_vars> <number_of_clauses>
-    dimacs = 'p cnf %d %d\n' % (len(var2idx), len(clauses))
-    dimacs += '\n'.join(clauses)
-    return (dimacs, var2idx)
+    from .dimacs import write_dimacs
+    fp = io.StringIO()
+    write_dimacs(cnf, fp)
+    return (fp.getvalue(), var2idx)
 
 #------------------------------------------------------------------------------
 # convenience solvers
 #------------------------------------------------------------------------------
 
-def solve(expr, desired_output=True):
-    varnames = expr.varnames()
-
-    expr2, outvar = Tseytin_transformation(expr)
+# Tseytin encode expr to a CNF with the output constrained to desired_output
+#
+# pg: use the Plaisted-Greenbaum encoding, only the gate directions needed
+# for the fixed output polarity, so fewer clauses but gate variables are no
+# longer functions of the inputs (fine for one solution, not for blocking)
+#
+# native_xor: encode Xor nodes as XOR constraints, see TseytinEncoder
+# definitions: optional list, filled for prune_cnf(), see Tseytin_encode()
+def constrained_cnf(expr, desired_output=True, pg=False, native_xor=False, definitions=None):
+    polarity = (1 if desired_output else -1) if pg else 0
+    cnf, out = Tseytin_encode(expr, polarity, native_xor=native_xor, definitions=definitions)
 
     # append constraint on output
-    if not desired_output:
-        outvar = Not(outvar)
+    cnf.add_clause([out if desired_output else -out])
+
+    return cnf
 
-    expr2.children.append(Or(outvar))
+# prune: hand the solver the CNF reduced by preprocess.prune_cnf()
+# solver, cache, preprocess: see solve_cnf_lits()
+def solve(expr, desired_output=True, native_xor=False, prune=True, solver=None, cache=None, preprocess=False):
+    varnames = expr.varnames()
+
+    definitions = []
+    cnf = constrained_cnf(expr, desired_output, pg=True, native_xor=native_xor, definitions=definitions)
+    from .preprocess import prune_cnf
+    (reduced, recon) = prune_cnf(cnf, definitions) if prune else (cnf, None)
 
     # solve
-    solution = solve_cnf(expr2)
-    if not solution:
+    model = solve_cnf_lits(reduced, solver, cache, preprocess)
+    if model == None:
         return {}
+    solution = cnf.model_to_dict(recon.extend(model) if prune else model)
 
     # pick out original variables (no temporaries)
     result = {name: solution[name] for name in varnames}
     print(result)
     return result
 
-def solve_all(expr, desired_output=True):
+# all solutions, as dicts over the projection variables
+#
+# projection: names to enumerate over, by default every variable of expr, each
+#   distinct assignment to these is reported once (the others take the values
+#   of some satisfying assignment), and blocking clauses only mention these
+# minimize: report cubes instead, dicts of just the variables that matter,
+#   every completion of a cube is a solution and every solution completes some
+#   cube, though cubes may overlap, eg: A or B -> [{'B': True}, {'A': True}]
+# cache: optional cache.SolveCache, the whole sequence of models is cached and
+#   replayed (minimized cubes only for the very same expression)
+# preprocess: simplify the CNF first, see preprocess.simplify_cnf(), with the
+#   projection variables frozen
+def solve_all(expr, desired_output=True, native_xor=False, prune=True, solver=None, projection=None, minimize=False,
+        cache=None, preprocess=False):
     varnames = expr.varnames()
-
-    expr2, outvar = Tseytin_transformation(expr)
-
-    # append constraint on output
-    if not desired_output:
-        outvar = Not(outvar)
-
-    expr2.children.append(Or(outvar))
+    projection = sorted(varnames if projection == None else projection)
+
+    # blocking only mentions inputs, so the gates need not be functions of
+    # them and the one-directional (Plaisted-Greenbaum) encoding is enough
+    definitions = []
+    cnf = constrained_cnf(expr, desired_output, pg=True, native_xor=native_xor, definitions=definitions)
+    from .preprocess import prune_cnf
+    (reduced, recon) = prune_cnf(cnf, definitions) if prune else (cnf, None)
+    simplified = None
+    if preprocess:
+        from .preprocess import simplify_cnf
+        (reduced, simplified) = simplify_cnf(reduced, [reduced.name2idx[name] for name in projection
+            if name in reduced.name2idx])
+
+    # projection variables left in the reduced CNF, the rest were fixed
+    block_vars = {name: reduced.name2idx[name] for name in projection if name in reduced.name2idx}
+
+    # a cached run is replayed instead of solving, the projection (and its
+    # order, which decides the cubes) is part of the key
+    replay = None
+    if cache != None:
+        from .cache import canonical_form, to_canonical, from_canonical
+        marks = {v: i for (i, v) in enumerate(block_vars.values())}
+        tag = f'solve_all {expr}' if minimize else 'solve_all'
+        (key, order) = canonical_form(reduced, marks, tag)
+        entry = cache.get(key)
+        if entry != None:
+            replay = iter([from_canonical(m, order) for m in entry['models']])
+    if replay == None:
+        session = SolverSession(reduced, solver)
 
     # solve
     solutions = []
+    models = []
     while True:
-        solution = solve_cnf(expr2)
-        if not solution:
+        if replay != None:
+            model = next(replay, None)
+        else:
+            model = session.model if session.solve() else None
+        if model == None:
             break
+        models.append(model)
 
         # pick out original variables (no temporaries)
-        solutions.append({name: solution[name] for name in varnames})
+        if simplified != None:
+            model = simplified.extend(model)
+        solution = cnf.model_to_dict(recon.extend(model) if prune else model)
+        values = {name: solution[name] for name in varnames}
+
+        # free each projection variable the expression still holds without,
+        # checked by three-valued evaluation with the others as in the model
+        cube = {name: values[name] for name in projection}
+        if minimize:
+            for name in projection:
+                del values[name]
+                if expr.evaluate(values) != desired_output:
+                    values[name] = cube[name]
+            cube = {name: values[name] for name in projection if name in values}
+        solutions.append(cube)
+
+        # block this solution
+        if replay == None:
+            session.add_clause([-block_vars[name] if value else block_vars[name]
+                for (name, value) in cube.items() if name in block_vars])
+
+    if cache != None and replay == None:
+        cache.put(key, {'models': [to_canonical(m, order) for m in models]})
 
-        #
-        stopper = Or(*[Not(Var(name)) if value else Var(name) for name,value in solution.items()])
-        #print('stopper:', stopper)
+    return solutions
 
-        expr2.children.append(stopper)
-        #print(expr.__str_tabbed_tree__())
+#------------------------------------------------------------------------------
+# asyncio
+#------------------------------------------------------------------------------
 
-    return solutions
+# Coroutine versions of the solvers for callers juggling many problems on one
+# event loop. Solvers run as child processes without a thread each: external
+# programs through procpool.ProcessPool.run_async(), the built-in solver in a
+# multiprocessing child watched with add_reader(). Both take a slot of the
+# shared pool, the same slots blocking calls take, so at most max_workers run
+# at once however many are awaited. Everything but running the solver is
+# solve_steps(), as for solve_cnf_lits().
+#
+# timeout: seconds, subprocess.TimeoutExpired is raised after the child is
+#   killed, None for no limit
+# cancelling the awaiting task also kills the child
+#
+# Portfolios are not supported here, they manage their own processes.
+
+async def call_solver_async(dimacs, program='cryptominisat5', timeout=None):
+    from ..procpool import default_pool
+    (stdout, stderr) = await default_pool().run_async([program], dimacs, timeout)
+    return stdout.rstrip()
+
+# cdcl.Solver on cnf in a child process, returns its model or None
+async def run_builtin_async(cnf, timeout=None):
+    import asyncio
+    import subprocess
+    import multiprocessing
+    from ..procpool import default_pool
+    from .portfolio import run_builtin
+
+    async with default_pool().async_slots():
+        (conn, child_conn) = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=run_builtin, args=(child_conn, cnf, {}), daemon=True)
+        process.start()
+        child_conn.close()
+
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(conn.fileno(), lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, timeout)
+            # the child sends one message then exits, EOFError if it died
+            return conn.recv()
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(['builtin'], timeout)
+        finally:
+            loop.remove_reader(conn.fileno())
+            if process.is_alive():
+                process.kill()
+            process.join()
+            conn.close()
+
+# same as solve_cnf_lits()
+async def solve_cnf_lits_async(cnf, solver=None, timeout=None, cache=None, preprocess=False):
+    if solver == None:
+        solver = default_solver()
+    assert isinstance(solver, str) and solver != 'portfolio', 'portfolios have no asyncio interface'
+
+    async def run(problem):
+        if solver == 'builtin':
+            return await run_builtin_async(problem, timeout)
+        return parse_solution(await call_solver_async(to_dimacs(problem)[0], solver, timeout), problem.n_vars)
+
+    steps = solve_steps(cnf, solver, cache, preprocess)
+    try:
+        problem = next(steps)
+        while True:
+            problem = steps.send(await run(problem))
+    except StopIteration as done:
+        return done.value
+
+# same as solve_cnf()
+async def solve_cnf_async(expr, solver=None, timeout=None, cache=None, preprocess=False):
+    cnf = expr if isinstance(expr, CNF) else CNF.from_expr(expr)
+
+    model = await solve_cnf_lits_async(cnf, solver, timeout, cache, preprocess)
+    if model == None:
+        return {}
+
+    return cnf.model_to_dict(model)
+
+# same as solve(), without the printing
+async def solve_async(expr, desired_output=True, native_xor=False, prune=True, solver=None, timeout=None, cache=None,
+        preprocess=False):
+    definitions = []
+    cnf = constrained_cnf(expr, desired_output, pg=True, native_xor=native_xor, definitions=definitions)
+    from .preprocess import prune_cnf
+    (reduced, recon) = prune_cnf(cnf, definitions) if prune else (cnf, None)
+
+    model = await solve_cnf_lits_async(reduced, solver, timeout, cache, preprocess)
+    if model == None:
+        return {}
+    solution = cnf.model_to_dict(recon.extend(model) if prune else model)
+
+    return {name: solution[name] for name in expr.varnames()}
+
+# solve_cnf_async() on each of many problems, results in the same order
+#
+# max_concurrent: problems in flight at once (their DIMACS text, models etc.
+#   held in memory), None for the pool's max_workers
+# return_exceptions: as asyncio.gather(), eg: a TimeoutExpired in place of
+#   the result of a problem that ran out of time instead of failing them all
+async def solve_many_async(exprs, solver=None, timeout=None, cache=None, max_concurrent=None,
+        return_exceptions=False, preprocess=False):
+    import asyncio
+    from ..procpool import default_pool
+
+    slots = asyncio.Semaphore(max_concurrent or default_pool().max_workers)
+
+    async def one(expr):
+        async with slots:
+            return await solve_cnf_async(expr, solver, timeout, cache, preprocess)
+
+    return await asyncio.gather(*[one(expr) for expr in exprs], return_exceptions=return_exceptions)
 
 #------------------------------------------------------------------------------
 # main
@@ -125,6 +554,8 @@ def solve_all(expr, desired_output=True):
 
 if __name__ == '__main__':
     import sys
+    import itertools
+    from .preprocess import prune_cnf
 
     print('\nDemonstrate how clauses can be added to find all solutions.')
     expr = And(parse_python('(A or B or C)'))
@@ -184,3 +615,253 @@ if __name__ == '__main__':
         print(f'Testing solution: {solution}')
         assert expr.evaluate(solution) == True
         print('PASS')
+
+    print('\nNATIVE XOR CONSTRAINTS')
+    expr = parse_python('((A ^ B) ^ (C ^ D)) and (A or D)')
+    cnf = constrained_cnf(expr, native_xor=True)
+    assert cnf.n_xors == 1
+    assert '\nx' in to_dimacs(cnf)[0]
+    # with CryptoMiniSat if installed, which reads the 'x' lines
+    import shutil
+    for solver in ['builtin'] + (['cryptominisat5'] if shutil.which('cryptominisat5') else []):
+        solutions = solve_all(expr, native_xor=True, solver=solver)
+        assert len(solutions) == 6
+        for solution in solutions:
+            assert expr.evaluate(solution) == True
+        # what a solver without XOR support gets
+        assert solve_cnf_lits(cnf.expand_xors(), solver) != None
+
+    print('\nCARDINALITY')
+    expr = And(Exactly(2, *[Var(name) for name in 'ABCD']), Or(Var('A'), Var('B')))
+    solutions = solve_all(expr)
+    assert len(solutions) == 5
+    for solution in solutions:
+        assert expr.evaluate(solution) == True
+
+    print('\nPSEUDO-BOOLEAN')
+    # pick items worth at least 8 within a weight limit of 10
+    items = [Var(name) for name in 'ABCD']
+    expr = And(PB([5, 4, 3, 6], 10, *items), PB([-4, -3, -5, -2], -8, *items))
+    solutions = solve_all(expr)
+    assert len(solutions) == 2
+    for solution in solutions:
+        assert expr.evaluate(solution) == True
+
+    print('\nPRUNED')
+    expr = parse_python('(A and not B) and ((C or D) or (B ^ E))')
+    definitions = []
+    cnf = constrained_cnf(expr, definitions=definitions)
+    (reduced, recon) = prune_cnf(cnf, definitions)
+    assert reduced.n_vars < cnf.n_vars and len(reduced) < len(cnf)
+    assert len(solve_all(expr)) == len(solve_all(expr, prune=False)) == 7
+    assert expr.evaluate(solve(expr)) == True
+    assert solve(parse_python('A and not A')) == {}
+
+    print('\nBUILTIN SOLVER')
+    expr = parse_python('((not x1) and x2) or (x1 and (not x2)) or ((not x2) and x3)')
+    solutions = solve_all(expr, solver='builtin')
+    assert len(solutions) == 5
+    assert all(expr.evaluate(solution) for solution in solutions)
+    expr = And(Exactly(2, *[Var(name) for name in 'ABCD']), Xor(Var('A'), Var('C')))
+    assert len(solve_all(expr, native_xor=True, solver='builtin')) == 4
+    assert solve_cnf(parse_python('A and not A'), solver='builtin') == {}
+    # long XORs are expanded with extra variables before the session loads them
+    expr = parse_python('A ^ B ^ C ^ D ^ E ^ F')
+    solutions = solve_all(expr, native_xor=True, solver='builtin')
+    assert len(solutions) == 32 and all(len(s) == 6 and expr.evaluate(s) for s in solutions)
+    assert len(solve_all(expr, native_xor=True, solver='builtin', projection=['A', 'B'])) == 4
+
+    print('\nINCREMENTAL SESSIONS')
+    for solver in ['builtin', default_solver()]:
+        cnf = CNF.from_expr(parse_python('(A or B or C) and (not A or not B)'))
+        session = SolverSession(cnf, solver)
+        models = []
+        while session.solve():
+            models.append(session.model)
+            session.add_clause([-lit for lit in session.model])
+        assert len(models) == 5 and len({tuple(m) for m in models}) == 5
+        assert session.n_solves == 6
+
+        # new variables, then clauses that make it unsatisfiable for good
+        session = SolverSession(cnf, solver)
+        session.add_clause([4, 1])
+        assert session.solve() and len(session.model) == 4
+        session.add_clauses([[-4], [-2, -3]])
+        assert session.solve() and session.model[:2] == [1, -2] and session.model[3] < 0
+        session.add_clause([-1])
+        assert not session.solve()
+        session.add_clause([2])
+        assert not session.solve()
+
+    # the built-in session keeps what it learnt
+    xs = [Var(f'x{i}') for i in range(8)]
+    cnf = constrained_cnf(And(AtMost(4, *xs), AtLeast(3, *xs)))
+    session = SolverSession(cnf, 'builtin')
+    n = 0
+    while session.solve():
+        n += 1
+        session.add_clause([-lit for lit in session.model[:8]])
+    assert n == 56 + 70
+
+    print('\nPROJECTED ENUMERATION')
+    expr = parse_python('(A and B) or (C and not D) or (B ^ E)')
+    solutions = solve_all(expr, solver='builtin')
+    assert len(solutions) == 23
+    full = solutions
+    # projection onto A and B: every combination has an extension
+    solutions = solve_all(expr, projection=['A', 'B'], solver='builtin')
+    assert sorted(tuple(s.values()) for s in solutions) == [(False, False), (False, True), (True, False), (True, True)]
+    # cubes cover exactly the solutions
+    cubes = solve_all(expr, minimize=True, solver='builtin')
+    assert len(cubes) < 23
+    covered = set()
+    for cube in cubes:
+        assert expr.evaluate(cube) == True
+        free = [name for name in 'ABCDE' if not name in cube]
+        for bits in itertools.product([False, True], repeat=len(free)):
+            covered.add(tuple(sorted({**cube, **dict(zip(free, bits))}.items())))
+    assert covered == {tuple(sorted(s.items())) for s in full}
+    cubes = solve_all(parse_python('A or B'), minimize=True, solver='builtin')
+    assert len(cubes) == 2 and all(len(cube) == 1 for cube in cubes)
+    # 2^20 solutions of a big Or are a handful of cubes
+    xs = [Var(f'x{i}') for i in range(20)]
+    cubes = solve_all(Or(*xs), minimize=True, solver='builtin')
+    assert len(cubes) <= 20
+    cubes = solve_all(Or(*xs), desired_output=False, minimize=True, solver='builtin')
+    assert cubes == [{f'x{i}': False for i in range(20)}]
+
+    print('\nASYNCIO')
+    import time
+    import random
+    import asyncio
+    import tempfile
+    import subprocess
+    import multiprocessing
+
+    def random_cnf(rng, n_vars, n_clauses, k=3):
+        cnf = CNF()
+        for i in range(n_vars):
+            cnf.new_var()
+        for i in range(n_clauses):
+            cnf.add_clause([rng.choice([-1, 1]) * v for v in rng.sample(range(1, n_vars+1), k)])
+        return cnf
+
+    # a solver that never answers
+    stuck = tempfile.NamedTemporaryFile('w', suffix='.py', delete=False)
+    stuck.write(f'#!{sys.executable}\nimport sys, time\nsys.stdin.read()\ntime.sleep(30)\n')
+    stuck.close()
+    os.chmod(stuck.name, 0o755)
+
+    async def main():
+        rng = random.Random(3)
+        cnfs = [random_cnf(rng, 30, 110) for i in range(6)]
+        expected = [solve_cnf_lits(cnf, 'builtin') for cnf in cnfs]
+        results = await solve_many_async(cnfs, solver='builtin', max_concurrent=2)
+        assert [r == {} for r in results] == [m == None for m in expected]
+
+        expr = parse_python('(A or B) and (not A or C) and (B ^ C)')
+        assert expr.evaluate(await solve_async(expr, solver='builtin')) == True
+        assert await solve_async(parse_python('A and not A'), solver='builtin') == {}
+        assert await solve_cnf_async(parse_python('(A or B) and not A'), solver='builtin') == {'A': False, 'B': True}
+        # the same steps as the blocking solvers, preprocessing included
+        assert await solve_cnf_async(parse_python('(A or B) and not A'), solver='builtin', preprocess=True) == \
+            {'A': False, 'B': True}
+        results = await solve_many_async(cnfs, solver='builtin', preprocess=True)
+        assert [r == {} for r in results] == [m == None for m in expected]
+        assert expr.evaluate(await solve_async(expr, solver='builtin', preprocess=True)) == True
+
+        # timeouts, the built-in solver on something hard, and a program
+        hard = random_cnf(random.Random(0), 250, 1065)
+        for (cnf, solver) in [(hard, 'builtin'), (cnfs[0], stuck.name)]:
+            t0 = time.time()
+            try:
+                await solve_cnf_lits_async(cnf, solver, timeout=0.3)
+                assert False
+            except subprocess.TimeoutExpired:
+                pass
+            assert time.time() - t0 < 5
+        assert multiprocessing.active_children() == []
+
+        # one timeout among many, reported in its place
+        results = await solve_many_async([cnfs[0], hard, cnfs[1]], solver='builtin', timeout=1,
+            return_exceptions=True)
+        assert type(results[1]) == subprocess.TimeoutExpired and type(results[0]) == dict
+
+        # cancellation kills the child
+        task = asyncio.ensure_future(solve_cnf_lits_async(hard, 'builtin'))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+            assert False
+        except asyncio.CancelledError:
+            pass
+        assert multiprocessing.active_children() == []
+
+    asyncio.run(main())
+    os.remove(stuck.name)
+
+    print('\nPREPROCESSING')
+    from .tools import generate
+    for n_nodes in range(1, 30):
+        expr = generate(n_nodes, list('ABCDE'))
+        for desired in [True, False]:
+            result = solve(expr, desired, solver='builtin', preprocess=True)
+            expected = solve_all(expr, desired, solver='builtin')
+            assert (result == {}) == (expected == [])
+            assert result == {} or expr.evaluate(result) == desired
+            assert sorted(map(str, solve_all(expr, desired, solver='builtin', preprocess=True))) == \
+                sorted(map(str, expected))
+    cnf = CNF.from_expr(parse_python('(A or B) and (not A or C) and (not C or not B) and (C or D)'))
+    solution = solve_cnf(cnf, solver='builtin', preprocess=True)
+    assert set(solution) == set('ABCD') and cnf.model_to_dict(cnf.dict_to_model(solution)) == solution
+    assert (solution['A'] or solution['B']) and (not solution['A'] or solution['C'])
+    assert solve_cnf(parse_python('A and (not A or B) and not B'), solver='builtin', preprocess=True) == {}
+
+    print('\nASSUMPTIONS')
+    # one encoding asked both ways, the output an assumption not a clause
+    for n_nodes in range(1, 25):
+        expr = generate(n_nodes, list('ABCDE'))
+        (cnf, out) = Tseytin_encode(expr)
+        names = sorted(expr.varnames())
+        table = {expr.evaluate(dict(zip(names, bits))) for bits in itertools.product([False, True], repeat=len(names))}
+        session = SolverSession(cnf, 'builtin')
+        for desired in [True, False, True]:
+            lit = out if desired else -out
+            assert session.solve([lit]) == (desired in table)
+            if session.model != None:
+                assert expr.evaluate(cnf.model_to_dict(session.model)) == desired
+            else:
+                assert session.failed == [lit]
+        assert session.n_solves == 3
+
+    cnf = CNF.from_expr(parse_python('(not A or B) and (not B or C) and (D or E)'))
+    (a, c, d) = (cnf.var('A'), cnf.var('C'), cnf.var('D'))
+    for solver in ['builtin', default_solver()]:
+        for preprocess in [False, True]:
+            # names, in the form given
+            assumptions = ['A', '-C', '-D']
+            (solution, failed) = solve_cnf_assuming(cnf, assumptions, solver, preprocess)
+            assert solution == {}
+            assert failed == (['A', '-C'] if solver == 'builtin' else assumptions)
+            (solution, failed) = solve_cnf_assuming(cnf, ['A', '-D'], solver, preprocess)
+            assert failed == [] and solution['C'] and solution['E'] and not solution['D']
+            # variable numbers
+            (solution, failed) = solve_cnf_assuming(cnf, [-d, a, -c], solver, preprocess)
+            assert solution == {} and failed == ([a, -c] if solver == 'builtin' else [-d, a, -c])
+            # unsatisfiable whatever is assumed, nothing to blame
+            (solution, failed) = solve_cnf_assuming(parse_python('A and not A'), ['A'], solver, preprocess)
+            assert solution == {} and (failed == [] or solver != 'builtin')
+    # fixed by simplification, then contradicted
+    cnf = CNF.from_expr(parse_python('A and (not A or B) and (C or D)'))
+    assert solve_cnf_assuming(cnf, ['-B', 'C'], 'builtin', preprocess=True) == ({}, ['-B'])
+    assert solve_cnf_assuming(cnf, ['B', '-C'], 'builtin', preprocess=True)[0]['D']
+    # solve_cnf() itself always returns a dict
+    solution = solve_cnf(cnf, 'builtin')
+    assert type(solution) == dict and solution['A'] and solution['B']
+
+    # the session stays usable after a failed call
+    session = SolverSession(CNF.from_expr(parse_python('(A or B) and (not A or not B)')), 'builtin')
+    assert not session.solve([1, 2]) and sorted(session.failed) == [1, 2]
+    assert session.solve([1]) and session.model == [1, -2]
+    assert session.solve() and session.failed == []
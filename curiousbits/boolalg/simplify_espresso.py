@@ -1,6 +1,4 @@
-from subprocess import Popen, PIPE
-
-from .tools import parse_python, generate, to_truth_indices
+from .tools import parse_python, generate, to_truth_indices, shellout
 from .expr import *
 
 class TruthTable(object):
@@ -17,7 +15,7 @@ class TruthTable(object):
         orow = [str(int(o)) for o in outputs]
         self.rows.append(''.join(irow) + ' ' + ''.join(orow))
 
-    def simplify(self):
+    def simplify(self, timeout=None):
         # form input
         lines = []
         lines.append(f'.i {self.n_inputs}')
@@ -28,16 +26,11 @@ class TruthTable(object):
         script = '\n'.join(lines)
         #print('INPUT:')
         #print(script)
-        script = script.encode('utf-8')
 
         # pipe to espresso
-        process = Popen('espresso', stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        (stdout, stderr) = process.communicate(script)
-        stdout = stdout.decode("utf-8")
-        stderr = stderr.decode("utf-8")
+        (stdout, stderr) = shellout(['espresso'], script, timeout)
         #print('stdout: -%s-' % stdout)
         #print('stderr: -%s-' % stderr)
-        process.wait()
 
         # products is list of (literals, negated_literals)
         # where each is a set of integers identifying the literal variables involved in that product
@@ -105,6 +98,11 @@ def simplify(expr):
 
     return result
 
+# simplify many expressions, with espresso running on several at once
+def simplify_many(exprs):
+    from ..procpool import default_pool
+    return list(default_pool().executor().map(simplify, exprs))
+
 if __name__ == '__main__':
     # A + /AB
     # should simplify to
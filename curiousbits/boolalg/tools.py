@@ -1,15 +1,17 @@
-import ast
-import random
-from subprocess import *
+import io
+import collections
 
 #from . import expr
 from .expr import *
+from .cnf import CNF
 
 #------------------------------------------------------------------------------
 # string <-> expressions
 #------------------------------------------------------------------------------
 # refine the AST from parse()/ast.parse() to ExprNode
 def refine(tree):
+    import ast
+
     if type(tree) == ast.Module:
         return refine(tree.body)
     elif type(tree) == list: # block
@@ -42,17 +44,19 @@ def refine(tree):
 
 # parse a logical expression in Python to ExprNode
 def parse_python(input_):
+    import ast
+
     ast_tree = ast.parse(input_)
     # print(ast.dump(ast_tree, indent=4))
     expr_tree = refine(ast_tree)
     return expr_tree
 
-parse_python('A ^ B')
-
 #------------------------------------------------------------------------------
 # generate random expressions
 #------------------------------------------------------------------------------
 def generate(n_nodes, varnames):
+    import random
+
     n = 0
 
     expr = None
@@ -187,7 +191,8 @@ def truth_indices_to_pos(ones, varnames):
     if len(ones) == 2**n:
         return Val(True)
 
-    zeroes = sorted(set(range(2**n)) - set(ones))
+    ones = set(ones)
+    zeroes = (row for row in range(2**n) if not row in ones)
 
     sums = []
     for row in zeroes:
@@ -202,6 +207,139 @@ def truth_indices_to_pos(ones, varnames):
 
     return And(*sums) if len(sums)>1 else sums[0]
 
+#------------------------------------------------------------------------------
+# packed truth tables and cubes
+#------------------------------------------------------------------------------
+
+# A packed truth table is a python int where bit i is set iff row i is true,
+# using the same row numbering as to_truth_indices() (varnames[0] is the MSB).
+#
+# A cube is a string over '0', '1', '-' with one position per variable, like
+# what espresso and quine_mccluskey produce. '-' means the variable is absent
+# (don't care), so cube '1-0' covers rows 100 and 110.
+
+# eg: [1,2] -> 0b0110
+def truth_indices_to_table(ones, n):
+    table = bytearray((2**n + 7) // 8)
+    for row in ones:
+        table[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(table, 'little')
+
+# eg: A/B + /AB -> 0b0110
+def to_truth_table(expr, varnames=None):
+    if varnames == None:
+        varnames = sorted(expr.varnames())
+    return truth_indices_to_table(to_truth_indices(expr, varnames), len(varnames))
+
+# yield cubes covering exactly the true rows of a packed truth table
+#
+# Split on the most significant variable: rows true in both halves become a
+# cube with '-' in that position, what remains of each half gets a '0' or '1'.
+# This merges adjacent minterms without the pairwise compare of quine-mccluskey.
+#
+# eg: (0b1110, 2) -> '-1', '10'
+def table_to_cubes(table, n):
+    full = [(1 << (1 << m)) - 1 for m in range(n+1)]
+
+    def helper(table, m, prefix):
+        if not table:
+            return
+        if table == full[m]:
+            yield prefix + '-'*m
+            return
+        half = 1 << (m-1)
+        lo = table & full[m-1]
+        hi = table >> half
+        both = lo & hi
+        yield from helper(both, m-1, prefix + '-')
+        yield from helper(lo ^ both, m-1, prefix + '0')
+        yield from helper(hi ^ both, m-1, prefix + '1')
+
+    yield from helper(table & full[n], n, '')
+
+def truth_indices_to_cubes(ones, n):
+    return table_to_cubes(truth_indices_to_table(ones, n), n)
+
+# eg: '1-0' -> A/C
+def cube_to_product(cube, varnames):
+    assert len(cube) == len(varnames)
+    factors = []
+    for (c, name) in zip(cube, varnames):
+        match c:
+            case '-': continue
+            case '1': factors.append(Var(name))
+            case '0': factors.append(Not(Var(name)))
+            case _: raise Exception(f'error: {c}')
+
+    match len(factors):
+        case 0: return Val(True)
+        case 1: return factors[0]
+        case _: return And(*factors)
+
+# eg: '1-0' -> /A+C, the sum that is false exactly on the rows of the cube
+def cube_to_sum(cube, varnames):
+    assert len(cube) == len(varnames)
+    addends = []
+    for (c, name) in zip(cube, varnames):
+        match c:
+            case '-': continue
+            case '1': addends.append(Not(Var(name)))
+            case '0': addends.append(Var(name))
+            case _: raise Exception(f'error: {c}')
+
+    match len(addends):
+        case 0: return Val(False)
+        case 1: return addends[0]
+        case _: return Or(*addends)
+
+# stream one product per cube, without collecting them
+def iter_sop_products(cubes, varnames):
+    for cube in cubes:
+        yield cube_to_product(cube, varnames)
+
+# stream one sum per cube of ZERO rows, without collecting them
+def iter_pos_sums(cubes, varnames):
+    for cube in cubes:
+        yield cube_to_sum(cube, varnames)
+
+# cubes (of the true rows) -> sum of products
+# eg: ['1-', '01'] -> A + /AB
+def cubes_to_sop(cubes, varnames):
+    products = []
+    for product in iter_sop_products(cubes, varnames):
+        if product == True:
+            return Val(True)
+        products.append(product)
+
+    match len(products):
+        case 0: return Val(False)
+        case 1: return products[0]
+        case _: return Or(*products)
+
+# cubes (of the false rows) -> product of sums
+# eg: ['00'] -> A+B
+def cubes_to_pos(cubes, varnames):
+    sums = []
+    for sum_ in iter_pos_sums(cubes, varnames):
+        if sum_ == False:
+            return Val(False)
+        sums.append(sum_)
+
+    match len(sums):
+        case 0: return Val(True)
+        case 1: return sums[0]
+        case _: return And(*sums)
+
+# packed truth table -> sum of products over merged cubes
+def truth_table_to_sop(table, varnames):
+    return cubes_to_sop(table_to_cubes(table, len(varnames)), varnames)
+
+# packed truth table -> product of sums over merged cubes of the false rows
+def truth_table_to_pos(table, varnames):
+    n = len(varnames)
+    zeroes = ~table & ((1 << (1 << n)) - 1)
+    return cubes_to_pos(table_to_cubes(zeroes, n), varnames)
+
 #------------------------------------------------------------------------------
 # format testers
 #------------------------------------------------------------------------------
@@ -213,6 +351,10 @@ def is_binary(expr):
     return len(expr.children) <= 2 and all([is_binary(c) for c in expr.children])
 
 def is_cnf(expr):
+    # valid by construction
+    if isinstance(expr, CNF):
+        return True
+
     if type(expr) != And:
         return False
 
@@ -243,55 +385,71 @@ def print_truth_table(expr, varnames=None):
         binstr = ''.join(['1' if i&(1<<(n-k-1)) else '0' for k in range(n)])
         print(f'{binstr} {1 if i in indices else 0}')
 
-def shellout(cmd, input_text=None):
-    process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    if input_text == None:
-        (stdout, stderr) = process.communicate()
-    else:
-        if type(input_text) == str:
-            input_text = input_text.encode('utf-8')
-        (stdout, stderr) = process.communicate(input=input_text)
-    stdout = stdout.decode("utf-8")
-    stderr = stderr.decode("utf-8")
-    process.wait()
-    return (stdout, stderr)
-
-def gen_dot(expr):
-    dot = []
-    dot.append('digraph G {')
+# run cmd with input_text on stdin, returns (stdout, stderr)
+# goes through the shared process pool, which bounds how many run at once
+def shellout(cmd, input_text=None, timeout=None):
+    from ..procpool import default_pool
+    return default_pool().run(cmd, input_text, timeout)
+
+# write graphviz for an expression to file object fp, a line at a time
+#
+# Nodes are keyed by id(), so a subexpression shared by several parents (a DAG)
+# is written once with an edge to each parent.
+#
+# max_depth: nodes deeper than this are drawn as a collapsed "..." node
+# max_nodes: nodes (leaves too) to draw at most, the rest are drawn as one
+#   "..." node feeding every parent that lost children to it
+def write_dot(expr, fp, max_depth=None, max_nodes=None):
+    fp.write('digraph G {\n')
 
     # global graph settings
-    dot.append('// global settings')
-    dot.append('rankdir="LR"')
-    #dot.append('graph [splines=ortho];')
-    dot.append('node [shape="rectangle"];')
-    dot.append('edge [];')
-
-    # node list
-    dot.append('// nodes')
-    for n in expr.all_nodes():
+    fp.write('// global settings\n')
+    fp.write('rankdir="LR"\n')
+    #fp.write('graph [splines=ortho];\n')
+    fp.write('node [shape="rectangle"];\n')
+    fp.write('edge [];\n')
+
+    # nodes and edges, breadth first so a shared node is placed at its shallowest depth
+    fp.write('// nodes and edges\n')
+    # seen holds every node written or queued, so it is also the node count
+    seen = {id(expr)}
+    queue = collections.deque([(expr, 0)])
+    more = False
+    while queue:
+        (n, depth) = queue.popleft()
+
         if type(n) == Var:
-            label = n.name
-            extra = ' shape="plain"'
+            fp.write(f'{id(n)} [label="{n.name}" shape="plain"];\n')
+        elif type(n) == Val:
+            fp.write(f'{id(n)} [label="{n}" shape="plain"];\n')
+        elif max_depth != None and depth >= max_depth:
+            fp.write(f'{id(n)} [label="{n.__class__.__name__} ..." style="dashed"];\n')
+            continue
         else:
-            label = n.__class__.__name__
-            extra = ''
-        dot.append(f'{id(n)} [label="{label}"{extra}];')
-
-    def edge_finder(n):
-        if type(n) == Var: return []
-        result = [(n, c) for c in n.children]
-        result = result + sum([edge_finder(c) for c in n.children], [])
-        return result
-
-    # edge list
-    dot.append('// edges')
-    for (a, b) in edge_finder(expr):
-        dot.append(f'{id(b)} -> {id(a)};')
-
-    dot.append('}')
-
-    return '\n'.join(dot)
+            fp.write(f'{id(n)} [label="{n.__class__.__name__}"];\n')
+
+        lost = False
+        for c in n.children:
+            if not id(c) in seen:
+                if max_nodes != None and len(seen) >= max_nodes:
+                    lost = True
+                    continue
+                seen.add(id(c))
+                queue.append((c, depth+1))
+            fp.write(f'{id(c)} -> {id(n)};\n')
+
+        if lost:
+            if not more:
+                fp.write('more [label="..." style="dashed"];\n')
+                more = True
+            fp.write(f'more -> {id(n)};\n')
+
+    fp.write('}\n')
+
+def gen_dot(expr, max_depth=None, max_nodes=None):
+    fp = io.StringIO()
+    write_dot(expr, fp, max_depth, max_nodes)
+    return fp.getvalue()
 
 #------------------------------------------------------------------------------
 # tests
@@ -304,7 +462,6 @@ if __name__ == '__main__':
     print(expr)
     print(expr.__py__())
     print_truth_table(expr)
-    sys.exit(0)
 
     print('GENERATE SOME RANDOM EQUATIONS')
     varnames = list('ABCDEF')
@@ -387,6 +544,55 @@ if __name__ == '__main__':
         indices1 = to_truth_indices(expr1)
         print(f'{expr1} -> {indices1}')
 
+    print('CUBES FROM PACKED TRUTH TABLES')
+    assert truth_indices_to_table([1, 2], 2) == 0b0110
+    assert to_truth_table(parse_python('A ^ B')) == 0b0110
+    assert list(table_to_cubes(0b0110, 2)) == ['01', '10']
+    assert list(table_to_cubes(0b1110, 2)) == ['-1', '10']
+    assert list(table_to_cubes(0b1111, 2)) == ['--']
+    assert list(table_to_cubes(0, 2)) == []
+    assert str(truth_table_to_sop(0b1110, ['A', 'B'])) == '/BA+B'
+    assert str(truth_table_to_pos(0b1110, ['A', 'B'])) == 'A+B'
+    assert truth_table_to_sop(0, ['A']) == False
+    assert truth_table_to_pos(0, ['A']) == False
+    assert truth_table_to_sop(0b11, ['A']) == True
+    assert truth_table_to_pos(0b11, ['A']) == True
+
+    for n_nodes in range(1, 40):
+        expr0 = generate(n_nodes, list('ABCDEF'))
+        varnames = sorted(expr0.varnames())
+        table = to_truth_table(expr0, varnames)
+        sop = truth_table_to_sop(table, varnames)
+        pos = truth_table_to_pos(table, varnames)
+        assert to_truth_indices(sop, varnames) == to_truth_indices(expr0, varnames)
+        assert to_truth_indices(pos, varnames) == to_truth_indices(expr0, varnames)
+
+    # half the rows of a 20 variable function, one cube instead of 2^19 minterms
+    varnames = [f'x{i}' for i in range(20)]
+    ones = range(2**19, 2**20)
+    assert list(truth_indices_to_cubes(ones, 20)) == ['1' + '-'*19]
+    assert str(truth_table_to_sop(truth_indices_to_table(ones, 20), varnames)) == 'x0'
+
+    print('DOT OUTPUT')
+    a = parse_python('A')
+    shared = And(a, Not(a))
+    expr = Or(shared, Xor(shared, parse_python('B')))
+    dot = gen_dot(expr)
+    assert dot.count(f'{id(shared)} [') == 1
+    assert dot.count(f'{id(a)} [') == 1
+    assert dot.count(f'{id(shared)} -> ') == 2
+    assert dot.count(' -> ') == 7
+    dot = gen_dot(expr, max_depth=1)
+    assert dot.count('...') == 2
+    assert not f'{id(a)} [' in dot
+    dot = gen_dot(expr, max_nodes=2)
+    assert dot.count('[label=') == 3 and dot.count('...') == 1
+    # leaves count too
+    expr = And(*[Var(f'x{i}') for i in range(100)])
+    dot = gen_dot(expr, max_nodes=10)
+    assert dot.count('[label=') == 11 and dot.count('more -> ') == 1 and dot.count(' -> ') == 10
+    assert gen_dot(expr, max_nodes=101) == gen_dot(expr)
+
     print('FACTOR OUT SUBTREE')
     a = parse_python('A')
     b = parse_python('B')
@@ -1,5 +1,70 @@
+import time
+
 from .expr import *
-from .tools import *
+from .tools import is_binary
+from .cnf import CNF
+
+#------------------------------------------------------------------------------
+# encoding statistics
+#------------------------------------------------------------------------------
+
+# filled in by Tseytin_transformation() and Tseytin_encode() when asked for
+# (with_stats=True) or when any stats_hooks are registered
+class TseytinStats(object):
+    def __init__(self):
+        # gate type name -> count, eg: {'And': 3, 'Or': 1}
+        self.gates = {}
+        self.n_vars = 0
+        self.n_clauses = 0
+        self.n_literals = 0
+        self.max_width = 0
+        # XOR constraints (native_xor), not counted in the clauses
+        self.n_xors = 0
+        # phase ('deepen', 'encode', 'flatten', 'reduce') -> seconds
+        self.timings = {}
+        # expression nodes, counting shared nodes once: the input, or for
+        # Tseytin_transformation() the larger of the input and its result
+        self.n_nodes = 0
+
+    def count_gate(self, node):
+        name = type(node).__name__
+        self.gates[name] = self.gates.get(name, 0) + 1
+
+    def count_clause(self, width):
+        self.n_clauses += 1
+        self.n_literals += width
+        self.max_width = max(self.max_width, width)
+
+    # runs fn(*args), adding its time to phase
+    def timed(self, phase, fn, *args):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        self.timings[phase] = self.timings.get(phase, 0) + time.perf_counter() - t0
+        return result
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        gates = ' '.join(f'{k}={v}' for (k, v) in sorted(self.gates.items()))
+        timings = ' '.join(f'{k}={v*1000:.1f}ms' for (k, v) in self.timings.items())
+        return f'<TseytinStats vars={self.n_vars} clauses={self.n_clauses} literals={self.n_literals} ' \
+            f'xors={self.n_xors} max_width={self.max_width} nodes={self.n_nodes} gates=[{gates}] ' \
+            f'timings=[{timings}]>'
+
+# functions called with the TseytinStats of every encoding, eg: for a pipeline
+# to log each instance
+#
+#   stats_hooks.append(lambda stats: log.info(repr(stats)))
+stats_hooks = []
+
+def report_stats(stats):
+    for hook in stats_hooks:
+        hook(stats)
+
+# the stats to fill, None when nobody wants them
+def new_stats(with_stats):
+    return TseytinStats() if with_stats or stats_hooks else None
 
 #------------------------------------------------------------------------------
 # Tseytin transformation
@@ -8,60 +73,589 @@ from .tools import *
 
 # returns (expression equisatisfiable with proper operation of this gate,
 #          variable representing output of this gate)
-def Tseytin_transformation_re(node):
+#
+# polarity: 0 defines the gate fully, output <-> operation
+#          +1 when the output will only be required true, output -> operation
+#          -1 when the output will only be required false, operation -> output
+# the one-directional forms are the Plaisted-Greenbaum encoding
+#
+# numbering: {id(node): n} naming the gate of each node gate_<n>, by default
+# from gate_numbering(node)
+def Tseytin_transformation_re(node, polarity=0, numbering=None):
+    if numbering == None:
+        numbering = gate_numbering(node)
+    pos = polarity >= 0
+    neg = polarity <= 0
     if type(node) == And:
         if len(node.children) != 2:
             raise NotImplementedError()
-        A_tseytin, A = Tseytin_transformation_re(node.children[0])
-        B_tseytin, B = Tseytin_transformation_re(node.children[1])
+        A_tseytin, A = Tseytin_transformation_re(node.children[0], polarity, numbering)
+        B_tseytin, B = Tseytin_transformation_re(node.children[1], polarity, numbering)
         # generate variable representing this output
-        C = Var(f'gate_{id(node)}')
-        C_tseytin = And(Or(Not(A), Not(B), C), Or(A, Not(C)), Or(B, Not(C)))
-        return (And(A_tseytin, B_tseytin, C_tseytin), C)
+        C = Var(f'gate_{numbering[id(node)]}')
+        clauses = []
+        if neg: clauses.append(Or(Not(A), Not(B), C))
+        if pos: clauses.extend([Or(A, Not(C)), Or(B, Not(C))])
+        return (And(A_tseytin, B_tseytin, *clauses), C)
     elif type(node) == Or:
         if len(node.children) != 2:
             raise NotImplementedError()
-        A_tseytin, A = Tseytin_transformation_re(node.children[0])
-        B_tseytin, B = Tseytin_transformation_re(node.children[1])
+        A_tseytin, A = Tseytin_transformation_re(node.children[0], polarity, numbering)
+        B_tseytin, B = Tseytin_transformation_re(node.children[1], polarity, numbering)
         # generate variable representing this output
-        C = Var(f'gate_{id(node)}')
-        C_tseytin = And(Or(A, B, Not(C)), Or(Not(A), C), Or(Not(B), C))
-        return (And(A_tseytin, B_tseytin, C_tseytin), C)
+        C = Var(f'gate_{numbering[id(node)]}')
+        clauses = []
+        if pos: clauses.append(Or(A, B, Not(C)))
+        if neg: clauses.extend([Or(Not(A), C), Or(Not(B), C)])
+        return (And(A_tseytin, B_tseytin, *clauses), C)
     elif type(node) == Xor:
         if len(node.children) != 2:
             raise NotImplementedError()
-        A_tseytin, A = Tseytin_transformation_re(node.children[0])
-        B_tseytin, B = Tseytin_transformation_re(node.children[1])
+        # either value of the output depends on both values of the inputs
+        A_tseytin, A = Tseytin_transformation_re(node.children[0], 0, numbering)
+        B_tseytin, B = Tseytin_transformation_re(node.children[1], 0, numbering)
         # generate variable representing this output
-        C = Var(f'gate_{id(node)}')
-        C_tseytin = And(Or(Not(A), Not(B), Not(C)), Or(A, B, Not(C)), Or(A, Not(B), C), Or(Not(A), B, C))
-        return (And(A_tseytin, B_tseytin, C_tseytin), C)
+        C = Var(f'gate_{numbering[id(node)]}')
+        clauses = []
+        if pos: clauses.extend([Or(Not(A), Not(B), Not(C)), Or(A, B, Not(C))])
+        if neg: clauses.extend([Or(A, Not(B), C), Or(Not(A), B, C)])
+        return (And(A_tseytin, B_tseytin, *clauses), C)
     elif type(node) == Not:
         if len(node.children) != 1:
             raise NotImplementedError()
-        A_tseytin, A = Tseytin_transformation_re(node.children[0])
+        A_tseytin, A = Tseytin_transformation_re(node.children[0], -polarity, numbering)
         # generate variable representing this output
-        C = Var(f'gate_{id(node)}')
-        C_tseytin = And(Or(Not(A), Not(C)), Or(A, C))
-        return (And(A_tseytin, C_tseytin), C)
+        C = Var(f'gate_{numbering[id(node)]}')
+        clauses = []
+        if pos: clauses.append(Or(Not(A), Not(C)))
+        if neg: clauses.append(Or(A, C))
+        return (And(A_tseytin, *clauses), C)
     elif type(node) == Var:
         return (Val(True), node)
     else:
         raise NotImplementedError()
 
-def Tseytin_transformation(expr):
+# gates are numbered in post-order (children before parents), skipping
+# variables, so the same expression always gets the same gate names
+def gate_numbering(expr):
+    gates = [n for n in post_order(expr) if type(n) != Var]
+    return {id(n): i for (i, n) in enumerate(gates)}
+
+# polarity: see Tseytin_transformation_re(), use +1 (or -1) for a
+# Plaisted-Greenbaum encoding when outvar will be asserted true (or false)
+# gates: optional dict, filled with {'gate_<n>': node} for every gate
+# with_stats: also return a TseytinStats, as (expr, outvar, stats)
+def Tseytin_transformation(expr, polarity=0, gates=None, with_stats=False):
+    stats = new_stats(with_stats)
+    if stats == None:
+        run = lambda phase, fn, *args: fn(*args)
+    else:
+        run = stats.timed
+        stats.n_nodes = len(post_order(expr))
+
     if not is_binary(expr):
-        expr = expr.deepen()
+        expr = run('deepen', expr.deepen)
+
+    numbering = gate_numbering(expr)
+    if gates != None:
+        for n in post_order(expr):
+            if id(n) in numbering:
+                gates[f'gate_{numbering[id(n)]}'] = n
 
-    expr, outvar = Tseytin_transformation_re(expr)
+    if stats != None:
+        for n in post_order(expr):
+            if id(n) in numbering:
+                stats.count_gate(n)
+        stats.n_vars = len(input_names(expr)) + len(numbering)
+
+    expr, outvar = run('encode', Tseytin_transformation_re, expr, polarity, numbering)
+
+    if stats != None:
+        stats.n_nodes = max(stats.n_nodes, len(post_order(expr)))
 
     # un-nest ANDs, so the final expression is one big AND
-    expr.flatten()
+    run('flatten', expr.flatten)
 
     # discard True conjuncts, which were returned by transforming literals
-    expr.reduce()
+    run('reduce', expr.reduce)
+
+    if stats == None:
+        return (expr, outvar)
+
+    for c in (expr.children if type(expr) == And else [expr]):
+        if type(c) != Val:
+            stats.count_clause(len(c.children) if type(c) == Or else 1)
+    report_stats(stats)
+    return (expr, outvar, stats) if with_stats else (expr, outvar)
+
+#------------------------------------------------------------------------------
+# Tseytin transformation straight to integer clauses
+#------------------------------------------------------------------------------
+
+# Walks the expression once (no deepen/flatten/reduce), allocating an anonymous
+# CNF variable per gate and emitting n-ary definitions directly:
+#
+#   g = AND(x1..xk): (/g + xi) for each i, (g + /x1 + ... + /xk)   k+1 clauses
+#   g = OR(x1..xk):  (g + /xi) for each i, (/g + x1 + ... + xk)    k+1 clauses
+#   g = XOR(a,b):    four clauses, n-ary XOR is a chain (parity, like deepen())
+#   NOT:             no gate, the child literal is negated
+#   AtMost/AtLeast/Exactly: a unary counter (see cardinality.py) over the
+#                    inputs, g tied to the one or two outputs at the bound
+#   PB:              see pseudo_boolean.py, g tied to the literal it returns
+#
+# Each gate has a mask of needed directions: POS for g -> operation, NEG for
+# operation -> g. With polarity tracking (Plaisted-Greenbaum) a gate under an
+# output that is only ever asserted true gets POS alone, NOT swaps the two,
+# and XOR inputs need both.
+POS = 1
+NEG = 2
+BOTH = POS | NEG
+
+def flip(mask):
+    return ((mask & POS) << 1) | ((mask & NEG) >> 1)
+
+# unique nodes of expr, children before parents, without recursion
+def post_order(expr):
+    result = []
+    seen = set()
+    stack = [(expr, False)]
+    while stack:
+        (node, ready) = stack.pop()
+        if ready:
+            result.append(node)
+            continue
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        stack.extend((c, False) for c in reversed(node.children) if not id(c) in seen)
+    return result
+
+# Gate variables are numbered in the order gates are first needed, which is
+# post-order (children left to right before parents), so the same expression
+# always produces the same CNF. encoder.gates maps each back to its node.
+#
+# Gates are hashed structurally on their input literals, so identical
+# subformulas (even separate clones) get one gate and one set of clauses, and
+# an encoder reused across encode() calls shares gates between the roots.
+#
+# OR is encoded as a negated AND of negated inputs and XOR inputs are made
+# positive, so /A+/B shares the gate of AB and /A^B the gate of A^B.
+#
+# cnf: a CNF, or anything with its new_var()/var()/add_clause()/n_vars, like
+#   a dimacs.DimacsWriter
+# share: structural hashing on, off saves its memory for very large outputs
+# record_gates: keep the gates map, and encoder.definitions: a list of
+#   (gate variable, first clause, end clause) for the clauses each gate
+#   definition added, innermost first (see preprocess.prune_cnf())
+# native_xor: emit XOR constraints (cnf.add_xor()) instead of clauses, with
+#   nested Xor nodes gathered into one constraint, for CryptoMiniSat
+# card: counter for cardinality nodes, 'seqcounter', 'totalizer', 'sortnet'
+#   or 'auto' to pick by size, see cardinality.py
+# pb: likewise for PB nodes, 'bdd', 'adder', 'sortnet' or 'auto', see
+#   pseudo_boolean.py
+class TseytinEncoder(object):
+    def __init__(self, cnf=None, share=True, record_gates=True, native_xor=False, card='auto', pb='auto'):
+        self.cnf = CNF() if cnf == None else cnf
+        self.true_lit = None
+        self.share = share
+        self.native_xor = native_xor
+        self.card = card
+        self.pb = pb
+        # (op, input literals) -> (gate variable, mask of directions emitted)
+        self.memo = {}
+        # gate variable -> the first node encoded by it
+        self.gates = {} if record_gates else None
+        self.definitions = [] if record_gates else None
+
+    # literal that is always true, for Val nodes
+    def constant(self, value):
+        if self.true_lit == None:
+            self.true_lit = self.cnf.new_var()
+            self.cnf.add_clause([self.true_lit])
+        return self.true_lit if value else -self.true_lit
+
+    # gate variable for key, emitting whichever directions in mask are new
+    def memo_gate(self, key, xs, mask, define):
+        (g, done) = self.memo.get(key, (None, 0))
+        if g == None:
+            g = self.cnf.new_var()
+        missing = mask & ~done
+        if missing:
+            start = self.cnf.n_clauses
+            define(g, xs, missing)
+            if self.definitions != None:
+                self.definitions.append((g, start, self.cnf.n_clauses))
+            if self.share:
+                self.memo[key] = (g, done | missing)
+        return g
+
+    def define_and(self, g, xs, mask):
+        if mask & POS:
+            for x in xs:
+                self.cnf.add_clause([-g, x])
+        if mask & NEG:
+            self.cnf.add_clause([g] + [-x for x in xs])
+
+    def define_xor(self, g, xs, mask):
+        (a, b) = xs
+        if mask & POS:
+            self.cnf.add_clauses([[-a, -b, -g], [a, b, -g]])
+        if mask & NEG:
+            self.cnf.add_clauses([[a, -b, g], [-a, b, g]])
+
+    def gate_and(self, xs, mask=BOTH):
+        xs = set(xs)
+        if self.true_lit != None:
+            if -self.true_lit in xs:
+                return self.constant(False)
+            xs.discard(self.true_lit)
+        if any(-x in xs for x in xs):
+            return self.constant(False)
+        xs = sorted(xs)
+
+        if len(xs) == 0:
+            return self.constant(True)
+        if len(xs) == 1:
+            return xs[0]
+        return self.memo_gate(('And', tuple(xs)), xs, mask, self.define_and)
 
-    return (expr, outvar)
+    # x1 + ... + xk = /(/x1 ... /xk)
+    def gate_or(self, xs, mask=BOTH):
+        return -self.gate_and([-x for x in xs], flip(mask))
+
+    def gate_xor2(self, a, b, mask=BOTH):
+        # /a ^ b = /(a ^ b)
+        negate = (a < 0) != (b < 0)
+        (a, b) = sorted([abs(a), abs(b)])
+        if negate:
+            mask = flip(mask)
+
+        if a == b:
+            g = self.constant(False)
+        elif self.true_lit in (a, b):
+            g = -(b if a == self.true_lit else a)
+        else:
+            g = self.memo_gate(('Xor', a, b), (a, b), mask, self.define_xor)
+
+        return -g if negate else g
+
+    def gate_xor(self, xs, mask=BOTH):
+        if len(xs) == 0:
+            return self.constant(False)
+        a = xs[0]
+        for (i, b) in enumerate(xs[1:], 2):
+            # only the last gate of the chain is an output
+            a = self.gate_xor2(a, b, mask if i == len(xs) else BOTH)
+        return a
+
+    # g = x1 ^ ... ^ xk as the single constraint /g ^ x1 ^ ... ^ xk
+    def define_xor_native(self, g, xs, mask):
+        self.cnf.add_xor([-g] + list(xs))
+
+    # xs -> (negated, set of variables appearing an odd number of times), with
+    # negations and constants pulled out and pairs cancelled
+    def xor_parity(self, xs):
+        negate = False
+        odd = set()
+        for x in xs:
+            if type(x) == tuple:
+                # a folded Xor, already a parity
+                negate ^= x[0]
+                odd ^= x[1]
+                continue
+            if x < 0:
+                negate = not negate
+                x = -x
+            if x == self.true_lit:
+                negate = not negate
+            else:
+                odd ^= {x}
+        return (negate, odd)
+
+    def gate_xor_native(self, xs):
+        (negate, odd) = self.xor_parity(xs)
+        xs = sorted(odd)
+
+        if len(xs) == 0:
+            g = self.constant(False)
+        elif len(xs) == 1:
+            g = xs[0]
+        else:
+            g = self.memo_gate(('XorN', tuple(xs)), xs, BOTH, self.define_xor_native)
+
+        return -g if negate else g
+
+    # Xor nodes (other than the root) used only as inputs of other Xor nodes,
+    # these are folded into their parents when native_xor is on
+    def xor_chains(self, order):
+        only_xor_parents = {}
+        for node in order:
+            for c in node.children:
+                if type(c) == Xor:
+                    only_xor_parents[id(c)] = only_xor_parents.get(id(c), True) and type(node) == Xor
+        only_xor_parents.pop(id(order[-1]), None)
+        return {k for (k, v) in only_xor_parents.items() if v}
+
+    # g = (count of true xs) op k, op one of 'AtMost', 'AtLeast', 'Exactly'
+    def define_card(self, op, k, g, xs, mask):
+        # counter directions: up makes the outputs at least the count, down at most
+        match op:
+            case 'AtMost': (up, down) = (mask & POS, mask & NEG)
+            case 'AtLeast': (up, down) = (mask & NEG, mask & POS)
+            case 'Exactly': (up, down) = (True, True)
+        from .cardinality import unary_count
+        us = unary_count(self.cnf, xs, k+1, bool(up), bool(down), self.card)
+
+        # g = at_least_k * /at_least_k+1, each None when out of range (true, false)
+        lo = us[k-1] if k > 0 and op != 'AtMost' else None
+        hi = us[k] if k < len(us) and op != 'AtLeast' else None
+        if mask & POS:
+            if lo != None: self.cnf.add_clause([-g, lo])
+            if hi != None: self.cnf.add_clause([-g, -hi])
+        if mask & NEG:
+            self.cnf.add_clause([g] + ([-lo] if lo != None else []) + ([hi] if hi != None else []))
+
+    def gate_card(self, op, k, xs, mask=BOTH):
+        # constants and complementary pairs move into the bound
+        pending = {}
+        for x in xs:
+            if self.true_lit != None and abs(x) == self.true_lit:
+                k -= x > 0
+            elif pending.get(-x, 0) > 0:
+                pending[-x] -= 1
+                k -= 1
+            else:
+                pending[x] = pending.get(x, 0) + 1
+        xs = sorted(x for (x, n) in pending.items() for i in range(n))
+
+        holds = {
+            'AtMost': lambda count: count <= k,
+            'AtLeast': lambda count: count >= k,
+            'Exactly': lambda count: count == k,
+        }[op]
+        results = {holds(count) for count in range(len(xs)+1)}
+        if len(results) == 1:
+            return self.constant(results.pop())
+
+        define = lambda g, xs, mask: self.define_card(op, k, g, xs, mask)
+        return self.memo_gate((op, k, tuple(xs)), xs, mask, define)
+
+    # g = (sum of ws[i] * xs[i]) <= k
+    def define_pb(self, k, g, terms, mask):
+        ws = [w for (x, w) in terms]
+        xs = [x for (x, w) in terms]
+        from .pseudo_boolean import encode_pb
+        le = encode_pb(self, ws, xs, k, bool(mask & POS), bool(mask & NEG), self.pb)
+        if mask & POS: self.cnf.add_clause([-g, le])
+        if mask & NEG: self.cnf.add_clause([g, -le])
+
+    def gate_pb(self, ws, k, xs, mask=BOTH):
+        # positive weights only: w*x = w + -w*/x
+        terms = {}
+        for (w, x) in zip(ws, xs):
+            if w < 0:
+                (w, x, k) = (-w, -x, k - w)
+            if self.true_lit != None and abs(x) == self.true_lit:
+                k -= w if x > 0 else 0
+            elif w:
+                terms[x] = terms.get(x, 0) + w
+
+        # a*x + b*/x = min(a, b) + |a-b| on whichever had more
+        for x in [x for x in terms if x > 0 and -x in terms]:
+            (a, b) = (terms.pop(x), terms.pop(-x))
+            k -= min(a, b)
+            if a != b:
+                terms[x if a > b else -x] = abs(a - b)
+
+        if k < 0:
+            return self.constant(False)
+        if sum(terms.values()) <= k:
+            return self.constant(True)
+        terms = sorted(terms.items())
+
+        if len({w for (x, w) in terms}) == 1:
+            return self.gate_card('AtMost', k // terms[0][1], [x for (x, w) in terms], mask)
+
+        define = lambda g, terms, mask: self.define_pb(k, g, terms, mask)
+        return self.memo_gate(('PB', k, tuple(terms)), terms, mask, define)
+
+    def gate(self, node, xs, mask=BOTH):
+        match type(node).__name__:
+            case 'Var': return self.cnf.var(node.name)
+            case 'Val': return self.constant(node.value)
+            case 'Not': return -xs[0]
+            case 'And': return self.gate_and(xs, mask)
+            case 'Or': return self.gate_or(xs, mask)
+            case 'Xor': return self.gate_xor(xs, mask)
+            case 'AtMost' | 'AtLeast' | 'Exactly': return self.gate_card(type(node).__name__, node.bound, xs, mask)
+            case 'PB': return self.gate_pb(node.weights, node.bound, xs, mask)
+            case _: raise NotImplementedError()
+
+    # mask of needed directions for every node, parents are visited before children
+    def polarities(self, order, polarity):
+        masks = {id(order[-1]): {1: POS, -1: NEG}.get(polarity, BOTH)}
+        for node in reversed(order):
+            mask = masks[id(node)]
+            match type(node).__name__:
+                case 'Not' | 'AtMost': child_mask = flip(mask)
+                case 'And' | 'Or' | 'AtLeast': child_mask = mask
+                case _: child_mask = BOTH
+            for (i, c) in enumerate(node.children):
+                if type(node) == PB:
+                    # same as AtMost for positive weights, AtLeast for negative
+                    child_mask = flip(mask) if node.weights[i] > 0 else mask
+                masks[id(c)] = masks.get(id(c), 0) | child_mask
+        return masks
+
+    # returns the literal equal to expr
+    #
+    # polarity: +1 (or -1) for a Plaisted-Greenbaum encoding, when the returned
+    # literal will only be asserted true (or false), 0 for full equivalence
+    def encode(self, expr, polarity=0):
+        order = post_order(expr)
+        masks = self.polarities(order, polarity) if polarity else None
+
+        folded = self.xor_chains(order) if self.native_xor else set()
+
+        # parents still to be encoded, a literal is dropped after the last
+        uses = {}
+        for node in order:
+            for c in node.children:
+                uses[id(c)] = uses.get(id(c), 0) + 1
+
+        lits = {}
+        for node in order:
+            mask = masks.pop(id(node)) if masks else BOTH
+            n_vars = self.cnf.n_vars
+            if self.native_xor and type(node) == Xor:
+                # a folded Xor is its parity, not a literal, computed once even
+                # when shared and only as large as the variables under it
+                xs = [lits[id(c)] for c in node.children]
+                lit = self.xor_parity(xs) if id(node) in folded else self.gate_xor_native(xs)
+            else:
+                lit = self.gate(node, [lits[id(c)] for c in node.children], mask)
+            # gates allocated for this node (several for an XOR chain)
+            if self.gates != None:
+                for var in range(n_vars+1, self.cnf.n_vars+1):
+                    if var != self.true_lit:
+                        self.gates[var] = node
+            lits[id(node)] = lit
+            for c in node.children:
+                uses[id(c)] -= 1
+                if uses[id(c)] == 0:
+                    del uses[id(c)]
+                    del lits[id(c)]
+
+        return lits[id(expr)]
+
+    # literals for several roots sharing one encoding
+    def encode_many(self, roots, polarity=0):
+        return [self.encode(root, polarity) for root in roots]
+
+# write the encoding of expr to text file object fp as DIMACS, without
+# holding the clauses in memory
+#
+# The expression itself is in memory, and the encoder keeps per-node
+# bookkeeping for it (the visiting order, and a literal per node until its
+# last parent is encoded), so memory is linear in the expression, not its
+# depth.
+#
+# A seekable fp is written in one pass, the header patched at the end. For a
+# pipe the encoding runs twice: once to count, once to write.
+#
+# desired_output: if not None, a unit clause fixing the output
+# share: see TseytinEncoder, turn off to drop its structural hash table
+# native_xor, card, pb: see TseytinEncoder
+#
+# returns (writer, output literal), writer.name2idx maps input names to variables
+def Tseytin_encode_to_file(expr, fp, desired_output=None, polarity=0, share=True, native_xor=False, card='auto', pb='auto'):
+    from .dimacs import ClauseCounter, DimacsWriter
+
+    names = sorted(input_names(expr))
+
+    def encode(sink):
+        for name in names:
+            sink.new_var(name)
+        out = TseytinEncoder(sink, share, record_gates=False, native_xor=native_xor, card=card, pb=pb).encode(expr, polarity)
+        if desired_output != None:
+            sink.add_clause([out if desired_output else -out])
+        return out
+
+    if fp.seekable():
+        writer = DimacsWriter(fp)
+    else:
+        counter = ClauseCounter()
+        encode(counter)
+        writer = DimacsWriter(fp, counter.n_vars, counter.n_clauses)
+
+    out = encode(writer)
+    writer.close()
+    return (writer, out)
+
+# like expr.varnames(), but without recursion and visiting shared nodes once
+def input_names(expr):
+    result = set()
+    seen = set()
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if type(node) == Var:
+            result.add(node.name)
+        stack.extend(node.children)
+    return result
+
+# returns (CNF equisatisfiable with proper operation of the gates,
+#          literal representing the output)
+#
+# input variables are numbered first, in sorted name order, then gates in
+# post-order, so the CNF (and its DIMACS) is the same from run to run
+#
+# polarity: see TseytinEncoder.encode()
+# gates: optional dict, filled with {gate variable: node}
+# definitions: optional list, extended with TseytinEncoder.definitions
+# native_xor, card, pb: see TseytinEncoder
+# with_stats: also return a TseytinStats, as (cnf, literal, stats), gates are
+#   counted by the node type that allocated them
+def Tseytin_encode(expr, polarity=0, gates=None, native_xor=False, card='auto', pb='auto', definitions=None, with_stats=False):
+    result = Tseytin_encode_many([expr], polarity, gates, native_xor, card, pb, definitions, with_stats)
+    return (result[0], result[1][0]) + result[2:]
+
+# like Tseytin_encode() for a list of expressions, returns (cnf, [literal, ...])
+# with every distinct subformula across all of them encoded once
+def Tseytin_encode_many(roots, polarity=0, gates=None, native_xor=False, card='auto', pb='auto', definitions=None, with_stats=False):
+    stats = new_stats(with_stats)
+
+    cnf = CNF()
+    for name in sorted(set().union(*[input_names(root) for root in roots])):
+        cnf.new_var(name)
+
+    encoder = TseytinEncoder(cnf, native_xor=native_xor, card=card, pb=pb)
+    if stats == None:
+        outs = encoder.encode_many(roots, polarity)
+    else:
+        outs = stats.timed('encode', encoder.encode_many, roots, polarity)
+    if gates != None:
+        gates.update(encoder.gates)
+    if definitions != None:
+        definitions.extend(encoder.definitions)
+
+    if stats == None:
+        return (cnf, outs)
+
+    # the integer encoder builds no nodes, only the input counts
+    stats.n_nodes = sum(len(post_order(root)) for root in roots)
+    for node in encoder.gates.values():
+        stats.count_gate(node)
+    stats.n_vars = cnf.n_vars
+    for clause in cnf:
+        stats.count_clause(len(clause))
+    stats.n_xors = cnf.n_xors
+    report_stats(stats)
+    return (cnf, outs, stats) if with_stats else (cnf, outs)
 
 if __name__ == '__main__':
     import sys
@@ -89,3 +683,400 @@ if __name__ == '__main__':
     expr = Or(Var('A'), Var('B'))
     texpr, v = Tseytin_transformation(expr)
     print(f'TSEYTIN({expr}): {v} = {texpr}')
+
+    print('TSEYTIN ENCODING TO INTEGER CLAUSES')
+    from .tools import generate, parse_python
+
+    # value of the output literal when inputs are fixed, found by unit propagation
+    # (complete for Tseytin definitions: every gate is forced by its inputs)
+    def propagate(cnf, values, out):
+        values = dict(values)
+        changed = True
+        while changed:
+            changed = False
+            for clause in cnf:
+                free = [l for l in clause if not abs(l) in values]
+                if any(values.get(abs(l)) == (l > 0) for l in clause):
+                    continue
+                assert free, 'conflict'
+                if len(free) == 1:
+                    values[abs(free[0])] = free[0] > 0
+                    changed = True
+        return values[abs(out)] == (out > 0)
+
+    def check(expr):
+        cnf, out = Tseytin_encode(expr)
+        varnames = sorted(expr.varnames())
+        n = len(varnames)
+        for i in range(2**n):
+            inputs = {name: bool(i & (1<<(n-pos-1))) for (pos, name) in enumerate(varnames)}
+            values = {cnf.var(name): value for (name, value) in inputs.items()}
+            assert propagate(cnf, values, out) == expr.evaluate(inputs)
+        return cnf
+
+    cnf, out = Tseytin_encode(Var('A'))
+    assert len(cnf) == 0 and out == 1
+    cnf, out = Tseytin_encode(Not(Var('A')))
+    assert len(cnf) == 0 and out == -1
+
+    # k+1 clauses per n-ary gate
+    cnf = check(parse_python('A and B and C and D'))
+    assert len(cnf) == 5 and cnf.n_vars == 5
+    cnf = check(parse_python('A or not B or C'))
+    assert len(cnf) == 4
+    cnf = check(parse_python('not (A and B) or (C and not D)'))
+    assert len(cnf) == 9
+    check(parse_python('A ^ B'))
+    check(parse_python('(A ^ B) ^ (C and D)'))
+    check(And(Var('A'), Val(True)))
+    check(Or(Var('A'), Val(False), Not(Val(True))))
+
+    for n_nodes in range(1, 40):
+        check(generate(n_nodes, list('ABCDEF')))
+
+    # deep expressions don't recurse
+    expr = Var('x0')
+    for i in range(1, 5000):
+        expr = And(Or(expr, Var(f'x{i}')), Not(Var(f'y{i}')))
+    cnf, out = Tseytin_encode(expr)
+    assert cnf.n_vars == 9999 + 2*4999
+
+
+    print('PLAISTED-GREENBAUM ENCODING')
+
+    # is the CNF satisfiable with the given variables fixed
+    def satisfiable(clauses, values):
+        values = dict(values)
+        while True:
+            unit = None
+            for clause in clauses:
+                if any(values.get(abs(l)) == (l > 0) for l in clause):
+                    continue
+                free = [l for l in clause if not abs(l) in values]
+                if not free:
+                    return False
+                if len(free) == 1:
+                    unit = free[0]
+                    break
+                if unit == None:
+                    branch = free[0]
+            if unit == None:
+                break
+            values[abs(unit)] = unit > 0
+        if all(any(values.get(abs(l)) == (l > 0) for l in clause) for clause in clauses):
+            return True
+        return satisfiable(clauses, {**values, abs(branch): True}) or satisfiable(clauses, {**values, abs(branch): False})
+
+    # for every input row, CNF + output asserted is satisfiable iff expr gives desired output
+    def check_pg(expr, desired):
+        polarity = 1 if desired else -1
+        cnf, out = Tseytin_encode(expr, polarity)
+        full, _ = Tseytin_encode(expr)
+        assert len(cnf) <= len(full)
+        clauses = [list(c) for c in cnf] + [[out if desired else -out]]
+        varnames = sorted(expr.varnames())
+        n = len(varnames)
+        for i in range(2**n):
+            inputs = {name: bool(i & (1<<(n-pos-1))) for (pos, name) in enumerate(varnames)}
+            values = {cnf.var(name): value for (name, value) in inputs.items()}
+            assert satisfiable(clauses, values) == (expr.evaluate(inputs) == desired)
+
+        # same for the BoolExpr transformation
+        texpr, outvar = Tseytin_transformation(expr.clone(), polarity)
+        texpr = texpr.reduce()
+        if type(texpr) == Val:
+            return
+        tcnf = CNF.from_expr(texpr)
+        clauses = [list(c) for c in tcnf] + [[tcnf.var(outvar.name) * polarity]]
+        for i in range(2**n):
+            inputs = {name: bool(i & (1<<(n-pos-1))) for (pos, name) in enumerate(varnames)}
+            values = {tcnf.var(name): value for (name, value) in inputs.items()}
+            assert satisfiable(clauses, values) == (expr.evaluate(inputs) == desired)
+
+    # half the clauses of a single gate
+    cnf, out = Tseytin_encode(parse_python('A and B and C'), 1)
+    assert len(cnf) == 3
+    cnf, out = Tseytin_encode(parse_python('A and B and C'), -1)
+    assert len(cnf) == 1
+    cnf, out = Tseytin_encode(parse_python('not (A or B or C)'), 1)
+    assert len(cnf) == 3
+    cnf, out = Tseytin_encode(parse_python('A ^ B'), 1)
+    assert len(cnf) == 2
+
+    check_pg(parse_python('(A and B) or not (C or (A and D))'), True)
+    check_pg(parse_python('(A and B) or not (C or (A and D))'), False)
+    check_pg(parse_python('(A ^ (B and C)) or not A'), True)
+    check_pg(parse_python('(A ^ (B and C)) or not A'), False)
+    for n_nodes in range(1, 30):
+        expr = generate(n_nodes, list('ABCDE'))
+        check_pg(expr, True)
+        check_pg(expr, False)
+
+    # a node shared under both polarities gets both directions
+    shared = parse_python('A and B')
+    expr = And(Or(shared, Var('C')), Not(And(shared, Var('D'))))
+    check_pg(expr, True)
+
+
+    print('STRUCTURAL SHARING')
+
+    # clones encode to the same gate
+    expr = parse_python('(A and B) or (B and A) or not (not A or not B)')
+    cnf, out = Tseytin_encode(expr)
+    assert cnf.n_vars == 3 and out == 3
+    check(expr)
+    # g ^ /g folds to the constant
+    cnf, out = Tseytin_encode(parse_python('(A ^ B) ^ (not A ^ B)'))
+    assert cnf.n_vars == 4 and len(cnf) == 5 and out == 4
+    check(parse_python('(A ^ B) ^ (not A ^ B)'))
+    check(parse_python('(A ^ B) and (B ^ A) and (A or not A)'))
+
+    # an n-bit adder is linear in n even though its carry expressions are
+    # built from clones and grow exponentially
+    from .components import register_adder, full_adder
+    for n in [4, 8, 12]:
+        roots = register_adder([f'A{i}' for i in range(n)], [f'B{i}' for i in range(n)])
+        cnf, outs = Tseytin_encode_many(roots)
+        assert len(outs) == n+1
+        assert cnf.n_vars <= 2*n + 5*n
+        print(f'{n}-bit adder: {cnf.n_vars} variables, {len(cnf)} clauses')
+
+        for trial in range(20):
+            import random
+            a, b = random.randrange(2**n), random.randrange(2**n)
+            inputs = {f'A{i}': bool(a & (1<<i)) for i in range(n)}
+            inputs.update({f'B{i}': bool(b & (1<<i)) for i in range(n)})
+            values = {cnf.var(name): value for (name, value) in inputs.items()}
+            total = sum(propagate(cnf, values, out) << i for (i, out) in enumerate(outs))
+            assert total == a + b
+
+
+    print('DETERMINISTIC NUMBERING')
+    from .sat_solve import to_dimacs
+
+    expr = parse_python('(A and not B) or (C ^ (A or D)) or not (B and D)')
+    gates = {}
+    texpr0, outvar0 = Tseytin_transformation(expr.clone(), gates=gates)
+    texpr1, outvar1 = Tseytin_transformation(expr.clone())
+    assert str(texpr0) == str(texpr1) and str(outvar0) == str(outvar1)
+    assert sorted(gates, key=lambda name: int(name.split('_')[1])) == [f'gate_{i}' for i in range(len(gates))]
+    assert gates[str(outvar0)].__class__ == Or
+
+    gates = {}
+    cnf0, out0 = Tseytin_encode(expr.clone(), gates=gates)
+    cnf1, out1 = Tseytin_encode(expr.clone())
+    assert to_dimacs(cnf0) == to_dimacs(cnf1) and out0 == out1
+    assert sorted(gates) == list(range(5, cnf0.n_vars+1))
+    assert type(gates[abs(out0)]) == Or
+    assert str(gates[5]) == '/BA'
+
+    # and across processes, where id() differs
+    import subprocess
+    script = 'from curiousbits.boolalg.tseytin import *; from curiousbits.boolalg.sat_solve import to_dimacs; ' + \
+        'from curiousbits.boolalg.components import register_adder; ' + \
+        'print(to_dimacs(Tseytin_encode_many(register_adder(list("ABCD"), list("EFGH")))[0])[0])'
+    runs = [subprocess.run([sys.executable, '-c', script], capture_output=True) for i in range(2)]
+    assert all(run.returncode == 0 and run.stdout for run in runs), [run.stderr for run in runs]
+    assert runs[0].stdout == runs[1].stdout
+
+
+    print('STREAMING TO DIMACS')
+    import io
+    from .dimacs import write_dimacs
+
+    class Pipe(io.StringIO):
+        def seekable(self):
+            return False
+
+    def clauses(text):
+        lines = text.strip().split('\n')
+        return (lines[0].split(), [line for line in lines[1:]])
+
+    for expr in [parse_python('(A and not B) or (C ^ (A or D)) or not (B and D)'), Var('A'), Val(False)]:
+        for desired_output in [None, True, False]:
+            for polarity in [0, 1]:
+                cnf, out = Tseytin_encode(expr, polarity)
+                if desired_output != None:
+                    cnf.add_clause([out if desired_output else -out])
+                fp = io.StringIO()
+                write_dimacs(cnf, fp)
+                expected = clauses(fp.getvalue())
+
+                for fp in [io.StringIO(), Pipe()]:
+                    writer, out2 = Tseytin_encode_to_file(expr, fp, desired_output, polarity)
+                    assert out2 == out and clauses(fp.getvalue()) == expected
+                    assert writer.name2idx == cnf.name2idx
+
+    # without sharing, the cloned carry chains of an adder are encoded again
+    roots = register_adder(list('ABCD'), list('EFGH'))
+    expr = Or(roots[-1], roots[-2])
+    fp = io.StringIO()
+    writer, out = Tseytin_encode_to_file(expr, fp, share=False)
+    assert writer.n_vars > Tseytin_encode(expr)[0].n_vars
+
+
+    print('NATIVE XOR CONSTRAINTS')
+
+    # a chain of Xor nodes is one constraint
+    expr = parse_python('((A ^ B) ^ (C ^ (not D))) ^ E')
+    cnf, out = Tseytin_encode(expr, native_xor=True)
+    assert len(cnf) == 0 and [list(x) for x in cnf.xors()] == [[-6, 1, 2, 3, 4, 5]] and out == -6
+
+    # shared inner Xor nodes with a non-Xor parent keep their own gate
+    inner = parse_python('A ^ B')
+    expr = Or(Xor(inner, Var('C')), And(inner, Var('D')))
+    cnf, out = Tseytin_encode(expr, native_xor=True)
+    assert cnf.n_xors == 2
+
+    # full adders: both sums are constraints, carries are clauses
+    S, C_out = full_adder('A', 'B', 'C')
+    cnf, outs = Tseytin_encode_many([S, C_out], native_xor=True)
+    assert cnf.n_xors >= 1
+
+    def check_native(expr):
+        cnf, out = Tseytin_encode(expr, native_xor=True)
+        expanded = cnf.expand_xors()
+        varnames = sorted(expr.varnames())
+        n = len(varnames)
+        for i in range(2**n):
+            inputs = {name: bool(i & (1<<(n-pos-1))) for (pos, name) in enumerate(varnames)}
+            values = {expanded.var(name): value for (name, value) in inputs.items()}
+            assert propagate(expanded, values, out) == expr.evaluate(inputs)
+
+    check_native(parse_python('((A ^ B) ^ (C ^ (not D))) ^ E'))
+    check_native(parse_python('(A ^ B) ^ (A ^ C)'))
+    check_native(parse_python('(A ^ True) ^ (B and (C ^ A))'))
+    check_native(expr)
+    for n_nodes in range(1, 40):
+        check_native(generate(n_nodes, list('ABCDEF')))
+
+    # a DAG of Xor nodes each shared twice, unfolded it doubles per level
+    node = Var('V0')
+    for i in range(1, 60):
+        node = Xor(node, Xor(node, Var(f'V{i}')))
+    cnf, out = Tseytin_encode(node, native_xor=True)
+    assert len(cnf) == 0 and cnf.n_xors == 0 and out == cnf.var('V59')
+
+
+    print('CARDINALITY')
+
+    A, B, C, D, E = [Var(name) for name in 'ABCDE']
+    cards = [
+        AtMost(1, A, B, C, D),
+        AtMost(2, A, Not(B), C, And(D, E), E),
+        AtLeast(2, A, B, Or(C, D), E),
+        AtLeast(1, A, B),
+        Exactly(2, A, B, C, D, E),
+        Exactly(0, A, Not(B)),
+        Exactly(1, A, Not(A), B),
+        Or(AtMost(1, A, B, C), Exactly(3, B, C, D, E)),
+        Not(AtLeast(3, A, B, C, D)),
+        AtMost(1, A, Val(True), B),
+    ]
+    for card in ['seqcounter', 'totalizer', 'sortnet']:
+        for expr in cards:
+            cnf = CNF()
+            for name in sorted(expr.varnames()):
+                cnf.new_var(name)
+            out = TseytinEncoder(cnf, card=card).encode(expr)
+            varnames = sorted(expr.varnames())
+            n = len(varnames)
+            for i in range(2**n):
+                inputs = {name: bool(i & (1<<(n-pos-1))) for (pos, name) in enumerate(varnames)}
+                values = {cnf.var(name): value for (name, value) in inputs.items()}
+                assert propagate(cnf, values, out) == expr.evaluate(inputs), (card, expr)
+
+            # Plaisted-Greenbaum
+            for desired in [True, False]:
+                cnf = CNF()
+                for name in varnames:
+                    cnf.new_var(name)
+                out = TseytinEncoder(cnf, card=card).encode(expr, 1 if desired else -1)
+                clauses = [list(c) for c in cnf] + [[out if desired else -out]]
+                for i in range(2**n):
+                    inputs = {name: bool(i & (1<<(n-pos-1))) for (pos, name) in enumerate(varnames)}
+                    values = {cnf.var(name): value for (name, value) in inputs.items()}
+                    assert satisfiable(clauses, values) == (expr.evaluate(inputs) == desired), (card, expr, desired)
+
+    # decided by the bound alone
+    cnf, out = Tseytin_encode(AtMost(3, A, B, C))
+    assert len(cnf) == 1 and list(cnf.clause(0)) == [out]
+    cnf, out = Tseytin_encode(Exactly(1, A, Not(A)))
+    assert len(cnf) == 1 and list(cnf.clause(0)) == [out]
+
+    # at most one of 50 stays small, where pairwise And/Or would be quadratic
+    xs = [Var(f'x{i}') for i in range(50)]
+    cnf, out = Tseytin_encode(AtMost(1, *xs))
+    assert len(cnf) < 400
+
+
+    print('PSEUDO-BOOLEAN')
+
+    pbs = [
+        PB([3, 2, 2], 4, A, B, C),
+        PB([3, -2, 5, 1], 3, A, B, Not(C), And(D, E)),
+        PB([2, 2, 3], 3, A, Not(A), B),
+        PB([4, 4, 4], 8, A, B, C),
+        PB([1, 7], 0, Val(True), A),
+        Or(PB([5, 3, 2], 5, A, B, C), PB([-1, -2, -3], -4, C, D, E)),
+        Not(PB([6, 5, 4, 3], 9, A, B, C, D)),
+    ]
+    for pb in ['bdd', 'adder', 'sortnet']:
+        for expr in pbs:
+            varnames = sorted(expr.varnames())
+            n = len(varnames)
+            for polarity in [0, 1, -1]:
+                cnf = CNF()
+                for name in varnames:
+                    cnf.new_var(name)
+                out = TseytinEncoder(cnf, pb=pb).encode(expr, polarity)
+                clauses = [list(c) for c in cnf]
+                for i in range(2**n):
+                    inputs = {name: bool(i & (1<<(n-pos-1))) for (pos, name) in enumerate(varnames)}
+                    values = {cnf.var(name): value for (name, value) in inputs.items()}
+                    result = expr.evaluate(inputs)
+                    if polarity == 0:
+                        assert propagate(cnf, values, out) == result, (pb, expr)
+                    else:
+                        desired = polarity > 0
+                        lit = out if desired else -out
+                        assert satisfiable(clauses + [[lit]], values) == (result == desired), (pb, expr, polarity)
+
+    # weights of a 20 term knapsack, a handful of clauses per term
+    weights = [17, 23, 5, 31, 12, 9, 28, 14, 7, 19, 26, 3, 11, 22, 8, 15, 30, 6, 13, 24]
+    xs = [Var(f'x{i}') for i in range(len(weights))]
+    cnf, out = Tseytin_encode(PB(weights, 100, *xs), polarity=1)
+    assert len(cnf) < 2000
+
+
+    print('STATISTICS')
+
+    expr = parse_python('(A and B and C) or (not A and (B ^ C))')
+    texpr, outvar, stats = Tseytin_transformation(expr.clone(), with_stats=True)
+    assert stats.gates == {'And': 3, 'Or': 1, 'Not': 1, 'Xor': 1}
+    assert stats.n_vars == 3 + 6
+    assert stats.n_clauses == len(texpr.children) and stats.max_width == 3
+    assert set(stats.timings) == {'deepen', 'encode', 'flatten', 'reduce'}
+    assert stats.n_nodes > len(post_order(expr)) and stats.n_xors == 0
+    assert stats.as_dict()['n_literals'] == stats.n_literals
+
+    cnf, out, stats = Tseytin_encode(expr, with_stats=True)
+    assert (stats.n_vars, stats.n_clauses, stats.n_literals) == (cnf.n_vars, cnf.n_clauses, cnf.n_literals)
+    assert stats.gates == {'And': 2, 'Or': 1, 'Xor': 1}
+    assert list(stats.timings) == ['encode']
+    cnf, out, stats = Tseytin_encode(Or(expr, parse_python('A ^ B ^ D')), native_xor=True, with_stats=True)
+    assert (stats.n_clauses, stats.n_xors) == (cnf.n_clauses, cnf.n_xors) and stats.n_xors == 2
+
+    # hooks see every encoding, asked for or not
+    seen = []
+    stats_hooks.append(seen.append)
+    Tseytin_encode(expr)
+    Tseytin_transformation(expr.clone())
+    cnf, outs = Tseytin_encode_many([expr, Var('D')])
+    stats_hooks.remove(seen.append)
+    assert len(seen) == 3 and all(type(s) == TseytinStats for s in seen)
+    assert seen[0].n_clauses == cnf.n_clauses
+    Tseytin_encode(expr)
+    assert len(seen) == 3
+
+    print('pass')
@@ -1,9 +1,20 @@
 # TEST WITH: python -m curiousbits.graphs.nxtools
 
-import random
-from subprocess import Popen, PIPE
+import importlib
 
-import networkx as nx
+# networkx takes longer to import than the rest of curiousbits combined, so
+# it's loaded on first use of nx.<anything>
+class LazyModule(object):
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module == None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+nx = LazyModule('networkx')
 
 #------------------------------------------------------------------------------
 # graphviz integration
@@ -49,7 +60,8 @@ def gen_dot(G, f_node_attrs=None, f_edge_attrs=None, f_extra=None):
 # fpath:        path to output file
 # f_node_attrs: function to return additional node attributes
 # f_edge_attrs: function to return additional edge attributes
-def draw(G, fpath, f_node_attrs=None, f_edge_attrs=None, f_extra=None, verbose=False):
+# timeout:      seconds to allow dot, None for no limit
+def draw(G, fpath, f_node_attrs=None, f_edge_attrs=None, f_extra=None, verbose=False, timeout=None):
     dot = gen_dot(G, f_node_attrs, f_edge_attrs, f_extra)
 
     if fpath.endswith('.svg'):
@@ -64,13 +76,10 @@ def draw(G, fpath, f_node_attrs=None, f_edge_attrs=None, f_extra=None, verbose=F
     if verbose:
         print('cmd: ' + ' '.join(cmd))
 
-    process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout, stderr) = process.communicate(dot.encode('utf-8'))
-    stdout = stdout.decode('utf-8')
-    stderr = stderr.decode('utf-8')
+    from ..procpool import default_pool
+    (stdout, stderr) = default_pool().run(cmd, dot, timeout)
     #print('stdout: -%s-' % stdout)
     #print('stderr: -%s-' % stderr)
-    process.wait()
 
 #------------------------------------------------------------------------------
 # generate graphs
@@ -79,6 +88,8 @@ def draw(G, fpath, f_node_attrs=None, f_edge_attrs=None, f_extra=None, verbose=F
 # CFG with single entry, single exit (SESE)
 # https://en.wikipedia.org/wiki/Single-entry_single-exit
 def gen_SESE(num_nodes):
+    import random
+
     G = nx.gnp_random_graph(num_nodes, 2*1/num_nodes, seed=None, directed=True)
 
     #print('-- removing unconnected nodes')
@@ -0,0 +1,327 @@
+# bounded pool for running external tools (espresso, dot, sat solvers)
+#
+# The tools we drive read their whole problem from stdin and only answer at
+# EOF, so every job is still its own process. What the pool adds is a fixed
+# number of slots shared by everyone (no fork bombs when minimizing thousands
+# of functions), long-lived worker threads, batching and timeouts, with a
+# concurrent.futures front-end (submit/map) and an asyncio one (run_async/map_async).
+#
+# TEST WITH: python -m curiousbits.procpool
+
+import os
+import weakref
+import threading
+import subprocess
+
+# asyncio and concurrent.futures are imported where used, they dominate the
+# import time of this module and most callers only ever need run()
+
+class ProcessPool(object):
+    # max_workers: number of processes allowed to run at once
+    # timeout: default seconds allowed per job, None for no limit
+    def __init__(self, max_workers=None, timeout=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        # asyncio semaphores belong to an event loop, keep one per loop
+        self._async_slots = weakref.WeakKeyDictionary()
+
+    #--------------------------------------------------------------------------
+    # blocking
+    #--------------------------------------------------------------------------
+
+    # run cmd with input_text on stdin, returns (stdout, stderr) as str
+    # raises subprocess.TimeoutExpired (after killing the child) on timeout
+    def run(self, cmd, input_text=None, timeout=None):
+        if timeout == None:
+            timeout = self.timeout
+        if type(input_text) == str:
+            input_text = input_text.encode('utf-8')
+
+        with self._slots:
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                (stdout, stderr) = process.communicate(input=input_text, timeout=timeout)
+            except BaseException:
+                process.kill()
+                process.communicate()
+                raise
+
+        return (stdout.decode('utf-8'), stderr.decode('utf-8'))
+
+    #--------------------------------------------------------------------------
+    # concurrent.futures
+    #--------------------------------------------------------------------------
+
+    def executor(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with self._lock:
+            if self._executor == None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='procpool')
+            return self._executor
+
+    # returns a concurrent.futures.Future resolving to (stdout, stderr)
+    def submit(self, cmd, input_text=None, timeout=None):
+        return self.executor().submit(self.run, cmd, input_text, timeout)
+
+    # run cmd once per input, returns [(stdout, stderr), ...] in input order
+    #
+    # batch_size: inputs handed to a worker thread at a time, larger batches
+    # mean less scheduling overhead for many tiny jobs
+    def map(self, cmd, inputs, timeout=None, batch_size=1):
+        def run_batch(batch):
+            return [self.run(cmd, input_text, timeout) for input_text in batch]
+
+        inputs = list(inputs)
+        batches = [inputs[i:i+batch_size] for i in range(0, len(inputs), batch_size)]
+        futures = [self.executor().submit(run_batch, batch) for batch in batches]
+
+        result = []
+        for future in futures:
+            result.extend(future.result())
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._executor != None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #--------------------------------------------------------------------------
+    # asyncio
+    #--------------------------------------------------------------------------
+
+    # async context manager holding one of the slots run() takes, so blocking
+    # and asyncio callers together stay within max_workers
+    def async_slots(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        sem = self._async_slots.get(loop)
+        if sem == None:
+            sem = asyncio.Semaphore(self.max_workers)
+            self._async_slots[loop] = sem
+        return AsyncSlot(self._slots, sem)
+
+    # like run(), but the child is killed if the awaiting task is cancelled
+    async def run_async(self, cmd, input_text=None, timeout=None):
+        import asyncio
+
+        if timeout == None:
+            timeout = self.timeout
+        if type(input_text) == str:
+            input_text = input_text.encode('utf-8')
+
+        async with self.async_slots():
+            process = await asyncio.create_subprocess_exec(*cmd,
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            try:
+                (stdout, stderr) = await asyncio.wait_for(process.communicate(input_text), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            except BaseException:
+                process.kill()
+                await process.wait()
+                raise
+
+        return (stdout.decode('utf-8'), stderr.decode('utf-8'))
+
+    async def map_async(self, cmd, inputs, timeout=None):
+        import asyncio
+
+        return await asyncio.gather(*[self.run_async(cmd, input_text, timeout) for input_text in inputs])
+
+# a slot of a pool for a coroutine: tasks first queue on an asyncio semaphore
+# of the same size (no thread each), then take the pool's own slot, waiting
+# on a thread only while blocking callers hold them all
+class AsyncSlot(object):
+    def __init__(self, slots, queue):
+        self.slots = slots
+        self.queue = queue
+
+    async def __aenter__(self):
+        await self.queue.acquire()
+        try:
+            if not self.slots.acquire(blocking=False):
+                await self.wait()
+        except BaseException:
+            self.queue.release()
+            raise
+        return self
+
+    async def wait(self):
+        import asyncio
+
+        # the thread polls so that a cancelled wait does not leave it blocked
+        # (asyncio.run() waits for executor threads on the way out), whichever
+        # of it and the cancellation comes second gives the slot back
+        lock = threading.Lock()
+        state = {'acquired': False, 'abandoned': False}
+        def acquire():
+            while True:
+                got = self.slots.acquire(timeout=0.05)
+                with lock:
+                    if state['abandoned']:
+                        if got:
+                            self.slots.release()
+                        return
+                    if got:
+                        state['acquired'] = True
+                        return
+
+        future = asyncio.get_running_loop().run_in_executor(None, acquire)
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            with lock:
+                state['abandoned'] = True
+                if state['acquired']:
+                    self.slots.release()
+            raise
+
+    async def __aexit__(self, *args):
+        self.slots.release()
+        self.queue.release()
+
+# the pool shared by tools.shellout(), sat_solve.call_solver(), etc.
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def default_pool():
+    global _default_pool
+    if _default_pool == None:
+        # two threads must not each make one, the limit is per pool
+        with _default_pool_lock:
+            if _default_pool == None:
+                _default_pool = ProcessPool()
+    return _default_pool
+
+#------------------------------------------------------------------------------
+# tests
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    import sys
+    import time
+    import asyncio
+
+    # stand-in tools
+    upper = [sys.executable, '-c', 'import sys; sys.stdout.write(sys.stdin.read().upper())']
+    sleeper = [sys.executable, '-c', 'import time; time.sleep(0.5)']
+    stderr_tool = [sys.executable, '-c', 'import sys; sys.stderr.write("oops")']
+
+    pool = ProcessPool(max_workers=2)
+
+    print('-------- run')
+    assert pool.run(upper, 'hello') == ('HELLO', '')
+    assert pool.run(upper, b'bytes') == ('BYTES', '')
+    assert pool.run(stderr_tool) == ('', 'oops')
+
+    print('-------- timeout')
+    t0 = time.time()
+    try:
+        pool.run([sys.executable, '-c', 'import time; time.sleep(10)'], timeout=0.2)
+        assert False
+    except subprocess.TimeoutExpired:
+        pass
+    assert time.time() - t0 < 5
+
+    print('-------- submit, map, batching')
+    assert pool.submit(upper, 'abc').result() == ('ABC', '')
+    inputs = [f'job{i}' for i in range(10)]
+    expected = [(f'JOB{i}', '') for i in range(10)]
+    assert pool.map(upper, inputs) == expected
+    assert pool.map(upper, inputs, batch_size=3) == expected
+
+    print('-------- bounded concurrency')
+    t0 = time.time()
+    pool.map(sleeper, [None]*4)
+    assert time.time() - t0 >= 1.0
+
+    print('-------- asyncio')
+    async def main():
+        assert await pool.run_async(upper, 'async') == ('ASYNC', '')
+        assert await pool.map_async(upper, inputs) == expected
+
+        try:
+            await pool.run_async([sys.executable, '-c', 'import time; time.sleep(10)'], timeout=0.2)
+            assert False
+        except subprocess.TimeoutExpired:
+            pass
+
+        # cancellation kills the child
+        task = asyncio.ensure_future(pool.run_async([sys.executable, '-c', 'import time; time.sleep(10)']))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        try:
+            await task
+            assert False
+        except asyncio.CancelledError:
+            pass
+
+        t0 = time.time()
+        await pool.map_async(sleeper, [None]*4)
+        assert time.time() - t0 >= 1.0
+
+        # blocking and asyncio callers share the slots
+        t0 = time.time()
+        futures = [pool.submit(sleeper) for i in range(2)]
+        await pool.map_async(sleeper, [None]*2)
+        for future in futures:
+            future.result()
+        assert time.time() - t0 >= 1.0
+        assert pool._slots.acquire(blocking=False) and pool._slots.acquire(blocking=False)
+        pool._slots.release()
+        pool._slots.release()
+
+    asyncio.run(main())
+
+    print('-------- cancelled while blocking callers hold every slot')
+    async def cancelled():
+        task = asyncio.ensure_future(pool.run_async(upper, 'never'))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        try:
+            await task
+            assert False
+        except asyncio.CancelledError:
+            pass
+
+    for i in range(2):
+        pool._slots.acquire()
+    # in case the waiting thread does hang, let asyncio.run() return anyway
+    safety = threading.Timer(10, lambda: [pool._slots.release() for i in range(2)])
+    safety.start()
+    t0 = time.time()
+    asyncio.run(cancelled())
+    assert time.time() - t0 < 2
+    safety.cancel()
+    pool._slots.release()
+    pool._slots.release()
+    assert pool._slots.acquire(blocking=False) and pool._slots.acquire(blocking=False)
+    assert not pool._slots.acquire(blocking=False)
+    pool._slots.release()
+    pool._slots.release()
+
+    print('-------- one default pool')
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(default_pool())) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(p is pools[0] for p in pools) and default_pool() is pools[0]
+
+    pool.close()
+    print('pass')
@@ -44,4 +44,54 @@ if __name__ == '__main__':
             vnames = expr0.varnames()
             assert batools.to_truth_indices(expr0, vnames) == batools.to_truth_indices(expr1, vnames)
 
+    if what in ['all', 'import-time']:
+        import subprocess
+
+        # (module, budget in milliseconds, modules it must not drag in)
+        #
+        # budgets are loose enough to hold without cached bytecode, they catch
+        # an eager import of networkx/asyncio/etc. rather than small drift
+        heavy = ['networkx', 'asyncio', 'concurrent.futures', 'subprocess', 'ast', 'random']
+        budgets = [
+            ('curiousbits.boolalg.expr', 60, heavy),
+            ('curiousbits.boolalg.cnf', 80, heavy),
+            ('curiousbits.boolalg.tools', 100, heavy),
+            ('curiousbits.boolalg.tseytin', 120, heavy),
+            ('curiousbits.boolalg.sat_solve', 120, heavy),
+            ('curiousbits.boolalg.components', 120, heavy),
+            ('curiousbits.boolalg.simplify_espresso', 120, heavy),
+            ('curiousbits.boolalg.simplify_qm', 120, heavy),
+            ('curiousbits.boolalg.cdcl', 60, heavy),
+            ('curiousbits.boolalg.dimacs', 60, heavy),
+            ('curiousbits.boolalg.preprocess', 100, heavy),
+            ('curiousbits.boolalg.cardinality', 60, heavy),
+            ('curiousbits.boolalg.pseudo_boolean', 60, heavy),
+            ('curiousbits.boolalg.model_count', 100, heavy),
+            ('curiousbits.boolalg.cache', 100, heavy),
+            ('curiousbits.boolalg.portfolio', 100, ['networkx', 'asyncio', 'concurrent.futures', 'ast', 'random']),
+            ('curiousbits.graphs.nxtools', 60, heavy),
+            ('curiousbits.math.combinatorics', 30, heavy),
+            ('curiousbits.procpool', 100, ['asyncio', 'concurrent.futures']),
+        ]
+
+        for (module, budget, forbidden) in budgets:
+            # no side effects at import time, nothing printed
+            script = f'import sys, {module}; print(\' \'.join(sys.modules))'
+            (stdout, stderr) = batools.shellout([sys.executable, '-c', script])
+            loaded = set(stdout.split())
+            assert module in loaded, stderr
+            for name in forbidden:
+                assert not name in loaded, f'importing {module} imports {name}'
+
+            # best of 3, cumulative microseconds from the line ending in the module name
+            best = None
+            for i in range(3):
+                (stdout, stderr) = batools.shellout([sys.executable, '-X', 'importtime', '-c', f'import {module}'])
+                line = [l for l in stderr.splitlines() if l.split('|')[-1].strip() == module][0]
+                usecs = int(line.split('|')[1])
+                best = usecs if best == None else min(best, usecs)
+
+            print(f'{module}: {best/1000:.1f}ms (budget {budget}ms)')
+            assert best / 1000 <= budget, f'importing {module} took {best/1000:.1f}ms, over budget of {budget}ms'
+
     print('pass')
@@ -5,9 +5,20 @@ set -e # exit when any command fails
 
 python -m curiousbits.boolalg.expr
 python -m curiousbits.boolalg.tools
+python -m curiousbits.boolalg.cnf
+python -m curiousbits.boolalg.dimacs
+python -m curiousbits.boolalg.cardinality
+python -m curiousbits.boolalg.pseudo_boolean
+python -m curiousbits.boolalg.preprocess
+python -m curiousbits.boolalg.cdcl
 python -m curiousbits.boolalg.tseytin
 python -m curiousbits.boolalg.sat_solve
+python -m curiousbits.boolalg.portfolio
+python -m curiousbits.boolalg.cache
+python -m curiousbits.boolalg.model_count
 python -m curiousbits.boolalg.components
 python -m curiousbits.boolalg.simplify_espresso
 python -m curiousbits.boolalg.simplify_qm
 python -m curiousbits.graphs.nxtools
+python -m curiousbits.procpool
+python ./test.py import-time